@@ -21,7 +21,7 @@ import struct
 import sys
 from asyncio import Queue, Task
 from asyncio.streams import FlowControlMixin, StreamReader, StreamWriter
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
 import attr
 import cattr
@@ -175,10 +175,29 @@ class Channel:
 
 
 class ChanProHead:
-    def __init__(self, chanpro: ChanPro, channel0: Channel):
+    def __init__(
+        self,
+        chanpro: ChanPro,
+        channel0: Channel,
+        on_telemetry: Optional[Callable[[dict], None]] = None,
+    ):
         self._chanpro = chanpro
         self._channel0 = channel0
         self._next_channel_id = 1
+        self._on_telemetry = on_telemetry
+        self._root_listener = asyncio.create_task(self._listen_to_root())
+
+    async def _listen_to_root(self):
+        while True:
+            try:
+                message = await self._channel0.recv()
+            except EOFError:
+                return
+            if isinstance(message, dict) and "telemetry" in message:
+                if self._on_telemetry:
+                    self._on_telemetry(message["telemetry"])
+            else:
+                logger.warning("Unexpected message on root channel: %r", message)
 
     async def start_command_channel(self, command: str, payload: Any) -> Channel:
         new_channel = self._chanpro.new_channel(self._next_channel_id, command)
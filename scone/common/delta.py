@@ -0,0 +1,172 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+rsync-style delta encoding.
+
+The receiver, which has an old copy of a file, computes a weak rolling checksum
+(Adler-32) and a strong hash of each block of that copy.
+The sender, which has the new content, slides a window over it looking for
+blocks that the receiver already has, and produces a delta: a list of literal
+byte strings and [first block, number of blocks] references.
+"""
+
+import math
+import zlib
+from hashlib import blake2b
+from typing import BinaryIO, Dict, List, Optional, Union
+
+import attr
+
+_ADLER_MOD = 65521
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+
+# literal runs are sent in chunks of at most this size
+MAX_LITERAL_CHUNK = 1024 * 1024
+
+# a literal run of bytes, or a [first block index, block count] reference.
+DeltaInstruction = Union[bytes, List[int]]
+
+
+@attr.s(auto_attribs=True)
+class BlockSignatures:
+    block_size: int
+    # Adler-32 of each complete block
+    weak: List[int]
+    # truncated BLAKE2b of each complete block
+    strong: List[bytes]
+
+
+def choose_block_size(size: int) -> int:
+    """
+    Chooses a block size of about the square root of the file size (as rsync
+    does), rounded to a multiple of 1 KiB.
+    """
+    block_size = (int(math.sqrt(size)) // 1024) * 1024
+    return min(max(block_size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def strong_hash(block: bytes) -> bytes:
+    return blake2b(block, digest_size=16).digest()
+
+
+def compute_signatures(file: BinaryIO, block_size: int) -> BlockSignatures:
+    """
+    Computes the signatures of each complete block of a file.
+    (A trailing partial block is always sent as a literal instead.)
+    """
+    signatures = BlockSignatures(block_size, [], [])
+    while True:
+        block = file.read(block_size)
+        if len(block) < block_size:
+            break
+        signatures.weak.append(zlib.adler32(block))
+        signatures.strong.append(strong_hash(block))
+    return signatures
+
+
+def _literal_chunks(data: bytes, start: int, end: int) -> List[bytes]:
+    return [
+        data[pos : min(pos + MAX_LITERAL_CHUNK, end)]
+        for pos in range(start, end, MAX_LITERAL_CHUNK)
+    ]
+
+
+def literal_delta(data: bytes) -> List[DeltaInstruction]:
+    """
+    A delta that sends all of data literally.
+    """
+    delta: List[DeltaInstruction] = []
+    delta.extend(_literal_chunks(data, 0, len(data)))
+    return delta
+
+
+def compute_delta(
+    data: bytes, signatures: BlockSignatures, max_literal: Optional[int] = None
+) -> Optional[List[DeltaInstruction]]:
+    """
+    Computes the delta that turns the receiver's old file into data.
+
+    CPU-bound; best run in a process pool.
+
+    :param max_literal: give up, returning None, once more than this many
+        literal bytes would be needed. (It would then be cheaper to send
+        the whole file than to keep searching.)
+    """
+    block_size = signatures.block_size
+    by_weak: Dict[int, List[int]] = {}
+    for index, weak in enumerate(signatures.weak):
+        by_weak.setdefault(weak, []).append(index)
+
+    delta: List[DeltaInstruction] = []
+    literal_bytes = 0
+    literal_start = 0
+    pos = 0
+    end = len(data)
+    weak_a: Optional[int] = None
+    weak_b = 0
+
+    while pos + block_size <= end:
+        if weak_a is None:
+            checksum = zlib.adler32(data[pos : pos + block_size])
+            weak_a = checksum & 0xFFFF
+            weak_b = checksum >> 16
+
+        match: Optional[int] = None
+        candidates = by_weak.get((weak_b << 16) | weak_a)
+        if candidates is not None:
+            strong = strong_hash(data[pos : pos + block_size])
+            for candidate in candidates:
+                if signatures.strong[candidate] == strong:
+                    match = candidate
+                    break
+
+        if match is not None:
+            if literal_start < pos:
+                delta += _literal_chunks(data, literal_start, pos)
+            previous = delta[-1] if delta else None
+            if isinstance(previous, list) and sum(previous) == match:
+                # extends the previous run of blocks
+                previous[1] += 1
+            else:
+                delta.append([match, 1])
+            pos += block_size
+            literal_start = pos
+            weak_a = None
+            continue
+
+        literal_bytes += 1
+        if max_literal is not None and literal_bytes > max_literal:
+            return None
+
+        # roll the window along by one byte
+        if pos + block_size < end:
+            out_byte = data[pos]
+            in_byte = data[pos + block_size]
+            weak_a = (weak_a - out_byte + in_byte) % _ADLER_MOD
+            weak_b = (weak_b - block_size * out_byte + weak_a - 1) % _ADLER_MOD
+        pos += 1
+
+    if literal_start < end:
+        literal_bytes += end - pos
+        if max_literal is not None and literal_bytes > max_literal:
+            return None
+        delta += _literal_chunks(data, literal_start, end)
+
+    return delta
@@ -0,0 +1,149 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Hash algorithms for change detection.
+
+Digests are tagged with their algorithm, as in "blake2b:0123…", so that
+digests stored with one algorithm are recognised as incomparable (rather than
+as a change) when the configured algorithm changes.
+An untagged digest is a legacy SHA-256 digest.
+
+Integrity checks (e.g. of supermarket downloads) use plain SHA-256 instead.
+"""
+
+import hashlib
+import os
+from typing import Any, Callable, Tuple
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+SHA256 = "sha256"
+BLAKE2B = "blake2b"
+# only available if xxhash is installed (on both the head and the sous)
+XXH128 = "xxh128"
+
+ALGORITHMS = (SHA256, BLAKE2B, XXH128)
+
+DEFAULT_CHANGE_ALGORITHM = BLAKE2B
+
+# Digests of files modified this recently (in ns) before being hashed are not
+# cached, as a further write within the same mtime granularity would not be
+# noticed (the 'racy clean' problem).
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+_READ_SIZE = 8192 * 1024
+
+
+def new_hasher(algorithm: str) -> Any:
+    if algorithm == SHA256:
+        return hashlib.sha256()
+    elif algorithm == BLAKE2B:
+        return hashlib.blake2b(digest_size=32)
+    elif algorithm == XXH128:
+        if xxhash is None:
+            raise RuntimeError("xxh128 hashing needs xxhash to be installed.")
+        return xxhash.xxh3_128()
+    else:
+        raise ValueError(f"Unknown hash algorithm {algorithm!r}")
+
+
+def check_algorithm(algorithm: str) -> str:
+    """
+    Raises if the algorithm is unknown or unavailable here.
+    """
+    new_hasher(algorithm)
+    return algorithm
+
+
+def tag(algorithm: str, hexdigest: str) -> str:
+    return f"{algorithm}:{hexdigest}"
+
+
+def untag(digest: str) -> Tuple[str, str]:
+    """
+    :return: (algorithm, hex digest)
+    """
+    algorithm, colon, hexdigest = digest.partition(":")
+    if not colon:
+        return SHA256, digest
+    return algorithm, hexdigest
+
+
+def algorithm_of(digest: str) -> str:
+    return untag(digest)[0]
+
+
+def normalise(digest: str) -> str:
+    """
+    Tags a legacy untagged digest.
+    """
+    return tag(*untag(digest))
+
+
+def hash_bytes(data: bytes, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    hasher.update(data)
+    return tag(algorithm, hasher.hexdigest())
+
+
+def hash_file(path: str, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    with open(path, "rb") as fread:
+        while True:
+            data = fread.read(_READ_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return tag(algorithm, hasher.hexdigest())
+
+
+FileHasher = Callable[[str, str], str]
+
+
+def hash_dir(path: str, algorithm: str, file_hasher: FileHasher = hash_file) -> str:
+    """
+    Hashes a directory tree by the names and digests of its entries.
+
+    :param file_hasher: hashes each file, given its path and the algorithm.
+    """
+    items = {}
+    with os.scandir(path) as scandir:
+        for dir_entry in scandir:
+            if dir_entry.is_dir():
+                items[dir_entry.name] = hash_dir(dir_entry.path, algorithm, file_hasher)
+            else:
+                items[dir_entry.name] = file_hasher(dir_entry.path, algorithm)
+    hasher = new_hasher(algorithm)
+    for fname, fhash in sorted(items.items()):
+        hasher.update(fname.encode())
+        hasher.update(b"\0")
+        hasher.update(fhash.encode())
+        hasher.update(b"\0")
+    return tag(algorithm, hasher.hexdigest())
+
+
+def hash_path(path: str, algorithm: str, file_hasher: FileHasher = hash_file) -> str:
+    """
+    Hashes a file or a directory tree.
+    """
+    if os.path.isdir(path):
+        return hash_dir(path, algorithm, file_hasher)
+    return file_hasher(path, algorithm)
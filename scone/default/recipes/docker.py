@@ -1,13 +1,23 @@
+import logging
+import time
+
+from scone.default.steps.docker_steps import pull_docker_image
 from scone.default.utensils.docker_utensils import (
     DockerContainerRun,
-    DockerImagePull,
+    DockerImageInspect,
     DockerNetworkCreate,
     DockerVolumeCreate,
+    image_reference,
 )
 from scone.head.kitchen import Kitchen
 from scone.head.recipe import Recipe, RecipeContext
 from scone.head.utils import check_type, check_type_opt
 
+logger = logging.getLogger(__name__)
+
+# how long (seconds) a pulled tag is trusted before checking the registry again
+DEFAULT_TAG_TTL = 3600
+
 
 class DockerContainer(Recipe):
     _NAME = "docker-container"
@@ -32,13 +42,52 @@ class DockerImage(Recipe):
         super().__init__(recipe_context, args, head)
 
         self.repository = check_type(args.get("repository"), str)
-        self.tag = check_type(args.get("tag"), str)
+        self.tag = check_type_opt(args.get("tag"), str)
+        # pinned digest, e.g. sha256:…
+        self.digest = check_type_opt(args.get("digest"), str)
+        # seconds before a tag is pulled again; 0 to always pull
+        self.ttl = check_type(args.get("ttl", DEFAULT_TAG_TTL), int)
+
+        if self.digest is None and self.tag is None:
+            raise ValueError("docker-image needs a tag or a digest.")
+        if self.digest is not None and not self.digest.startswith("sha256:"):
+            raise ValueError(f"Digest {self.digest!r} should start with sha256:")
 
     async def cook(self, kitchen: Kitchen) -> None:
-        kitchen.get_dependency_tracker()
-        await kitchen.ut1areq(
-            DockerImagePull(self.repository, self.tag), DockerImagePull.Result
-        )
+        tracker = kitchen.get_dependency_tracker()
+
+        if self.digest is not None:
+            # content-addressed: if we have it, it can't be stale.
+            reference = image_reference(self.repository, self.digest)
+            present = await kitchen.ut1a(
+                DockerImageInspect(reference), DockerImageInspect.Result
+            )
+            if present is None:
+                await pull_docker_image(kitchen, self.repository, self.digest)
+            else:
+                logger.debug("%s already present; not pulling", reference)
+            return
+
+        assert self.tag is not None
+        # the tag may have moved on in the registry, so always check (below)
+        tracker.ignore()
+        reference = image_reference(self.repository, self.tag)
+        previous = await kitchen.get_previous_cache_data()
+        pulled_at = previous.get("pulled_at")
+        if pulled_at is not None and time.time() < pulled_at + self.ttl:
+            present = await kitchen.ut1a(
+                DockerImageInspect(reference), DockerImageInspect.Result
+            )
+            # the image must still be the one we pulled (not removed or retagged)
+            if present is not None and present.id == previous.get("image_id"):
+                logger.debug("%s pulled recently; not pulling", reference)
+                tracker.set_cache_data("pulled_at", pulled_at)
+                tracker.set_cache_data("image_id", present.id)
+                return
+
+        result = await pull_docker_image(kitchen, self.repository, self.tag)
+        tracker.set_cache_data("pulled_at", time.time())
+        tracker.set_cache_data("image_id", result.id)
 
 
 class DockerVolume(Recipe):
@@ -19,16 +19,15 @@ from pathlib import Path
 from typing import List
 
 from scone.common.modeutils import DEFAULT_MODE_DIR, parse_mode
-from scone.default.steps.basic_steps import exec_no_fails
-from scone.default.steps.filesystem_steps import depend_remote_file
-from scone.default.utensils.basic_utensils import (
-    Chmod,
-    Chown,
-    MakeDirectory,
-    SimpleExec,
-    Stat,
+from scone.default.steps.basic_steps import exec_no_fails, exec_streaming
+from scone.default.steps.filesystem_steps import (
+    apply_fs_transaction,
+    depend_remote_file,
+    stat_many,
 )
+from scone.default.utensils.basic_utensils import SimpleExec, Stat
 from scone.default.utensils.dynamic_dependencies import HasChangedInSousStore
+from scone.default.utensils.filesystem_utensils import FsOperation
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen, Preparation
 from scone.head.recipe import Recipe, RecipeContext
@@ -109,25 +108,19 @@ class EnsureDirectory(Recipe):
         self._make.reverse()
 
     async def cook(self, k: Kitchen):
-        for directory in self._make:
-            stat = await k.ut1a(Stat(directory), Stat.Result)
-            if stat is None:
-                # doesn't exist, make it
-                await k.ut0(MakeDirectory(directory, self.mode))
-
-            stat = await k.ut1a(Stat(directory), Stat.Result)
-            if stat is None:
-                raise RuntimeError("Directory vanished after creation!")
-
-            if stat.dir:
-                if (stat.user, stat.group) != (self.targ_user, self.targ_group):
-                    # need to chown
-                    await k.ut0(Chown(directory, self.targ_user, self.targ_group))
-
-                if stat.mode != self.mode:
-                    await k.ut0(Chmod(directory, self.mode))
-            else:
-                raise RuntimeError("Already exists but not a dir: " + directory)
+        await apply_fs_transaction(
+            k,
+            [
+                FsOperation(
+                    "directory",
+                    directory,
+                    mode=self.mode,
+                    user=self.targ_user,
+                    group=self.targ_group,
+                )
+                for directory in self._make
+            ],
+        )
 
         # mark as tracked.
         k.get_dependency_tracker()
@@ -157,18 +150,15 @@ class ExtractTar(Recipe):
             preparation.provides("file", final)
 
     async def cook(self, k: "Kitchen"):
-        res = await k.ut1areq(
-            SimpleExec(["tar", "xf", self.tar], self.dir), SimpleExec.Result
-        )
+        res = await exec_streaming(k, ["tar", "xf", self.tar], self.dir)
         if res.exit_code != 0:
             raise RuntimeError(
                 f"tar failed with ec {res.exit_code}; stderr = <<<"
-                f"\n{res.stderr.decode()}\n>>>"
+                f"\n{res.stderr.decode(errors='replace')}\n>>>"
             )
 
-        for expect_relative in self.expect_files:
-            expect = str(Path(self.dir, expect_relative))
-            stat = await k.ut1a(Stat(expect), Stat.Result)
+        expects = [str(Path(self.dir, relative)) for relative in self.expect_files]
+        for expect, stat in zip(expects, await stat_many(k, expects)):
             if stat is None:
                 raise RuntimeError(
                     f"tar succeeded but expectation failed; {expect!r} not found."
@@ -229,7 +219,9 @@ class CommandOnChange(Recipe):
     async def cook(self, kitchen: Kitchen) -> None:
         kitchen.get_dependency_tracker().ignore()
 
-        changed = await kitchen.ut1(HasChangedInSousStore(self.purpose, self.watching))
+        changed = await kitchen.ut1(
+            HasChangedInSousStore(self.purpose, self.watching, kitchen.head.change_hash)
+        )
 
         if changed:
             result = await kitchen.ut1areq(
@@ -281,8 +273,12 @@ class GitCheckout(Recipe):
                 preparation.provides("file", expected_path_str)
 
     async def cook(self, k: Kitchen) -> None:
-        # no non-arg dependencies
-        k.get_dependency_tracker()
+        if self.branch:
+            # the branch may have moved on since we last fetched it
+            k.get_dependency_tracker().ignore()
+        else:
+            # no non-arg dependencies
+            k.get_dependency_tracker()
 
         stat = await k.ut1a(Stat(self.dest_dir), Stat.Result)
         if stat is None:
@@ -307,7 +303,7 @@ class GitCheckout(Recipe):
         )
 
         # fetch the latest from the remote
-        await exec_no_fails(k, ["git", "fetch", "scone"], self.dest_dir)
+        await exec_no_fails(k, ["git", "fetch", "scone"], self.dest_dir, streaming=True)
 
         # figure out what ref we want to use
         # TODO(performance): fetch only this ref?
@@ -322,12 +318,16 @@ class GitCheckout(Recipe):
                 k,
                 ["git", "submodule", "update", "--init", "--recursive"],
                 self.dest_dir,
+                streaming=True,
             )
 
-        for expected in self.expect:
-            expected_path_str = str(Path(self.dest_dir, expected))
-            # TODO(performance, low): parallelise these
-            stat = await k.ut1a(Stat(expected_path_str), Stat.Result)
+        expected_path_strs = [
+            str(Path(self.dest_dir, expected)) for expected in self.expect
+        ]
+        stats = await stat_many(k, expected_path_strs)
+        for expected, expected_path_str, stat in zip(
+            self.expect, expected_path_strs, stats
+        ):
             if not stat:
                 raise RuntimeError(
                     f"expected {expected_path_str} to exist but it did not"
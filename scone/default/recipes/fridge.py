@@ -20,20 +20,31 @@ import logging
 import os
 from asyncio import Future
 from pathlib import Path
-from typing import Dict, cast
+from typing import Dict, List, Set, cast
 from urllib.parse import urlparse
 
 import requests
 
-from scone.common.misc import sha256_file
-from scone.common.modeutils import DEFAULT_MODE_FILE, parse_mode
+from scone.common.misc import sha256_bytes, sha256_file
+from scone.common.modeutils import DEFAULT_MODE_DIR, DEFAULT_MODE_FILE, parse_mode
 from scone.default.steps import fridge_steps
+from scone.default.steps.filesystem_steps import (
+    DELTA_MIN_SIZE,
+    apply_fs_transaction,
+    write_file,
+)
 from scone.default.steps.fridge_steps import (
     SUPERMARKET_RELATIVE,
     FridgeMetadata,
     load_and_transform,
 )
-from scone.default.utensils.basic_utensils import Chmod, Chown, HashFile, WriteFile
+from scone.default.utensils.filesystem_utensils import (
+    FS_DIFFERS,
+    FS_MISSING,
+    DirectoryManifest,
+    FsOperation,
+    ManifestEntry,
+)
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen, Preparation
 from scone.head.recipe import Recipe, RecipeContext
@@ -90,17 +101,183 @@ class FridgeCopy(Recipe):
             k, self.fridge_meta, self.real_path, self.recipe_context.sous
         )
         dest_str = str(self.destination)
-        chan = await k.start(WriteFile(dest_str, self.mode))
-        await chan.send(data)
-        await chan.send(None)
-        if await chan.recv() != "OK":
-            raise RuntimeError(f"WriteFail failed on fridge-copy to {self.destination}")
+        if len(data) < DELTA_MIN_SIZE:
+            # only written if the content differs
+            await apply_fs_transaction(
+                k, [FsOperation("file", dest_str, mode=self.mode, content=data)]
+            )
+        else:
+            # don't send large files unless they differ, and then only a delta
+            (outcome,) = await apply_fs_transaction(
+                k,
+                [
+                    FsOperation(
+                        "file", dest_str, mode=self.mode, sha256=sha256_bytes(data)
+                    )
+                ],
+            )
+            if outcome in (FS_DIFFERS, FS_MISSING):
+                await write_file(k, dest_str, data, self.mode)
 
         # this is the wrong thing
         # hash_of_data = sha256_bytes(data)
         # k.get_dependency_tracker().register_remote_file(dest_str, hash_of_data)
 
-        k.get_dependency_tracker().register_fridge_file(self._desugared_src)
+        k.get_dependency_tracker().register_fridge_file(
+            self._desugared_src, self.real_path
+        )
+
+
+class FridgeSync(Recipe):
+    """
+    Declares that a directory on the sous should mirror a directory in the
+    fridge. Only new or changed files are sent.
+    """
+
+    _NAME = "fridge-sync"
+
+    # maximum size of the file contents carried by one transaction
+    BATCH_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, recipe_context: RecipeContext, args: dict, head: Head):
+        super().__init__(recipe_context, args, head)
+
+        src = check_type(args.get("src"), str)
+        search = fridge_steps.search_in_fridge(head, src)
+        if search is None or not search[1].is_dir():
+            raise ValueError(f"Cannot find directory {src} in the fridge.")
+
+        self._desugared_src, self.real_path = search
+        self.destination = str(Path(check_type(args.get("dest"), str)))
+
+        mode = args.get("mode", DEFAULT_MODE_FILE)
+        assert isinstance(mode, str) or isinstance(mode, int)
+        self.mode = parse_mode(mode, directory=False)
+
+        dir_mode = args.get("dir_mode", DEFAULT_MODE_DIR)
+        assert isinstance(dir_mode, str) or isinstance(dir_mode, int)
+        self.dir_mode = parse_mode(dir_mode, directory=True)
+
+        # whether to delete files on the sous that are not in the fridge
+        self.delete = check_type(args.get("delete", False), bool)
+
+    def prepare(self, preparation: Preparation, head: Head) -> None:
+        super().prepare(preparation, head)
+        preparation.provides("directory", self.destination)
+        preparation.needs("directory", str(Path(self.destination).parent))
+
+    def _removals(
+        self,
+        local: Dict[str, fridge_steps.FridgeEntry],
+        remote: Dict[str, ManifestEntry],
+    ) -> List[FsOperation]:
+        removals = []
+        removed: Set[str] = set()
+        for relative, existing in sorted(remote.items()):
+            parent = os.path.dirname(relative)
+            if parent in removed:
+                # already gone with its parent
+                removed.add(relative)
+                continue
+            entry = local.get(relative)
+            if entry is None or entry.kind != existing.kind:
+                removals.append(
+                    FsOperation("absent", os.path.join(self.destination, relative))
+                )
+                removed.add(relative)
+        return removals
+
+    async def cook(self, k: Kitchen) -> None:
+        # (covers files being added to or removed from the directory, too)
+        k.get_dependency_tracker().register_fridge_file(
+            self._desugared_src, self.real_path
+        )
+
+        local = await fridge_steps.build_fridge_manifest(
+            k, self.real_path, self.recipe_context.sous
+        )
+        remote_result = await k.ut1areq(
+            DirectoryManifest(
+                self.destination,
+                {
+                    relative: entry.size
+                    for relative, entry in local.items()
+                    if entry.kind == "file"
+                },
+                k.head.change_hash,
+            ),
+            DirectoryManifest.Result,
+        )
+        remote = remote_result.entries or {}
+
+        operations = [FsOperation("directory", self.destination, mode=self.dir_mode)]
+        if self.delete:
+            operations += self._removals(local, remote)
+
+        to_send: List[str] = []
+        for relative, entry in sorted(local.items()):
+            path = os.path.join(self.destination, relative)
+            existing = remote.get(relative)
+            if entry.kind == "directory":
+                if (
+                    existing is None
+                    or existing.kind != "directory"
+                    or existing.mode != self.dir_mode
+                ):
+                    operations.append(
+                        FsOperation("directory", path, mode=self.dir_mode)
+                    )
+            else:
+                if (
+                    existing is not None
+                    and existing.kind == "file"
+                    and existing.digest == entry.digest
+                ):
+                    if existing.mode != self.mode:
+                        operations.append(FsOperation("chmod", path, mode=self.mode))
+                else:
+                    to_send.append(relative)
+
+        # small files are batched into transactions; large ones are sent
+        # separately, as deltas.
+        large: List[str] = []
+        batch_bytes = 0
+        for relative in to_send:
+            entry = local[relative]
+            if entry.size >= DELTA_MIN_SIZE:
+                large.append(relative)
+                continue
+            if batch_bytes + entry.size > FridgeSync.BATCH_BYTES:
+                await apply_fs_transaction(k, operations)
+                operations = []
+                batch_bytes = 0
+            operations.append(
+                FsOperation(
+                    "file",
+                    os.path.join(self.destination, relative),
+                    mode=self.mode,
+                    content=await entry.load(k),
+                )
+            )
+            batch_bytes += entry.size
+
+        if operations:
+            await apply_fs_transaction(k, operations)
+
+        for relative in large:
+            await write_file(
+                k,
+                os.path.join(self.destination, relative),
+                await local[relative].load(k),
+                self.mode,
+            )
+
+        logger.debug(
+            "%s: %d of %d files sent",
+            self.destination,
+            len(to_send),
+            sum(1 for entry in local.values() if entry.kind == "file"),
+        )
 
 
 class Supermarket(Recipe):
@@ -149,15 +326,22 @@ class Supermarket(Recipe):
             kitchen.head.directory, SUPERMARKET_RELATIVE, self.sha256
         )
 
-        logger.debug("Going to hash …")
+        # checks the hash and, if it matches, the ownership and mode,
+        # all in one go.
+        ensure_file = FsOperation(
+            "file",
+            str(self.destination),
+            mode=self.mode,
+            user=self.owner,
+            group=self.group,
+            sha256=self.sha256,
+        )
 
-        remote_hash = await kitchen.ut1(HashFile(str(self.destination)))
+        (outcome,) = await apply_fs_transaction(kitchen, [ensure_file])
 
-        logger.debug(
-            "sha256 of %s: want %s have %r", self.destination, self.sha256, remote_hash
-        )
+        logger.debug("%s: wanted sha256 %s: %s", self.destination, self.sha256, outcome)
 
-        if remote_hash != self.sha256:
+        if outcome in (FS_DIFFERS, FS_MISSING):
             if self.sha256 in Supermarket.in_progress:
                 logger.debug("Awaiting existing download")
                 await Supermarket.in_progress[self.sha256]
@@ -187,20 +371,12 @@ class Supermarket(Recipe):
             else:
                 logger.debug("Already in supermarket.")
 
-            # TODO(perf): load file in another thread
-            # TODO(perf): chunk file
-            with open(supermarket_path, "rb") as fin:
-                data = fin.read()
-            chan = await kitchen.start(WriteFile(str(self.destination), self.mode))
-            await chan.send(data)
-            await chan.send(None)
-            if await chan.recv() != "OK":
-                raise RuntimeError(
-                    f"WriteFail failed on supermarket to {self.destination}"
-                )
+            data = await asyncio.get_running_loop().run_in_executor(
+                kitchen.head.pools.threaded, supermarket_path.read_bytes
+            )
+            await write_file(kitchen, str(self.destination), data, self.mode)
 
-        await kitchen.ut0(Chown(str(self.destination), self.owner, self.group))
-        await kitchen.ut0(Chmod(str(self.destination), self.mode))
+            await apply_fs_transaction(kitchen, [ensure_file])
 
     @staticmethod
     def _download_file(url: str, dest_path: str, check_sha256: str, note: str):
@@ -20,7 +20,6 @@ import logging
 from typing import Optional
 
 from scone.default.steps import linux_steps
-from scone.default.utensils.linux_utensils import GetPasswdEntry
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen, Preparation
 from scone.head.recipe import Recipe, RecipeContext
@@ -56,9 +55,7 @@ class LinuxUser(Recipe):
         else:
             password_hash = None
 
-        pwd_entry = await kitchen.ut1a(
-            GetPasswdEntry(self.user_name), GetPasswdEntry.Result
-        )
+        pwd_entry = await linux_steps.get_passwd_entry(kitchen, self.user_name)
 
         if pwd_entry:
             logger.warning(
@@ -92,5 +92,8 @@ class PythonVenv(Recipe):
             install_args.append(name)
 
         await exec_no_fails(
-            kitchen, [self.dir + "/bin/pip", "install"] + install_args, "/"
+            kitchen,
+            [self.dir + "/bin/pip", "install"] + install_args,
+            "/",
+            streaming=True,
         )
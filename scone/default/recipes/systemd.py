@@ -15,6 +15,8 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+from typing import List
+
 from scone.default.steps.systemd_steps import (
     cook_systemd_daemon_reload,
     cook_systemd_enable,
@@ -22,21 +24,23 @@ from scone.default.steps.systemd_steps import (
 )
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen, Preparation
-from scone.head.recipe import Recipe, RecipeContext
+from scone.head.recipe import Recipe, RecipeContext, coalesced_context
 from scone.head.utils import check_type, check_type_opt
 
 
 class SystemdUnit(Recipe):
     """
     System unit.
-    TODO(performance): make it collapsible in a way so that it can daemon-reload
-        only once in most situations.
+    All of the units on a sous are coalesced (into a SystemdUnits), so that
+    systemd only has to daemon-reload once.
 
     TODO(performance): deduplication.
     """
 
     _NAME = "systemd"
 
+    _COALESCIBLE = True
+
     def __init__(self, recipe_context: RecipeContext, args: dict, head):
         super().__init__(recipe_context, args, head)
 
@@ -52,13 +56,58 @@ class SystemdUnit(Recipe):
         # TODO(potential future): preparation.provides("systemd-unit", self.unit_name)
         preparation.needs("file", self.at)
 
-    async def cook(self, kitchen: Kitchen) -> None:
-        if self.enabled is not None or self.started is not None:
-            await cook_systemd_daemon_reload(kitchen)
+    @property
+    def needs_reload(self) -> bool:
+        return self.enabled is not None or self.started is not None
 
+    async def cook_after_reload(self, kitchen: Kitchen) -> None:
         if self.enabled is not None:
             await cook_systemd_enable(kitchen, self.enabled, self.unit_name)
 
         if self.started is not None:
             if self.started:
                 await cook_systemd_start(kitchen, self.unit_name)
+
+    async def cook(self, kitchen: Kitchen) -> None:
+        if self.needs_reload:
+            await cook_systemd_daemon_reload(kitchen)
+
+        await self.cook_after_reload(kitchen)
+
+    @classmethod
+    def coalesce(cls, recipes: List[Recipe], head: Head) -> Recipe:
+        units = sorted(recipes, key=lambda unit: unit.arguments["unit"])
+        return SystemdUnits(
+            coalesced_context(recipes),
+            {"units": [unit.arguments for unit in units]},
+            head,
+        )
+
+
+class SystemdUnits(Recipe):
+    """
+    Several system units, with a single daemon-reload.
+    Takes the arguments of each systemd unit in a list, `units`.
+    Only made by coalescing SystemdUnits, so it has no _NAME (and can't be
+    used in menus).
+    """
+
+    def __init__(self, recipe_context: RecipeContext, args: dict, head):
+        super().__init__(recipe_context, args, head)
+
+        self.units = [
+            SystemdUnit(recipe_context, check_type(unit_args, dict), head)
+            for unit_args in check_type(args.get("units"), list)
+        ]
+
+    def prepare(self, preparation: Preparation, head: Head) -> None:
+        super().prepare(preparation, head)
+        for unit in self.units:
+            preparation.needs("file", unit.at)
+
+    async def cook(self, kitchen: Kitchen) -> None:
+        if any(unit.needs_reload for unit in self.units):
+            await cook_systemd_daemon_reload(kitchen)
+
+        for unit in self.units:
+            await unit.cook_after_reload(kitchen)
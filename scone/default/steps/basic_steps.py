@@ -15,10 +15,14 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
-from pathlib import PurePath
-from typing import List, Optional, Union
+import asyncio
+from pathlib import Path, PurePath
+from typing import AsyncIterable, AsyncIterator, Callable, List, Optional, Union
 
-from scone.default.utensils.basic_utensils import SimpleExec
+import cattr
+
+from scone.common.misc import eprint
+from scone.default.utensils.basic_utensils import SimpleExec, StreamingExec
 from scone.head.exceptions import CookingError
 from scone.head.kitchen import Kitchen, current_recipe
 from scone.head.recipe import Recipe
@@ -37,7 +41,7 @@ class ExecutionFailure(CookingError):
         user: str,
         result: SimpleExec.Result,
     ):
-        stderr = result.stderr.decode().replace("\n", "\n    ")
+        stderr = result.stderr.decode(errors="replace").replace("\n", "\n    ")
 
         message = (
             f"Command failed on {sous} (user {user}) in {working_dir}.\n"
@@ -48,16 +52,150 @@ class ExecutionFailure(CookingError):
         super().__init__(message)
 
 
-async def exec_no_fails(
-    kitchen: Kitchen, args: List[str], working_dir: Union[str, PurePath]
+# Called with (fd, chunk) for output as it arrives; fd is 1 (stdout) or 2 (stderr)
+OutputCallback = Callable[[int, bytes], None]
+
+
+class OutputEcho:
+    """
+    An OutputCallback which shows the output to the operator, line by line.
+    """
+
+    def __init__(self, prefix: str):
+        self._prefix = prefix
+        self._partial = {1: b"", 2: b""}
+
+    def __call__(self, fd: int, chunk: bytes) -> None:
+        *lines, self._partial[fd] = (self._partial[fd] + chunk).split(b"\n")
+        for line in lines:
+            eprint(f"{self._prefix}{line.decode(errors='replace')}")
+
+
+# Maximum number of stdin chunks sent to the sous but not yet taken by the command.
+STDIN_WINDOW = 8
+
+
+async def read_file_chunks(
+    kitchen: Kitchen, path: Union[str, PurePath], chunk_size: int = 1024 * 1024
+) -> AsyncIterator[bytes]:
+    """
+    Reads a file on the head in chunks (off the event loop), for example to
+    stream it into a command on the sous with exec_streaming(stdin=...).
+    """
+    loop = asyncio.get_running_loop()
+    with open(Path(path), "rb") as fin:
+        while True:
+            chunk = await loop.run_in_executor(
+                kitchen.head.pools.threaded, fin.read, chunk_size
+            )
+            if not chunk:
+                return
+            yield chunk
+
+
+async def exec_streaming(
+    kitchen: Kitchen,
+    args: List[str],
+    working_dir: Union[str, PurePath],
+    on_output: Optional[OutputCallback] = None,
+    capture_limit: int = 64 * 1024,
+    stdin: Optional[AsyncIterable[bytes]] = None,
 ) -> SimpleExec.Result:
+    """
+    Executes a command, keeping only the first and last capture_limit bytes
+    of its stdout and stderr in the result.
+    If on_output is given, it is called with the output as it arrives.
+    If stdin is given, its chunks are piped into the command as they are
+    consumed, without landing on the sous' disk.
+    """
     if not isinstance(working_dir, str):
         working_dir = str(working_dir)
 
-    result = await kitchen.start_and_consume_attrs(
-        SimpleExec(args, working_dir), SimpleExec.Result
+    channel = await kitchen.start(
+        StreamingExec(
+            args,
+            working_dir,
+            capture_limit=capture_limit,
+            forward_output=on_output is not None,
+            stdin=stdin is not None,
+        )
     )
 
+    credit = asyncio.Semaphore(STDIN_WINDOW)
+
+    async def feed_stdin(chunks: AsyncIterable[bytes]):
+        try:
+            async for chunk in chunks:
+                await credit.acquire()
+                await channel.send(chunk)
+        except Exception:
+            # close the command's stdin anyway, so that it isn't left waiting
+            await channel.send(None)
+            raise
+        await channel.send(None)
+
+    feeder = None
+    if stdin is not None:
+        feeder = asyncio.create_task(feed_stdin(stdin))
+
+    try:
+        while True:
+            if feeder is not None and not feeder.done():
+                receiving = asyncio.ensure_future(channel.recv())
+                await asyncio.wait(
+                    {receiving, feeder}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not receiving.done():
+                    receiving.cancel()
+                    # surface any error from reading the input straight away
+                    feeder.result()
+                    continue
+                message = receiving.result()
+            else:
+                message = await channel.recv()
+
+            if "ack" in message:
+                credit.release()
+            elif "result" in message:
+                await channel.wait_close()
+                if feeder is not None and feeder.done():
+                    # surface any error from reading the input
+                    feeder.result()
+                return cattr.structure(message["result"], SimpleExec.Result)
+            elif on_output is not None:
+                on_output(message["fd"], message["data"])
+    finally:
+        if feeder is not None and not feeder.done():
+            # the command exited without reading all of its input
+            feeder.cancel()
+
+
+async def exec_no_fails(
+    kitchen: Kitchen,
+    args: List[str],
+    working_dir: Union[str, PurePath],
+    streaming: bool = False,
+    on_output: Optional[OutputCallback] = None,
+    stdin: Optional[AsyncIterable[bytes]] = None,
+) -> SimpleExec.Result:
+    """
+    Executes a command, raising ExecutionFailure if it fails.
+
+    If streaming (or if on_output or stdin is given), only the start and end of
+    the output are kept (see exec_streaming); use this for chatty commands.
+    """
+    if not isinstance(working_dir, str):
+        working_dir = str(working_dir)
+
+    if streaming or on_output is not None or stdin is not None:
+        result = await exec_streaming(
+            kitchen, args, working_dir, on_output, stdin=stdin
+        )
+    else:
+        result = await kitchen.start_and_consume_attrs(
+            SimpleExec(args, working_dir), SimpleExec.Result
+        )
+
     if result.exit_code != 0:
         recipe: Optional[Recipe] = current_recipe.get(None)  # type: ignore
         if recipe:
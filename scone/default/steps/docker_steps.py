@@ -0,0 +1,83 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from typing import Optional
+
+import cattr
+
+from scone.default.utensils.docker_utensils import (
+    DockerImagePull,
+    DockerPullProgress,
+    image_reference,
+)
+from scone.head.kitchen import Kitchen
+
+logger = logging.getLogger(__name__)
+
+# a pull is considered stalled after this long (seconds) without any progress
+DEFAULT_STALL_TIMEOUT = 300.0
+
+
+async def pull_docker_image(
+    kitchen: Kitchen,
+    repository: str,
+    tag: str,
+    stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+) -> DockerImagePull.Result:
+    """
+    Pulls an image on the sous, logging the progress of its layers.
+
+    :param tag: a tag, or a digest such as sha256:…
+
+    :raises RuntimeError: if the pull fails, or makes no progress for
+        stall_timeout seconds.
+    """
+    image = image_reference(repository, tag)
+    chan = await kitchen.start(DockerImagePull(repository, tag))
+
+    # no timeout until the pull starts, as it may be queued behind others
+    timeout: Optional[float] = None
+    while True:
+        try:
+            message = await asyncio.wait_for(chan.recv(), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(
+                f"Pull of {image} stalled: no progress for {stall_timeout} s"
+            )
+        except EOFError:
+            raise RuntimeError(f"Pull of {image} ended without a result")
+        timeout = stall_timeout
+
+        if "progress" in message:
+            progress = cattr.structure(message["progress"], DockerPullProgress)
+            if progress.total:
+                logger.debug(
+                    "%s: %s %s (%d/%d)",
+                    image,
+                    progress.layer,
+                    progress.status,
+                    progress.current or 0,
+                    progress.total,
+                )
+            else:
+                logger.info("%s: %s %s", image, progress.layer or "", progress.status)
+        elif "error" in message:
+            raise RuntimeError(f"Failed to pull {image}: {message['error']}")
+        else:
+            return cattr.structure(message["result"], DockerImagePull.Result)
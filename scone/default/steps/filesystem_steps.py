@@ -15,10 +15,168 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
-from scone.default.utensils.basic_utensils import HashFile
-from scone.head.kitchen import Kitchen
+import asyncio
+import logging
+import stat
+from typing import Dict, List, Optional
+
+import cattr
+
+from scone.common.delta import (
+    BlockSignatures,
+    choose_block_size,
+    compute_delta,
+    literal_delta,
+)
+from scone.common.hashing import hash_bytes
+from scone.default.utensils.basic_utensils import (
+    DeltaWrite,
+    HashFile,
+    HashFiles,
+    Stat,
+    StatMany,
+    WriteFile,
+)
+from scone.default.utensils.dynamic_dependencies import CanSkipDynamic
+from scone.default.utensils.filesystem_utensils import FsOperation, FsTransaction
+from scone.head.kitchen import Kitchen, SousFileChecker, register_sous_file_checker
+
+logger = logging.getLogger(__name__)
+
+# files smaller than this are always sent whole
+DELTA_MIN_SIZE = 1024 * 1024
 
 
 async def depend_remote_file(path: str, kitchen: Kitchen) -> None:
-    sha256 = await kitchen.ut1(HashFile(path))
-    kitchen.get_dependency_tracker().register_remote_file(path, sha256)
+    digest = await kitchen.ut1(HashFile(path, kitchen.head.change_hash))
+    kitchen.get_dependency_tracker().register_remote_file(path, digest)
+
+
+class RemoteFileChecker(SousFileChecker):
+    """
+    Checks the files registered by depend_remote_file.
+    """
+
+    async def unchanged(self, kitchen: Kitchen, file_hashes: Dict[str, str]) -> bool:
+        return await kitchen.ut1(CanSkipDynamic(file_hashes))
+
+    async def hash_files(
+        self, kitchen: Kitchen, sous: str, user: str, paths: List[str], algorithm: str
+    ) -> Dict[str, Optional[str]]:
+        hashes: Dict[str, Optional[str]] = dict()
+        channel = await kitchen.start_on(sous, user, HashFiles(paths, algorithm))
+        while True:
+            try:
+                path, digest = await channel.recv()
+            except EOFError:
+                break
+            hashes[path] = digest
+        return hashes
+
+
+register_sous_file_checker(RemoteFileChecker())
+
+
+async def stat_many(kitchen: Kitchen, paths: List[str]) -> List[Optional[Stat.Result]]:
+    """
+    Stats many paths on the sous in one round trip.
+    :return: for each path, the result or None if it does not exist.
+    """
+    results = await kitchen.ut1(StatMany(paths))
+    return [
+        None
+        if result is None
+        else Stat.Result(
+            uid=result[0],
+            gid=result[1],
+            dir=stat.S_ISDIR(result[2]),
+            user=result[3],
+            group=result[4],
+            mode=result[2],
+        )
+        for result in results
+    ]
+
+
+async def apply_fs_transaction(
+    kitchen: Kitchen, operations: List[FsOperation]
+) -> List[str]:
+    """
+    Applies filesystem operations on the sous in one round trip.
+    :return: the outcome of each operation (see filesystem_utensils.FS_*)
+    """
+    result = await kitchen.ut1areq(FsTransaction(operations), FsTransaction.Result)
+    if result.error is not None:
+        raise RuntimeError(f"Filesystem transaction failed: {result.error}")
+    return result.outcomes
+
+
+async def write_file(kitchen: Kitchen, path: str, data: bytes, mode: int) -> None:
+    """
+    Writes a file on the sous.
+    Large files are sent as a delta against the sous' existing copy, so that
+    only the parts that changed need to be transferred.
+    """
+    if len(data) >= DELTA_MIN_SIZE and await _write_file_delta(
+        kitchen, path, data, mode
+    ):
+        return
+
+    chan = await kitchen.start(WriteFile(path, mode))
+    for chunk in literal_delta(data):
+        await chan.send(chunk)
+    await chan.send(None)
+    if await chan.recv() != "OK":
+        raise RuntimeError(f"WriteFile failed to {path}")
+
+
+async def _write_file_delta(
+    kitchen: Kitchen, path: str, data: bytes, mode: int
+) -> bool:
+    """
+    :return: False if the reconstructed file did not match, in which case
+        nothing was written.
+    """
+    loop = asyncio.get_running_loop()
+    digest = await loop.run_in_executor(
+        kitchen.head.pools.threaded, hash_bytes, data, kitchen.head.change_hash
+    )
+    chan = await kitchen.start(
+        DeltaWrite(path, mode, choose_block_size(len(data)), digest)
+    )
+
+    signatures = await chan.recv()
+    delta = None
+    if signatures is not None:
+        # give up on the delta once it is clear that much of the file changed
+        delta = await loop.run_in_executor(
+            kitchen.head.pools.process,
+            compute_delta,
+            data,
+            cattr.structure(signatures, BlockSignatures),
+            len(data) // 2,
+        )
+    if delta is None:
+        delta = literal_delta(data)
+
+    literal_bytes = 0
+    for instruction in delta:
+        if isinstance(instruction, bytes):
+            literal_bytes += len(instruction)
+        await chan.send(instruction)
+    await chan.send(None)
+
+    outcome = await chan.recv()
+    if outcome == "MISMATCH":
+        logger.warning("Delta transfer of %s mismatched; sending whole file", path)
+        return False
+    if outcome != "OK":
+        raise RuntimeError(f"DeltaWrite failed to {path}")
+
+    logger.debug(
+        "Delta transfer of %s: sent %d of %d bytes literally",
+        path,
+        literal_bytes,
+        len(data),
+    )
+    return True
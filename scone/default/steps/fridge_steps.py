@@ -15,12 +15,16 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import os
 from enum import Enum
 from pathlib import Path, PurePath
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
+import attr
 from jinja2 import DictLoader, Environment
 
+from scone.common.hashing import hash_bytes, hash_file
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen
 
@@ -114,3 +118,87 @@ async def load_and_transform(
         #     template.environment.handle_exception()
 
     return data
+
+
+@attr.s(auto_attribs=True)
+class FridgeEntry:
+    # file or directory
+    kind: str
+    # path to the file in the fridge
+    real_path: Path
+    meta: FridgeMetadata = FridgeMetadata.FRIDGE
+    size: int = 0
+    # tagged digest
+    digest: Optional[str] = None
+    # the transformed content, if it had to be loaded to be hashed
+    data: Optional[bytes] = None
+
+    async def load(self, kitchen: Kitchen) -> bytes:
+        if self.data is not None:
+            return self.data
+        return await asyncio.get_running_loop().run_in_executor(
+            kitchen.head.pools.threaded, self.real_path.read_bytes
+        )
+
+
+def _dir_identity(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def _sync_list_fridge_dir(root: Path, algorithm: str) -> Dict[str, FridgeEntry]:
+    entries: Dict[str, FridgeEntry] = {}
+    # directory → (st_dev, st_ino) of it and the directories it is within,
+    # as symlinked directories are followed and could lead round in a loop
+    lineages: Dict[str, Set[Tuple[int, int]]] = {}
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        lineage = lineages.pop(dirpath, None)
+        if lineage is None:
+            lineage = {_dir_identity(dirpath)}
+        relative_dir = os.path.relpath(dirpath, root)
+        for dirname in dirnames:
+            relative = os.path.normpath(os.path.join(relative_dir, dirname))
+            child = os.path.join(dirpath, dirname)
+            identity = _dir_identity(child)
+            if identity in lineage:
+                raise RuntimeError(
+                    f"Fridge directory {child} is a symlink to a directory"
+                    " that contains it."
+                )
+            lineages[child] = lineage | {identity}
+            entries[relative] = FridgeEntry("directory", Path(dirpath, dirname))
+        for filename in filenames:
+            real_path = Path(dirpath, filename)
+            unextended, meta = decode_fridge_extension(filename)
+            relative = os.path.normpath(os.path.join(relative_dir, unextended))
+            entry = FridgeEntry("file", real_path, meta)
+            if meta == FridgeMetadata.FRIDGE:
+                entry.size = real_path.stat().st_size
+                entry.digest = hash_file(str(real_path), algorithm)
+            entries[relative] = entry
+    return entries
+
+
+async def build_fridge_manifest(
+    kitchen: Kitchen, root: Path, sous: str
+) -> Dict[str, FridgeEntry]:
+    """
+    Lists and hashes a directory in the fridge, keyed by relative path
+    (with fridge extensions removed).
+    Frozen and templated files are transformed for the sous in order to
+    be hashed.
+    """
+    entries = await asyncio.get_running_loop().run_in_executor(
+        kitchen.head.pools.threaded,
+        _sync_list_fridge_dir,
+        root,
+        kitchen.head.change_hash,
+    )
+    for entry in entries.values():
+        if entry.kind == "file" and entry.digest is None:
+            entry.data = await load_and_transform(
+                kitchen, entry.meta, entry.real_path, sous
+            )
+            entry.size = len(entry.data)
+            entry.digest = hash_bytes(entry.data, kitchen.head.change_hash)
+    return entries
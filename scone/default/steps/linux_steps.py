@@ -15,10 +15,78 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+from asyncio import Future
 from typing import Optional
 
 from scone.default.utensils.basic_utensils import SimpleExec
-from scone.head.kitchen import Kitchen
+from scone.default.utensils.linux_utensils import (
+    GetGroupEntry,
+    GetNssSnapshot,
+    GetPasswdEntry,
+    GroupEntry,
+)
+from scone.head.kitchen import Kitchen, current_recipe
+
+
+class _NssState:
+    def __init__(self):
+        self.snapshot: Optional[Future] = None
+
+
+def _nss_state(kitchen: Kitchen) -> _NssState:
+    key = (current_recipe.get().recipe_context.sous, "nss")
+    state = kitchen.run_state.get(key)
+    if state is None:
+        state = _NssState()
+        kitchen.run_state[key] = state
+    return state
+
+
+async def get_nss_snapshot(kitchen: Kitchen) -> GetNssSnapshot.Result:
+    """
+    Returns the sous' passwd and group databases, fetched once per run and
+    shared between recipes.
+    """
+    state = _nss_state(kitchen)
+    if state.snapshot is None:
+        state.snapshot = asyncio.ensure_future(
+            kitchen.ut1areq(GetNssSnapshot(), GetNssSnapshot.Result)
+        )
+    snapshot = state.snapshot
+    try:
+        # shielded, as other recipes may be waiting for it too
+        return await asyncio.shield(snapshot)
+    except Exception:
+        if state.snapshot is snapshot:
+            state.snapshot = None
+        raise
+
+
+async def get_passwd_entry(
+    kitchen: Kitchen, user_name: str
+) -> Optional[GetPasswdEntry.Result]:
+    """
+    Looks up a user on the sous.
+    Users in the run's NSS snapshot are taken from there; others are looked up
+    afresh, as they may have been created since the snapshot was taken.
+    """
+    entry = (await get_nss_snapshot(kitchen)).users.get(user_name)
+    if entry is None:
+        entry = await kitchen.ut1a(GetPasswdEntry(user_name), GetPasswdEntry.Result)
+    return entry
+
+
+async def get_group_entry(kitchen: Kitchen, group_name: str) -> Optional[GroupEntry]:
+    """
+    Looks up a group on the sous.
+    Groups in the run's NSS snapshot are taken from there; others are looked up
+    afresh, as they may have been created since the snapshot was taken.
+    """
+    entry = (await get_nss_snapshot(kitchen)).groups.get(group_name)
+    if entry is None:
+        entry = await kitchen.ut1a(GetGroupEntry(group_name), GroupEntry)
+    return entry
 
 
 async def create_linux_user(
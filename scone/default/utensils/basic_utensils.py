@@ -22,32 +22,143 @@ import os
 import pwd
 import shutil
 import stat
-from typing import List
+from typing import BinaryIO, Dict, List, Optional
 
 import attr
+import cattr
 
 from scone.common.chanpro import Channel
-from scone.common.misc import sha256_file
+from scone.common.delta import compute_signatures
+from scone.common.hashing import DEFAULT_CHANGE_ALGORITHM, algorithm_of, normalise
+from scone.sous.atomic_write import AtomicWriter, get_durability
 from scone.sous.utensils import Utensil, Worktop
 
 
 @attr.s(auto_attribs=True)
 class WriteFile(Utensil):
+    """
+    Writes a file from the chunks sent by the head, followed by None.
+
+    The file is replaced atomically, and left untouched if it already has the
+    same content.
+    """
+
     path: str
     mode: int
+    # one of fsync, syncfs or none; None for the sous' configured default.
+    durability: Optional[str] = None
 
-    async def execute(self, channel: Channel, worktop):
-        oldumask = os.umask(0)
-        fdnum = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.mode)
-        os.umask(oldumask)
-
-        with open(fdnum, "wb") as file:
+    async def execute(self, channel: Channel, worktop: Worktop):
+        durability = get_durability(worktop, self.durability)
+        writer = AtomicWriter(self.path, self.mode)
+        try:
             while True:
                 next_chunk = await channel.recv()
                 if next_chunk is None:
                     break
                 assert isinstance(next_chunk, bytes)
-                file.write(next_chunk)
+                writer.write(next_chunk)
+        except BaseException:
+            writer.abort()
+            raise
+
+        await asyncio.get_running_loop().run_in_executor(
+            worktop.pools.threaded, writer.commit, worktop, durability
+        )
+
+        await channel.send("OK")
+
+
+@attr.s(auto_attribs=True)
+class DeltaWrite(Utensil):
+    """
+    Writes a file by applying a delta against the existing copy.
+
+    Sends the block signatures of the existing file (or None if there is none),
+    then receives delta instructions (see scone.common.delta), followed by None.
+    The reconstructed file must have the given (tagged) digest, else nothing
+    is written and "MISMATCH" is sent rather than "OK".
+    """
+
+    path: str
+    mode: int
+    block_size: int
+    digest: str
+    durability: Optional[str] = None
+
+    def _sync_open_existing(self) -> Optional[BinaryIO]:
+        try:
+            old_file = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(os.fstat(old_file.fileno()).st_mode):
+            old_file.close()
+            return None
+        return old_file
+
+    def _sync_copy_blocks(
+        self, old_file: BinaryIO, writer: AtomicWriter, first: int, count: int
+    ) -> None:
+        old_file.seek(first * self.block_size)
+        for _ in range(count):
+            block = old_file.read(self.block_size)
+            if len(block) != self.block_size:
+                raise RuntimeError(f"Block reference beyond end of {self.path}")
+            writer.write(block)
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        loop = asyncio.get_running_loop()
+        durability = get_durability(worktop, self.durability)
+
+        old_file = await loop.run_in_executor(
+            worktop.pools.threaded, self._sync_open_existing
+        )
+        if old_file is None:
+            await channel.send(None)
+        else:
+            signatures = await loop.run_in_executor(
+                worktop.pools.threaded,
+                compute_signatures,
+                old_file,
+                self.block_size,
+            )
+            await channel.send(signatures)
+
+        writer = AtomicWriter(self.path, self.mode, algorithm_of(self.digest))
+        try:
+            while True:
+                instruction = await channel.recv()
+                if instruction is None:
+                    break
+                if isinstance(instruction, bytes):
+                    writer.write(instruction)
+                else:
+                    if old_file is None:
+                        raise RuntimeError("Block reference but no existing file")
+                    first, count = instruction
+                    await loop.run_in_executor(
+                        worktop.pools.threaded,
+                        self._sync_copy_blocks,
+                        old_file,
+                        writer,
+                        first,
+                        count,
+                    )
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            if old_file is not None:
+                old_file.close()
+
+        if writer.digest() != normalise(self.digest):
+            writer.abort()
+            await channel.send("MISMATCH")
+            return
+
+        await loop.run_in_executor(
+            worktop.pools.threaded, writer.commit, worktop, durability
+        )
 
         await channel.send("OK")
 
@@ -105,6 +216,51 @@ class Stat(Utensil):
         )
 
 
+@attr.s(auto_attribs=True)
+class StatMany(Utensil):
+    """
+    Stats many paths (without following symlinks) in one go.
+
+    Sends a list with, for each path, None if it does not exist or else
+    [uid, gid, mode, user, group].
+    """
+
+    paths: List[str]
+
+    def _sync_execute(self) -> List[Optional[list]]:
+        users: Dict[int, str] = {}
+        groups: Dict[int, str] = {}
+        results: List[Optional[list]] = []
+        for path in self.paths:
+            try:
+                stat_result = os.stat(path, follow_symlinks=False)
+            except FileNotFoundError:
+                results.append(None)
+                continue
+
+            uid = stat_result.st_uid
+            gid = stat_result.st_gid
+            if uid not in users:
+                try:
+                    users[uid] = pwd.getpwuid(uid).pw_name
+                except KeyError:
+                    users[uid] = str(uid)
+            if gid not in groups:
+                try:
+                    groups[gid] = grp.getgrgid(gid).gr_name
+                except KeyError:
+                    groups[gid] = str(gid)
+
+            results.append([uid, gid, stat_result.st_mode, users[uid], groups[gid]])
+        return results
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        results = await asyncio.get_running_loop().run_in_executor(
+            worktop.pools.threaded, self._sync_execute
+        )
+        await channel.send(results)
+
+
 @attr.s(auto_attribs=True)
 class Chown(Utensil):
     path: str
@@ -155,15 +311,168 @@ class SimpleExec(Utensil):
         )
 
 
+class BoundedCapture:
+    """
+    Keeps only the first and last `limit` bytes of a stream of output.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._start = bytearray()
+        self._end = bytearray()
+        self._elided = 0
+
+    def add(self, chunk: bytes) -> None:
+        room = self._limit - len(self._start)
+        if room > 0:
+            self._start += chunk[:room]
+            chunk = chunk[room:]
+        self._end += chunk
+        excess = len(self._end) - self._limit
+        if excess > 0:
+            del self._end[:excess]
+            self._elided += excess
+
+    def getvalue(self) -> bytes:
+        if self._elided:
+            marker = f"\n[... {self._elided} bytes elided ...]\n".encode()
+            return bytes(self._start) + marker + bytes(self._end)
+        return bytes(self._start + self._end)
+
+
+@attr.s(auto_attribs=True)
+class StreamingExec(Utensil):
+    """
+    Like SimpleExec, but only keeps the start and end of the output in the
+    result, so that chatty commands don't use unbounded memory.
+
+    If forward_output is set, the output is also sent as it arrives, as
+    {"fd": 1 or 2, "data": bytes} messages.
+    The final message is {"result": SimpleExec.Result}.
+
+    If stdin is set, the head sends the command's input as bytes chunks,
+    followed by None for end-of-file. Each chunk is acknowledged with
+    {"ack": 1} once the command has taken it, so the head can limit how much
+    is in flight.
+    """
+
+    args: List[str]
+    working_dir: str
+    # bytes to keep at each of the start and end of stdout and of stderr.
+    capture_limit: int = 64 * 1024
+    forward_output: bool = False
+    stdin: bool = False
+
+    async def _pump(
+        self,
+        stream: Optional[asyncio.StreamReader],
+        fd: int,
+        capture: BoundedCapture,
+        channel: Channel,
+    ):
+        assert stream is not None
+        while True:
+            chunk = await stream.read(64 * 1024)
+            if not chunk:
+                return
+            capture.add(chunk)
+            if self.forward_output:
+                await channel.send({"fd": fd, "data": chunk})
+
+    async def _feed_stdin(
+        self, stream: Optional[asyncio.StreamWriter], channel: Channel
+    ):
+        assert stream is not None
+        try:
+            while True:
+                chunk = await channel.recv()
+                if chunk is None:
+                    break
+                stream.write(chunk)
+                await stream.drain()
+                await channel.send({"ack": 1})
+        except (BrokenPipeError, ConnectionResetError):
+            # the command stopped reading its input; not our business.
+            pass
+        finally:
+            stream.close()
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        proc = await asyncio.create_subprocess_exec(
+            *self.args,
+            stdin=asyncio.subprocess.PIPE if self.stdin else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.working_dir
+        )
+
+        stdout = BoundedCapture(self.capture_limit)
+        stderr = BoundedCapture(self.capture_limit)
+
+        feeder = None
+        if self.stdin:
+            feeder = asyncio.create_task(self._feed_stdin(proc.stdin, channel))
+
+        try:
+            await asyncio.gather(
+                self._pump(proc.stdout, 1, stdout, channel),
+                self._pump(proc.stderr, 2, stderr, channel),
+            )
+            exit_code = await proc.wait()
+        finally:
+            if feeder is not None:
+                # the command may have exited without reading all its input
+                feeder.cancel()
+
+        await channel.send(
+            {
+                "result": cattr.unstructure(
+                    SimpleExec.Result(
+                        exit_code=exit_code,
+                        stdout=stdout.getvalue(),
+                        stderr=stderr.getvalue(),
+                    )
+                )
+            }
+        )
+
+
 @attr.s(auto_attribs=True)
 class HashFile(Utensil):
+    """
+    Sends the tagged digest of a file (see scone.common.hashing),
+    or None if it is missing.
+    """
+
     path: str
+    algorithm: str = DEFAULT_CHANGE_ALGORITHM
 
     async def execute(self, channel: Channel, worktop: Worktop):
         try:
-            sha256 = await asyncio.get_running_loop().run_in_executor(
-                worktop.pools.threaded, sha256_file, self.path
+            digest = await asyncio.get_running_loop().run_in_executor(
+                worktop.pools.threaded,
+                worktop.hash_cache.hash_file,
+                self.path,
+                self.algorithm,
             )
-            await channel.send(sha256)
+            await channel.send(digest)
         except FileNotFoundError:
             await channel.send(None)
+
+
+@attr.s(auto_attribs=True)
+class HashFiles(Utensil):
+    """
+    Hashes many files in parallel, sending a [path, tagged digest] pair for
+    each file as soon as it has been hashed. The digest is None if the file is
+    missing.
+    """
+
+    paths: List[str]
+    algorithm: str = DEFAULT_CHANGE_ALGORITHM
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        async for path, digest in worktop.hash_cache.hash_many(
+            self.paths, worktop.pools, self.algorithm
+        ):
+            await channel.send([path, digest])
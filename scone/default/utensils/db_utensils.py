@@ -15,7 +15,9 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
+from typing import Any
 
 import attr
 
@@ -33,6 +35,53 @@ logger = logging.getLogger(__name__)
 if not asyncpg:
     logger.info("asyncpg not found, install if you need Postgres support")
 
+# defaults for the [postgres] section of scone.sous.toml
+DEFAULT_POOL_MIN_SIZE = 0
+DEFAULT_POOL_MAX_SIZE = 4
+# seconds after which an idle pooled connection is closed
+DEFAULT_POOL_IDLE_TIMEOUT = 60.0
+
+
+async def _get_pool(worktop: Worktop, database: str) -> Any:
+    """
+    Returns the sous' connection pool for a database, creating it if needed.
+    Pools live until the sous finishes.
+    """
+    key = f"postgres_pool:{database}"
+    pool_future = worktop.shared.get(key)
+    if pool_future is None:
+        config = worktop.config.get("postgres", {})
+        pool_future = asyncio.ensure_future(
+            asyncpg.create_pool(
+                database=database,
+                min_size=config.get("pool_min_size", DEFAULT_POOL_MIN_SIZE),
+                max_size=config.get("pool_max_size", DEFAULT_POOL_MAX_SIZE),
+                max_inactive_connection_lifetime=config.get(
+                    "pool_idle_timeout", DEFAULT_POOL_IDLE_TIMEOUT
+                ),
+            )
+        )
+        worktop.shared[key] = pool_future
+
+        async def close_pool():
+            if (
+                pool_future.done()
+                and not pool_future.cancelled()
+                and not pool_future.exception()
+            ):
+                await pool_future.result().close()
+
+        worktop.on_close(close_pool)
+
+    try:
+        # shielded, as other utensils may be waiting for it too
+        return await asyncio.shield(pool_future)
+    except Exception:
+        if worktop.shared.get(key) is pool_future:
+            # try again next time
+            del worktop.shared[key]
+        raise
+
 
 @attr.s(auto_attribs=True)
 class PostgresTransaction(Utensil):
@@ -66,12 +115,10 @@ class PostgresTransaction(Utensil):
 
                 await channel.send(results)
 
-        conn = await asyncpg.connect(database=self.database)
-        try:
+        pool = await _get_pool(worktop, self.database)
+        async with pool.acquire() as conn:
             if self.use_transaction_block:
                 async with conn.transaction():
                     await queryloop()
             else:
                 await queryloop()
-        finally:
-            await conn.close()
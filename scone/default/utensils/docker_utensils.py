@@ -1,6 +1,11 @@
-from typing import Optional
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
 
 import attr
+import cattr
 
 try:
     import docker.errors
@@ -11,8 +16,17 @@ from scone.common.chanpro import Channel
 from scone.sous import Utensil
 from scone.sous.utensils import Worktop
 
+logger = logging.getLogger(__name__)
+
 _docker_client_instance = None
 
+# default for max_concurrent_pulls in the [docker] section of scone.sous.toml
+DEFAULT_MAX_CONCURRENT_PULLS = 2
+
+# progress of a layer is sent at most this often (seconds), unless its status
+# changes
+PROGRESS_INTERVAL = 1.0
+
 
 def _docker_client():
     global _docker_client_instance
@@ -21,6 +35,36 @@ def _docker_client():
     return _docker_client_instance
 
 
+async def _run_blocking(worktop: Worktop, func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a blocking docker SDK call in the thread pool, so that it doesn't hold
+    up the sous' event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        worktop.pools.threaded, partial(func, *args, **kwargs)
+    )
+
+
+def image_reference(repository: str, tag: str) -> str:
+    """
+    :param tag: a tag, or a digest such as sha256:…
+    """
+    if ":" in tag:
+        return f"{repository}@{tag}"
+    return f"{repository}:{tag}"
+
+
+def _pull_semaphore(worktop: Worktop) -> asyncio.Semaphore:
+    semaphore = worktop.shared.get("docker_pull_semaphore")
+    if semaphore is None:
+        limit = worktop.config.get("docker", {}).get(
+            "max_concurrent_pulls", DEFAULT_MAX_CONCURRENT_PULLS
+        )
+        semaphore = asyncio.Semaphore(limit)
+        worktop.shared["docker_pull_semaphore"] = semaphore
+    return semaphore
+
+
 @attr.s(auto_attribs=True)
 class DockerContainerRun(Utensil):
     image: str
@@ -32,8 +76,12 @@ class DockerContainerRun(Utensil):
 
     async def execute(self, channel: Channel, worktop: Worktop):
         try:
-            container = _docker_client().containers.run(
-                self.image, self.command, detach=True
+            container = await _run_blocking(
+                worktop,
+                _docker_client().containers.run,
+                self.image,
+                self.command,
+                detach=True,
             )
 
         except docker.errors.ImageNotFound:
@@ -48,24 +96,126 @@ class DockerContainerRun(Utensil):
         await channel.send(DockerContainerRun.Result(name=container.name))
 
 
+@attr.s(auto_attribs=True)
+class DockerPullProgress:
+    # the layer ID, if the event is about a layer
+    layer: Optional[str]
+    status: str
+    current: Optional[int] = None
+    total: Optional[int] = None
+
+
 @attr.s(auto_attribs=True)
 class DockerImagePull(Utensil):
+    """
+    Pulls an image, sending {"progress": DockerPullProgress} messages as it
+    goes and finally either {"result": Result} or {"error": str}.
+
+    At most max_concurrent_pulls (see scone.sous.toml) pulls run at once.
+    """
+
     repository: str
+    # a tag, or a digest
     tag: str
 
     @attr.s(auto_attribs=True)
     class Result:
         id: str
 
+    def _sync_pull(
+        self, loop: asyncio.AbstractEventLoop, events: "asyncio.Queue[Optional[dict]]"
+    ) -> None:
+        try:
+            for event in _docker_client().api.pull(
+                self.repository, self.tag, stream=True, decode=True
+            ):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        loop = asyncio.get_running_loop()
+        async with _pull_semaphore(worktop):
+            events: "asyncio.Queue[Optional[dict]]" = asyncio.Queue()
+            pull = loop.run_in_executor(
+                worktop.pools.threaded, self._sync_pull, loop, events
+            )
+
+            error: Optional[str] = None
+            # layer → (status, time last sent)
+            last_sent: Dict[Optional[str], Any] = {}
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                if "error" in event:
+                    error = event["error"]
+                    continue
+
+                detail = event.get("progressDetail") or {}
+                progress = DockerPullProgress(
+                    layer=event.get("id"),
+                    status=event.get("status", ""),
+                    current=detail.get("current"),
+                    total=detail.get("total"),
+                )
+                now = time.monotonic()
+                last_status, last_time = last_sent.get(progress.layer, (None, 0.0))
+                elapsed = now - last_time
+                if progress.status != last_status or elapsed >= PROGRESS_INTERVAL:
+                    last_sent[progress.layer] = (progress.status, now)
+                    await channel.send({"progress": cattr.unstructure(progress)})
+
+            try:
+                await pull
+            except docker.errors.APIError as e:
+                # the docker server returned an error
+                error = str(e)
+
+        if error is not None:
+            logger.error("Failed to pull %s:%s: %s", self.repository, self.tag, error)
+            await channel.send({"error": error})
+            return
+
+        image = await _run_blocking(
+            worktop,
+            _docker_client().images.get,
+            image_reference(self.repository, self.tag),
+        )
+        await channel.send(
+            {"result": cattr.unstructure(DockerImagePull.Result(id=image.id))}
+        )
+
+
+@attr.s(auto_attribs=True)
+class DockerImageInspect(Utensil):
+    """
+    Looks up an image (by repository:tag, repository@digest or ID) in the local
+    image store, without contacting any registry.
+    Sends None if it is not present.
+    """
+
+    reference: str
+
+    @attr.s(auto_attribs=True)
+    class Result:
+        id: str
+        repo_digests: List[str]
+
     async def execute(self, channel: Channel, worktop: Worktop):
         try:
-            image = _docker_client().images.pull(self.repository, self.tag)
-        except docker.errors.APIError:
-            # the docker server returned an error
+            image = await _run_blocking(
+                worktop, _docker_client().images.get, self.reference
+            )
+        except docker.errors.ImageNotFound:
             await channel.send(None)
             return
 
-        await channel.send(DockerImagePull.Result(id=image.id))
+        await channel.send(
+            DockerImageInspect.Result(
+                id=image.id, repo_digests=image.attrs.get("RepoDigests") or []
+            )
+        )
 
 
 @attr.s(auto_attribs=True)
@@ -78,7 +228,9 @@ class DockerVolumeCreate(Utensil):
 
     async def execute(self, channel: Channel, worktop: Worktop):
         try:
-            volume = _docker_client().volume.create(self.name)
+            volume = await _run_blocking(
+                worktop, _docker_client().volumes.create, self.name
+            )
         except docker.errors.APIError:
             # the docker server returned an error
             await channel.send(None)
@@ -102,7 +254,9 @@ class DockerNetworkCreate(Utensil):
 
     async def execute(self, channel: Channel, worktop: Worktop):
         try:
-            network = _docker_client().networks.create(
+            network = await _run_blocking(
+                worktop,
+                _docker_client().networks.create,
                 self.name,
                 check_duplicate=self.check_duplicate,
                 internal=self.internal,
@@ -115,4 +269,4 @@ class DockerNetworkCreate(Utensil):
             await channel.send(None)
             return
 
-        await channel.send(DockerContainerRun.Result(name=network.name))
+        await channel.send(DockerNetworkCreate.Result(name=network.name))
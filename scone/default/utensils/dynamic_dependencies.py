@@ -23,29 +23,46 @@ from typing import Dict, List
 import attr
 
 from scone.common.chanpro import Channel
-from scone.common.misc import sha256_file
+from scone.common.hashing import (
+    DEFAULT_CHANGE_ALGORITHM,
+    algorithm_of,
+    check_algorithm,
+    normalise,
+)
 from scone.sous import Utensil
 from scone.sous.utensils import Worktop
 
 
 @attr.s(auto_attribs=True)
 class CanSkipDynamic(Utensil):
+    # path → digest (tagged, or untagged SHA-256)
     sous_file_hashes: Dict[str, str]
 
     async def execute(self, channel: Channel, worktop: Worktop):
-        for file, tracked_hash in self.sous_file_hashes.items():
+        # the digests may have been made with different algorithms
+        by_algorithm: Dict[str, List[str]] = {}
+        for file, digest in self.sous_file_hashes.items():
+            by_algorithm.setdefault(algorithm_of(digest), []).append(file)
+
+        for algorithm, files in by_algorithm.items():
             try:
-                real_hash = await asyncio.get_running_loop().run_in_executor(
-                    worktop.pools.threaded, sha256_file, file
-                )
-                if real_hash != tracked_hash:
-                    await channel.send(False)
-                    return
-            except IOError:
+                check_algorithm(algorithm)
+            except (ValueError, RuntimeError):
+                # can't verify it, so can't skip
                 await channel.send(False)
-                # TODO should we log this? NB includes FileNotFound...
                 return
 
+            hashes = worktop.hash_cache.hash_many(files, worktop.pools, algorithm)
+            try:
+                async for file, real_hash in hashes:
+                    # N.B. real_hash is None if the file is missing or unreadable.
+                    # TODO should we log this?
+                    if real_hash != normalise(self.sous_file_hashes[file]):
+                        await channel.send(False)
+                        return
+            finally:
+                await hashes.aclose()
+
         await channel.send(True)
 
 
@@ -53,8 +70,25 @@ class CanSkipDynamic(Utensil):
 class HasChangedInSousStore(Utensil):
     purpose: str
     paths: List[str]
+    # N.B. hashes stored with a different algorithm are checked with that
+    #     algorithm, then migrated to this one if unchanged.
+    algorithm: str = DEFAULT_CHANGE_ALGORITHM
 
-    def _sync_execute(self, worktop: Worktop) -> bool:
+    def _matches(self, worktop: Worktop, file: str, stored: str, real: str) -> bool:
+        """
+        Whether the file, whose digest is now real, still has the stored digest.
+        """
+        stored_algorithm = algorithm_of(stored)
+        if stored_algorithm == self.algorithm:
+            return stored == real
+        try:
+            check_algorithm(stored_algorithm)
+            return worktop.hash_cache.hash_file(file, stored_algorithm) == stored
+        except (ValueError, RuntimeError, FileNotFoundError):
+            # can't verify it, so count it as changed
+            return False
+
+    def _sync_execute(self, worktop: Worktop, real_hashes: Dict[str, str]) -> bool:
         with sqlite3.connect(Path(worktop.dir, "sous_store.db")) as db:
             db.execute(
                 """
@@ -64,7 +98,7 @@ class HasChangedInSousStore(Utensil):
             )
             changed = False
             for file in self.paths:
-                real_hash = sha256_file(file)
+                real_hash = real_hashes[file]
                 c = db.execute(
                     "SELECT hash FROM hash_store WHERE purpose=? AND path=?",
                     (self.purpose, file),
@@ -77,7 +111,11 @@ class HasChangedInSousStore(Utensil):
                         (self.purpose, file, real_hash),
                     )
                 elif db_hash[0] != real_hash:
-                    changed = True
+                    if not self._matches(
+                        worktop, file, normalise(db_hash[0]), real_hash
+                    ):
+                        changed = True
+                    # otherwise, only the way it was stored has changed
                     db.execute(
                         "UPDATE hash_store SET hash=? WHERE purpose=? AND path=?",
                         (real_hash, self.purpose, file),
@@ -85,7 +123,15 @@ class HasChangedInSousStore(Utensil):
         return changed
 
     async def execute(self, channel: Channel, worktop: Worktop):
+        real_hashes: Dict[str, str] = {}
+        async for file, real_hash in worktop.hash_cache.hash_many(
+            self.paths, worktop.pools, self.algorithm
+        ):
+            if real_hash is None:
+                raise FileNotFoundError(f"Cannot hash {file}")
+            real_hashes[file] = real_hash
+
         answer = await asyncio.get_running_loop().run_in_executor(
-            worktop.pools.threaded, self._sync_execute, worktop
+            worktop.pools.threaded, self._sync_execute, worktop, real_hashes
         )
         await channel.send(answer)
@@ -0,0 +1,349 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import grp
+import os
+import pwd
+import secrets
+import shutil
+import stat
+from typing import Dict, List, Optional
+
+import attr
+
+from scone.common.chanpro import Channel
+from scone.common.hashing import DEFAULT_CHANGE_ALGORITHM
+from scone.common.misc import sha256_bytes
+from scone.sous.atomic_write import AtomicWriter, get_durability
+from scone.sous.utensils import Utensil, Worktop
+
+# Outcomes of each operation in a transaction.
+FS_UNCHANGED = "unchanged"
+FS_CREATED = "created"
+FS_CHANGED = "changed"
+# the file's content differs (or it is missing) and no content was supplied
+FS_DIFFERS = "differs"
+FS_MISSING = "missing"
+FS_REMOVED = "removed"
+FS_FAILED = "failed"
+# not attempted because an earlier operation failed
+FS_SKIPPED = "skipped"
+
+
+@attr.s(auto_attribs=True)
+class FsOperation:
+    """
+    A desired state of one path on the sous.
+
+    Kinds:
+        - directory: the path is a directory. Created if absent.
+        - file: the path is a file whose content has the SHA-256 sha256.
+            If content is given, it is written when the file differs.
+        - chmod: the path has the mode.
+        - chown: the path has the owner user and group.
+        - symlink: the path is a symbolic link pointing at target.
+        - absent: nothing exists at the path. Directories are removed
+            recursively.
+
+    For directory and file, the mode, user and group are also ensured
+    if they are specified.
+    """
+
+    kind: str
+    path: str
+    mode: Optional[int] = None
+    user: Optional[str] = None
+    group: Optional[str] = None
+    sha256: Optional[str] = None
+    content: Optional[bytes] = None
+    target: Optional[str] = None
+
+
+class _FsOperationFailed(Exception):
+    pass
+
+
+class _Applier:
+    def __init__(self, worktop: Worktop, durability: str):
+        self._worktop = worktop
+        self._durability = durability
+        self._uids: Dict[str, int] = {}
+        self._gids: Dict[str, int] = {}
+
+    def _uid(self, user: str) -> int:
+        if user not in self._uids:
+            try:
+                self._uids[user] = pwd.getpwnam(user).pw_uid
+            except KeyError:
+                raise _FsOperationFailed(f"no such user {user!r}")
+        return self._uids[user]
+
+    def _gid(self, group: str) -> int:
+        if group not in self._gids:
+            try:
+                self._gids[group] = grp.getgrnam(group).gr_gid
+            except KeyError:
+                raise _FsOperationFailed(f"no such group {group!r}")
+        return self._gids[group]
+
+    def _ensure_attributes(self, op: FsOperation, st: os.stat_result) -> bool:
+        """
+        Ensures the mode and ownership of the path, if specified.
+        Returns True if anything was changed.
+        """
+        changed = False
+
+        if op.user is not None or op.group is not None:
+            uid = -1 if op.user is None else self._uid(op.user)
+            gid = -1 if op.group is None else self._gid(op.group)
+            if uid not in (-1, st.st_uid) or gid not in (-1, st.st_gid):
+                os.chown(op.path, uid, gid, follow_symlinks=False)
+                changed = True
+
+        if op.mode is not None and stat.S_IMODE(st.st_mode) != op.mode:
+            os.chmod(op.path, op.mode)
+            changed = True
+
+        return changed
+
+    def _lstat(self, path: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(path, follow_symlinks=False)
+        except FileNotFoundError:
+            return None
+
+    def apply_directory(self, op: FsOperation) -> str:
+        st = self._lstat(op.path)
+        if st is None:
+            os.mkdir(op.path)
+            st = os.stat(op.path, follow_symlinks=False)
+            self._ensure_attributes(op, st)
+            return FS_CREATED
+
+        if not stat.S_ISDIR(st.st_mode):
+            raise _FsOperationFailed("exists but is not a directory")
+
+        return FS_CHANGED if self._ensure_attributes(op, st) else FS_UNCHANGED
+
+    def apply_file(self, op: FsOperation) -> str:
+        want_sha256 = op.sha256
+        if want_sha256 is None:
+            if op.content is None:
+                raise _FsOperationFailed("file needs sha256 or content")
+            want_sha256 = sha256_bytes(op.content)
+
+        st = self._lstat(op.path)
+        if st is not None and not stat.S_ISREG(st.st_mode):
+            raise _FsOperationFailed("exists but is not a regular file")
+
+        if st is not None:
+            if self._worktop.hash_cache.sha256_file(op.path) == want_sha256:
+                changed = self._ensure_attributes(op, st)
+                return FS_CHANGED if changed else FS_UNCHANGED
+
+        if op.content is None:
+            return FS_DIFFERS if st is not None else FS_MISSING
+
+        writer = AtomicWriter(op.path, op.mode)
+        writer.write(op.content)
+        writer.commit(self._worktop, self._durability)
+        self._ensure_attributes(op, os.stat(op.path, follow_symlinks=False))
+        return FS_CREATED if st is None else FS_CHANGED
+
+    def apply_chmod(self, op: FsOperation) -> str:
+        if op.mode is None:
+            raise _FsOperationFailed("chmod needs a mode")
+        return self._apply_existing(op)
+
+    def apply_chown(self, op: FsOperation) -> str:
+        if op.user is None and op.group is None:
+            raise _FsOperationFailed("chown needs a user or group")
+        return self._apply_existing(op)
+
+    def _apply_existing(self, op: FsOperation) -> str:
+        st = self._lstat(op.path)
+        if st is None:
+            raise _FsOperationFailed("does not exist")
+        return FS_CHANGED if self._ensure_attributes(op, st) else FS_UNCHANGED
+
+    def apply_symlink(self, op: FsOperation) -> str:
+        if op.target is None:
+            raise _FsOperationFailed("symlink needs a target")
+
+        st = self._lstat(op.path)
+        if st is None:
+            os.symlink(op.target, op.path)
+            return FS_CREATED
+
+        if not stat.S_ISLNK(st.st_mode):
+            raise _FsOperationFailed("exists but is not a symlink")
+
+        if os.readlink(op.path) == op.target:
+            return FS_UNCHANGED
+
+        # replace atomically by renaming a new link over the old one
+        directory, name = os.path.split(op.path)
+        while True:
+            # a unique name (as for AtomicWriter), so that neither a link left
+            # behind by a crash nor a concurrent transaction gets in the way
+            temp_path = os.path.join(directory, f".{name}.{secrets.token_hex(8)}")
+            try:
+                os.symlink(op.target, temp_path)
+                break
+            except FileExistsError:
+                continue
+        try:
+            os.rename(temp_path, op.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return FS_CHANGED
+
+    def apply_absent(self, op: FsOperation) -> str:
+        st = self._lstat(op.path)
+        if st is None:
+            return FS_UNCHANGED
+        if stat.S_ISDIR(st.st_mode):
+            shutil.rmtree(op.path)
+        else:
+            os.unlink(op.path)
+        return FS_REMOVED
+
+    def apply(self, op: FsOperation) -> str:
+        applier = getattr(self, f"apply_{op.kind}", None)
+        if applier is None:
+            raise _FsOperationFailed(f"unknown operation kind {op.kind!r}")
+        return applier(op)
+
+
+@attr.s(auto_attribs=True)
+class FsTransaction(Utensil):
+    """
+    Applies a list of desired-state filesystem operations in order,
+    only changing what differs.
+
+    Stops at the first failed operation; any further operations are reported
+    as skipped.
+    """
+
+    operations: List[FsOperation]
+    # durability of written files; None for the sous' configured default.
+    durability: Optional[str] = None
+
+    @attr.s(auto_attribs=True)
+    class Result:
+        # one outcome per operation
+        outcomes: List[str]
+        # description of the failure, if an operation failed.
+        error: Optional[str] = None
+
+    def _sync_execute(self, worktop: Worktop) -> "FsTransaction.Result":
+        applier = _Applier(worktop, get_durability(worktop, self.durability))
+        outcomes: List[str] = []
+        for op in self.operations:
+            try:
+                outcomes.append(applier.apply(op))
+            except (_FsOperationFailed, OSError) as e:
+                outcomes.append(FS_FAILED)
+                outcomes += [FS_SKIPPED] * (len(self.operations) - len(outcomes))
+                return FsTransaction.Result(
+                    outcomes=outcomes, error=f"{op.kind} {op.path}: {e}"
+                )
+        return FsTransaction.Result(outcomes=outcomes)
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        result = await asyncio.get_running_loop().run_in_executor(
+            worktop.pools.threaded, self._sync_execute, worktop
+        )
+        await channel.send(result)
+
+
+@attr.s(auto_attribs=True)
+class ManifestEntry:
+    # file, directory, symlink or other
+    kind: str
+    # permission bits
+    mode: int
+    size: int
+    # tagged digest
+    digest: Optional[str] = None
+
+
+@attr.s(auto_attribs=True)
+class DirectoryManifest(Utensil):
+    """
+    Lists everything beneath a directory, keyed by relative path.
+
+    Files are only hashed if they appear in hash_if_size with the same size,
+    as a file of any other size is known to differ anyway.
+    """
+
+    path: str
+    # relative path → size
+    hash_if_size: Dict[str, int]
+    algorithm: str = DEFAULT_CHANGE_ALGORITHM
+
+    @attr.s(auto_attribs=True)
+    class Result:
+        # None if the directory does not exist
+        entries: Optional[Dict[str, ManifestEntry]]
+
+    def _sync_list(self) -> Optional[Dict[str, ManifestEntry]]:
+        if not os.path.isdir(self.path):
+            return None
+
+        entries: Dict[str, ManifestEntry] = {}
+        to_visit = [""]
+        while to_visit:
+            relative_dir = to_visit.pop()
+            with os.scandir(os.path.join(self.path, relative_dir)) as scandir:
+                for dir_entry in scandir:
+                    relative = os.path.join(relative_dir, dir_entry.name)
+                    st = dir_entry.stat(follow_symlinks=False)
+                    if stat.S_ISREG(st.st_mode):
+                        kind = "file"
+                    elif stat.S_ISDIR(st.st_mode):
+                        kind = "directory"
+                        to_visit.append(relative)
+                    elif stat.S_ISLNK(st.st_mode):
+                        kind = "symlink"
+                    else:
+                        kind = "other"
+                    entries[relative] = ManifestEntry(
+                        kind=kind, mode=stat.S_IMODE(st.st_mode), size=st.st_size
+                    )
+        return entries
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        entries = await asyncio.get_running_loop().run_in_executor(
+            worktop.pools.threaded, self._sync_list
+        )
+
+        if entries is not None:
+            to_hash = {
+                os.path.join(self.path, relative): entry
+                for relative, entry in entries.items()
+                if entry.kind == "file"
+                and self.hash_if_size.get(relative) == entry.size
+            }
+            async for path, digest in worktop.hash_cache.hash_many(
+                list(to_hash.keys()), worktop.pools, self.algorithm
+            ):
+                to_hash[path].digest = digest
+
+        await channel.send(DirectoryManifest.Result(entries=entries))
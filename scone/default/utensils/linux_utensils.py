@@ -15,7 +15,10 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import grp
 import pwd
+from typing import Dict, List
 
 import attr
 
@@ -50,3 +53,58 @@ class GetPasswdEntry(Utensil):
                 shell=entry.pw_shell,
             )
         )
+
+
+@attr.s(auto_attribs=True)
+class GroupEntry:
+    gid: int
+    members: List[str]
+
+
+@attr.s(auto_attribs=True)
+class GetGroupEntry(Utensil):
+    group_name: str
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        try:
+            entry = grp.getgrnam(self.group_name)
+        except KeyError:
+            await channel.send(None)
+            return
+
+        await channel.send(GroupEntry(gid=entry.gr_gid, members=list(entry.gr_mem)))
+
+
+@attr.s(auto_attribs=True)
+class GetNssSnapshot(Utensil):
+    """
+    Sends the whole passwd and group databases in one go.
+    """
+
+    @attr.s(auto_attribs=True)
+    class Result:
+        users: Dict[str, GetPasswdEntry.Result]
+        groups: Dict[str, GroupEntry]
+
+    @staticmethod
+    def _sync_execute() -> "GetNssSnapshot.Result":
+        users = {
+            entry.pw_name: GetPasswdEntry.Result(
+                uid=entry.pw_uid,
+                gid=entry.pw_gid,
+                home=entry.pw_dir,
+                shell=entry.pw_shell,
+            )
+            for entry in pwd.getpwall()
+        }
+        groups = {
+            entry.gr_name: GroupEntry(gid=entry.gr_gid, members=list(entry.gr_mem))
+            for entry in grp.getgrall()
+        }
+        return GetNssSnapshot.Result(users=users, groups=groups)
+
+    async def execute(self, channel: Channel, worktop: Worktop):
+        result = await asyncio.get_running_loop().run_in_executor(
+            worktop.pools.threaded, self._sync_execute
+        )
+        await channel.send(result)
@@ -21,14 +21,19 @@ import os
 import sys
 import time
 from argparse import ArgumentParser
+from contextlib import nullcontext
 from pathlib import Path
 
 from scone.common.misc import eprint
 from scone.common.pools import Pools
 from scone.head import dot_emitter
 from scone.head.dependency_tracking import DependencyCache
+from scone.head.durations import DurationStore
+from scone.head.fingerprints import FingerprintStore
 from scone.head.head import Head
 from scone.head.kitchen import Kitchen, Preparation
+from scone.head.scheduling import limit_opt
+from scone.head.tracing import HEAD_PROCESS, Tracer
 
 
 def cli() -> None:
@@ -40,6 +45,11 @@ def cli() -> None:
 
 async def cli_async() -> int:
     dep_cache = None
+    durations = None
+    fingerprints = None
+    tracer = None
+    trace_path = None
+    inputs_digest = None
     try:
         args = sys.argv[1:]
 
@@ -52,6 +62,57 @@ async def cli_async() -> int:
             default=False,
             help="Don't prompt for confirmation",
         )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            default=False,
+            help="Show what would be cooked and why, without cooking anything",
+        )
+        parser.add_argument(
+            "--keep-going",
+            "-k",
+            action="store_true",
+            default=False,
+            help="Carry on cooking recipes that don't depend on a failed recipe",
+        )
+        parser.add_argument(
+            "--incremental",
+            "-i",
+            action="store_true",
+            default=False,
+            help="Only check the head's files and variables for changes, assuming"
+            " the souss are as they were left by the last run (and do nothing if"
+            " none have changed since the last successful run)",
+        )
+        parser.add_argument(
+            "--trace",
+            action="store_true",
+            default=False,
+            help="Write a timeline of the run to trace.json"
+            " (for Perfetto or chrome://tracing)",
+        )
+        parser.add_argument(
+            "--max-in-flight",
+            type=int,
+            help="Maximum number of recipes cooking at once (0 for no limit)",
+        )
+        parser.add_argument(
+            "--max-per-sous",
+            type=int,
+            help="Maximum number of recipes cooking at once on one sous",
+        )
+        parser.add_argument(
+            "--max-per-sous-user",
+            type=int,
+            help="Maximum number of recipes cooking at once as one user on a sous",
+        )
+        parser.add_argument(
+            "--max-per-kind",
+            action="append",
+            default=[],
+            metavar="KIND=N",
+            help="Maximum number of recipes of a kind cooking at once on one sous",
+        )
         argp = parser.parse_args(args)
 
         eprint("Loading head…")
@@ -64,8 +125,38 @@ async def cli_async() -> int:
                 eprint("Don't appear to be in a head. STOP.")
                 return 1
 
+        if argp.incremental:
+            fingerprints = await FingerprintStore.open(
+                os.path.join(cdir, "fingerprints.sqlite3")
+            )
+            inputs_digest = fingerprints.head_inputs_digest(str(cdir))
+            if inputs_digest == await fingerprints.last_converged(argp.hostspec):
+                eprint(
+                    f"Nothing on the head has changed since '{argp.hostspec}'"
+                    " was last cooked successfully."
+                )
+                return 0
+
         head = Head.open(str(cdir))
 
+        if argp.trace:
+            tracer = Tracer()
+            trace_path = Path(cdir, "trace.json")
+
+        limits = head.concurrency_limits
+        if argp.max_in_flight is not None:
+            limits.total = limit_opt(argp.max_in_flight)
+        if argp.max_per_sous is not None:
+            limits.per_sous = limit_opt(argp.max_per_sous)
+        if argp.max_per_sous_user is not None:
+            limits.per_sous_user = limit_opt(argp.max_per_sous_user)
+        for kind_limit in argp.max_per_kind:
+            kind, equals, limit = kind_limit.partition("=")
+            if not equals or not limit.isdigit():
+                eprint(f"--max-per-kind should be KIND=N, not '{kind_limit}'")
+                return 1
+            limits.set_kind_limit(kind, int(limit))
+
         eprint(head.debug_info())
 
         hosts = set()
@@ -85,7 +176,13 @@ async def cli_async() -> int:
         prepare = Preparation(head)
 
         start_ts = time.monotonic()
-        prepare.prepare_all()
+        preparation_span = (
+            tracer.span("preparation", "head", (HEAD_PROCESS, "preparation"))
+            if tracer is not None
+            else nullcontext()
+        )
+        with preparation_span:
+            prepare.prepare_all()
         del prepare
         end_ts = time.monotonic()
         eprint(f"Preparation completed in {end_ts - start_ts:.3f} s.")
@@ -96,7 +193,9 @@ async def cli_async() -> int:
         dep_cache = await DependencyCache.open(
             os.path.join(head.directory, "depcache.sqlite3")
         )
-
+        durations = await DurationStore.open(
+            os.path.join(head.directory, "durations.sqlite3")
+        )
         # eprint("Checking dependency cache…")
         # start_ts = time.monotonic()
         # depchecks = await run_dep_checks(head, dep_cache, order)
@@ -114,6 +213,23 @@ async def cli_async() -> int:
         #             kind, ident, extra = item
         #             print(f" - we now have {kind} {ident} {dict(extra)}")
 
+        if argp.plan:
+            eprint("Planning…")
+            plan = await Kitchen(
+                head,
+                dep_cache,
+                durations=durations,
+                tracer=tracer,
+                fingerprints=fingerprints,
+                incremental=argp.incremental,
+            ).plan()
+            for line in plan.report():
+                print(line)
+            plan_path = Path(cdir, "plan.json")
+            plan.write_json(plan_path)
+            eprint(f"Plan written to {plan_path}.")
+            return 0
+
         eprint("Ready to cook? [y/N]: ", end="")
         if argp.yes:
             eprint("y (due to --yes)")
@@ -122,7 +238,15 @@ async def cli_async() -> int:
                 eprint("Stopping.")
                 return 101
 
-        kitchen = Kitchen(head, dep_cache)
+        kitchen = Kitchen(
+            head,
+            dep_cache,
+            durations=durations,
+            keep_going=argp.keep_going,
+            tracer=tracer,
+            fingerprints=fingerprints,
+            incremental=argp.incremental,
+        )
 
         # for epoch, epoch_items in enumerate(order):
         #     print(f"Cooking Course {epoch} of {len(order)}")
@@ -137,12 +261,40 @@ async def cli_async() -> int:
             await kitchen.cook_all()
         finally:
             dot_emitter.emit_dot(head.dag, Path(cdir, "dag.9.dot"))
+            for line in kitchen.telemetry_report():
+                eprint(line)
+            if kitchen.timings:
+                eprint("Slowest recipes:")
+                for line in kitchen.slowest_report():
+                    eprint(f" {line}")
+            if kitchen.failures:
+                eprint(
+                    f"{len(kitchen.failures)} recipes failed,"
+                    f" blocking {len(kitchen.blocked)} others:"
+                )
+                for line in kitchen.failure_report():
+                    eprint(f" {line}")
+
+        if kitchen.failures:
+            return 1
+
+        if fingerprints is not None and inputs_digest is not None:
+            await fingerprints.record_converged(argp.hostspec, inputs_digest)
 
         return 0
     finally:
+        if tracer is not None and trace_path is not None:
+            tracer.write(trace_path)
+            eprint(f"Trace written to {trace_path}.")
         Pools.get().shutdown()
         if dep_cache:
             await dep_cache.db.close()
+        if durations:
+            await durations.save()
+            await durations.db.close()
+        if fingerprints:
+            await fingerprints.save()
+            await fingerprints.db.close()
 
 
 if __name__ == "__main__":
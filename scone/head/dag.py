@@ -17,7 +17,7 @@
 
 from collections import defaultdict
 from enum import Enum
-from typing import Dict, Optional, Set, Union
+from typing import Dict, List, Optional, Set, Union
 
 import attr
 from frozendict import frozendict
@@ -50,6 +50,9 @@ class RecipeState(Enum):
     # This recipe failed.
     FAILED = -1
 
+    # This recipe was not cooked because something it depends on failed.
+    BLOCKED = -2
+
     @staticmethod
     def is_completed(state):
         return state in (RecipeState.COOKED, RecipeState.SKIPPED)
@@ -211,3 +214,63 @@ class RecipeDag:
             after_meta.incoming_uncompleted += 1
             # TODO if after_meta.state ==
         # TODO else ...
+
+    def reachable(self, start: Vertex, backwards: bool = False) -> Set[Vertex]:
+        """
+        The vertices reachable from (or, if backwards, that can reach) the start
+        vertex, excluding the start vertex itself.
+        """
+        edges = self.reverse_edges if backwards else self.edges
+        found: Set[Vertex] = set()
+        to_visit = [start]
+        while to_visit:
+            for vertex in edges[to_visit.pop()]:
+                if vertex not in found:
+                    found.add(vertex)
+                    to_visit.append(vertex)
+        return found
+
+    def _count_uncompleted(self, vertex: Vertex) -> int:
+        count = 0
+        for before in self.reverse_edges[vertex]:
+            if isinstance(before, Recipe):
+                if not RecipeState.is_completed(self.recipe_meta[before].state):
+                    count += 1
+            elif not self.resource_meta[before].completed:
+                count += 1
+        return count
+
+    def merge(self, recipes: List["Recipe"], merged: "Recipe") -> None:
+        """
+        Replaces the recipes with a single recipe having the union of their
+        edges.
+        The caller must make sure that no recipe reaches another, as that would
+        create a cycle.
+        """
+        replaced = set(recipes)
+        self.add(merged)
+        self.recipe_meta[merged].state = self.recipe_meta[recipes[0]].state
+        to_recount: Set[Vertex] = {merged}
+
+        for recipe in recipes:
+            for before in self.reverse_edges.pop(recipe, set()):
+                self.edges[before].discard(recipe)
+                if before not in replaced:
+                    self.edges[before].add(merged)
+                    self.reverse_edges[merged].add(before)
+            for after in self.edges.pop(recipe, set()):
+                self.reverse_edges[after].discard(recipe)
+                if after not in replaced:
+                    self.edges[merged].add(after)
+                    self.reverse_edges[after].add(merged)
+                    to_recount.add(after)
+            self.vertices.remove(recipe)
+            del self.recipe_meta[recipe]
+
+        for vertex in to_recount:
+            meta: Union[RecipeMeta, ResourceMeta]
+            if isinstance(vertex, Recipe):
+                meta = self.recipe_meta[vertex]
+            else:
+                meta = self.resource_meta[vertex]
+            meta.incoming_uncompleted = self._count_uncompleted(vertex)
@@ -20,7 +20,8 @@ import logging
 import time
 from copy import deepcopy
 from hashlib import sha256
-from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Set, Tuple, Union
 
 import aiosqlite
 import attr
@@ -29,7 +30,7 @@ import cattr
 from aiosqlite import Connection
 
 from scone.head.dag import Resource
-from scone.head.recipe import recipe_name_getter
+from scone.head.recipe import recipe_kind
 from scone.head.variables import Variables
 
 if TYPE_CHECKING:
@@ -63,6 +64,10 @@ def hash_dict(value: dict) -> str:
     ).hexdigest()
 
 
+def hash_variable(value: Any) -> str:
+    return hash_dict({"value": value})
+
+
 def paramhash_recipe(recipe: "Recipe") -> str:
     return hash_dict(
         {
@@ -75,11 +80,22 @@ def paramhash_recipe(recipe: "Recipe") -> str:
 
 @attr.s(auto_attribs=True)
 class DependencyBook:
-    provided: Dict[Resource, int] = dict()
-    watching: Dict[Resource, int] = dict()
+    # resource → time (ms) it was provided by this recipe
+    provided: Dict[Resource, int] = attr.Factory(dict)
+    # resource → time (ms) it had been provided when this recipe cooked
+    watching: Dict[Resource, int] = attr.Factory(dict)
     last_changed: int = 0
-    cache_data: Dict[str, Any] = dict()
+    # recipe-specific data to remember until the next time the recipe cooks
+    cache_data: Dict[str, Any] = attr.Factory(dict)
+    # if True, the recipe has inputs that we can't track, so must always cook
     ignored: bool = False
+    # path of a file or directory on the head (e.g. in the fridge) → digest
+    # (None if it was missing)
+    head_file_hashes: Dict[str, Optional[str]] = attr.Factory(dict)
+    # path of a file on the sous → digest
+    dyn_sous_file_hashes: Dict[str, str] = attr.Factory(dict)
+    # dotted variable name → hash of its value
+    var_hashes: Dict[str, str] = attr.Factory(dict)
 
     # TODO(performance, feature): track more in-depth details, perhaps as a
     #     per-resource cache thing, so that we can track the info needed to know
@@ -92,10 +108,13 @@ class DependencyBook:
             "last_changed": self.last_changed,
             "cache_data": self.cache_data,
             "ignored": self.ignored,
+            "head_file_hashes": self.head_file_hashes,
+            "dyn_sous_file_hashes": self.dyn_sous_file_hashes,
+            "var_hashes": self.var_hashes,
         }
 
     @staticmethod
-    def _structure(dictionary: dict) -> "DependencyBook":
+    def _structure(dictionary: dict, _cls: type) -> "DependencyBook":
         provided = {cattr.structure(k, Resource): v for k, v in dictionary["provided"]}
         watching = {cattr.structure(k, Resource): v for k, v in dictionary["watching"]}
 
@@ -105,6 +124,10 @@ class DependencyBook:
             last_changed=dictionary["last_changed"],
             cache_data=dictionary["cache_data"],
             ignored=dictionary["ignored"],
+            # (absent from books stored by older versions)
+            head_file_hashes=dictionary.get("head_file_hashes", {}),
+            dyn_sous_file_hashes=dictionary.get("dyn_sous_file_hashes", {}),
+            var_hashes=dictionary.get("var_hashes", {}),
         )
 
 
@@ -122,34 +145,46 @@ class DependencyTracker:
         self._dag: "RecipeDag" = dag
         self._recipe: "Recipe" = recipe
         self._time: int = int(time.time() * 1000)
+        # paths on the head to hash once the recipe has cooked
+        self.head_paths: Set[Path] = set()
 
     def watch(self, resource: Resource) -> None:
-        # XXX self.book.watching[resource] = self._dag.resource_time[resource]
-        self.book.watching[resource] = -42
+        self.book.watching[resource] = self._dag.resource_time.get(resource, 0)
 
     def provide(self, resource: Resource, time: Optional[int] = None) -> None:
         if time is None:
             time = self._time
-        self._dag.resource_time[resource] = time
+        self.book.provided[resource] = time
+        # the resource has changed as of its latest provider
+        self._dag.resource_time[resource] = max(
+            time, self._dag.resource_time.get(resource, 0)
+        )
 
     def ignore(self) -> None:
         self.book.ignored = True
 
+    def set_cache_data(self, key: str, value: Any) -> None:
+        """
+        Remembers a value (which must be JSON-serialisable) for the next time
+        the recipe cooks; see Kitchen.get_previous_cache_data.
+        """
+        self.book.cache_data[key] = value
+
     def register_variable(self, variable: str, value: Union[dict, str, int]):
-        # self._vars[variable] = value
-        # TODO(implement)
-        logger.critical("not implemented: register var %s", variable)
+        self.book.var_hashes[variable] = hash_variable(value)
 
-    def register_fridge_file(self, desugared_path: str):
-        # TODO this is not complete
-        fridge_res = Resource("fridge", desugared_path, None)
-        self.watch(fridge_res)
+    def register_fridge_file(self, desugared_path: str, real_path: Path):
+        """
+        Registers a file or directory in the fridge as an input of the recipe.
+        """
+        self.head_paths.add(real_path)
 
-    def register_remote_file(self, path: str, sous: Optional[str] = None):
-        sous = sous or self._recipe.recipe_context.sous
-        # TODO this is not complete
-        file_res = Resource("file", path, sous=sous)
-        self.watch(file_res)
+    def register_remote_file(self, path: str, digest: str):
+        """
+        Registers a file on the sous, with the digest it had when it was used,
+        as an input of the recipe.
+        """
+        self.book.dyn_sous_file_hashes[path] = digest
 
     def get_j2_var_proxies(
         self, variables: Variables
@@ -242,7 +277,7 @@ class DependencyCache:
                 AND paramhash = ?
                 LIMIT 1
             """,
-            (recipe_name_getter(recipe.__class__), paramhash,),
+            (recipe_kind(recipe.__class__), paramhash,),
         )
         rows = list(rows)
         if not rows:
@@ -273,7 +308,7 @@ class DependencyCache:
                     ts = excluded.ts
             """,
             (
-                recipe_name_getter(recipe.__class__),
+                recipe_kind(recipe.__class__),
                 paramhash,
                 canonicaljson.encode_canonical_json(cattr.unstructure(dep_book)),
                 self.time,
@@ -282,11 +317,27 @@ class DependencyCache:
         await self.db.commit()
 
     async def renew(self, rowid: int):
-        # TODO(perf): batch up many renews
+        await self.renew_many([rowid])
+
+    async def renew_many(self, rowids: Iterable[int]):
+        await self.db.executemany(
+            """
+            UPDATE dishcache SET ts = ? WHERE rowid = ?;
+            """,
+            [(self.time, rowid) for rowid in rowids],
+        )
+        await self.db.commit()
+
+    async def forget(self, recipe: "Recipe"):
+        """
+        Forgets the recipe, so that it is not skipped next time.
+        """
         await self.db.execute(
             """
-            UPDATE dishcache SET ts = ? WHERE rowid = ? LIMIT 1;
+            DELETE FROM dishcache
+                WHERE recipe_kind = ?
+                AND paramhash = ?
             """,
-            (self.time, rowid),
+            (recipe_kind(recipe.__class__), paramhash_recipe(recipe)),
         )
         await self.db.commit()
@@ -19,7 +19,7 @@ from pathlib import Path
 from typing import Dict
 
 from scone.head.dag import RecipeDag, RecipeState, Resource, Vertex
-from scone.head.recipe import Recipe, recipe_name_getter
+from scone.head.recipe import Recipe, recipe_kind
 
 state_to_colour = {
     RecipeState.LOADED: ("white", "black"),
@@ -30,6 +30,7 @@ state_to_colour = {
     RecipeState.SKIPPED: ("cadetblue1", "black"),
     RecipeState.BEING_COOKED: ("darkorange1", "black"),
     RecipeState.FAILED: ("black", "orange"),
+    RecipeState.BLOCKED: ("gray40", "white"),
 }
 
 
@@ -47,7 +48,7 @@ def emit_dot(dag: RecipeDag, path_out: Path) -> None:
             if isinstance(vertex, Recipe):
                 rec_meta = dag.recipe_meta[vertex]
                 label = (
-                    f"{recipe_name_getter(vertex.__class__)}"
+                    f"{recipe_kind(vertex.__class__)}"
                     f" [{rec_meta.incoming_uncompleted}]"
                 )
                 colour, text_colour = state_to_colour[rec_meta.state]
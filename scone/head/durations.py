@@ -0,0 +1,288 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+import aiosqlite
+import attr
+from aiosqlite import Connection
+
+from scone.common.chanpro import Channel
+from scone.head.dependency_tracking import paramhash_recipe
+from scone.head.recipe import Recipe, recipe_kind
+
+# Weight given to the latest sample in the smoothed durations.
+SMOOTHING = 0.3
+
+# (recipe kind, paramhash, sous)
+DurationKey = Tuple[str, str, str]
+
+
+@attr.s(auto_attribs=True)
+class CookTiming:
+    """
+    Where the wall time (in seconds) of cooking a recipe went.
+    """
+
+    # cookable, but waiting for a free slot
+    queue_wait: float = 0.0
+    # waiting on the sous
+    remote: float = 0.0
+    # everything else, whilst cooking
+    head: float = 0.0
+
+    @property
+    def cook(self) -> float:
+        return self.remote + self.head
+
+
+class CookTimer:
+    """
+    Measures a recipe's CookTiming as it is queued and cooked.
+    """
+
+    def __init__(self):
+        self.ready_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._remote_depth = 0
+        self._remote_since = 0.0
+        self.timing = CookTiming()
+
+    def started(self) -> None:
+        self.started_at = time.monotonic()
+        self.timing.queue_wait = self.started_at - self.ready_at
+
+    def finished(self) -> CookTiming:
+        assert self.started_at is not None
+        elapsed = time.monotonic() - self.started_at
+        self.timing.head = max(0.0, elapsed - self.timing.remote)
+        return self.timing
+
+    @contextmanager
+    def remote(self) -> Iterator[None]:
+        """
+        Counts the time within as remote time.
+        (Overlapping remote waits are only counted once.)
+        """
+        if self._remote_depth == 0:
+            self._remote_since = time.monotonic()
+        self._remote_depth += 1
+        try:
+            yield
+        finally:
+            self._remote_depth -= 1
+            if self._remote_depth == 0:
+                self.timing.remote += time.monotonic() - self._remote_since
+
+
+class TimedChannel:
+    """
+    Wraps a channel, counting the time spent talking over it as a recipe's
+    remote time.
+    """
+
+    def __init__(self, channel: Channel, timer: CookTimer):
+        self._channel = channel
+        self._timer = timer
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._channel, name)
+
+    def __str__(self):
+        return str(self._channel)
+
+    async def send(self, payload: Any):
+        with self._timer.remote():
+            await self._channel.send(payload)
+
+    async def recv(self) -> Any:
+        with self._timer.remote():
+            return await self._channel.recv()
+
+    async def close(self, reason: Optional[str] = None):
+        with self._timer.remote():
+            if reason is None:
+                await self._channel.close()
+            else:
+                await self._channel.close(reason)
+
+    async def wait_close(self):
+        with self._timer.remote():
+            await self._channel.wait_close()
+
+    async def consume(self) -> Any:
+        with self._timer.remote():
+            return await self._channel.consume()
+
+
+def _smooth(old: float, new: float) -> float:
+    return old + SMOOTHING * (new - old)
+
+
+class DurationStore:
+    """
+    Remembers how long recipes took to cook, and how long it took to find that
+    they could be skipped, as exponentially-smoothed averages, so that runs can
+    be scheduled and their duration estimated.
+    """
+
+    def __init__(self):
+        self.db: Connection = None  # type: ignore
+        self.averages: Dict[DurationKey, CookTiming] = dict()
+        self.skip_averages: Dict[DurationKey, float] = dict()
+        # mean cooking time of each recipe kind, for recipes never seen before
+        self._kind_averages: Dict[str, float] = dict()
+        # skips are frequent, so they are only written out on save()
+        self._unsaved_skips: Set[DurationKey] = set()
+
+    @classmethod
+    async def open(cls, path: str) -> "DurationStore":
+        ds = DurationStore()
+        ds.db = await aiosqlite.connect(path)
+        await ds.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS durations (
+                recipe_kind TEXT,
+                paramhash TEXT,
+                sous TEXT,
+                queue_wait REAL,
+                remote REAL,
+                head REAL,
+                skip REAL,
+                ts INT,
+                PRIMARY KEY (recipe_kind, paramhash, sous)
+            );
+            """
+        )
+        await ds.db.commit()
+
+        rows = await ds.db.execute_fetchall(
+            """
+            SELECT recipe_kind, paramhash, sous, queue_wait, remote, head, skip
+                FROM durations
+            """
+        )
+        for kind, paramhash, sous, queue_wait, remote, head, skip in rows:
+            key = (kind, paramhash, sous)
+            if head is not None:
+                ds.averages[key] = CookTiming(queue_wait, remote, head)
+            if skip is not None:
+                ds.skip_averages[key] = skip
+        ds._update_kind_averages()
+        return ds
+
+    def _update_kind_averages(self) -> None:
+        totals: Dict[str, Tuple[float, int]] = dict()
+        for (kind, _paramhash, _sous), timing in self.averages.items():
+            total, count = totals.get(kind, (0.0, 0))
+            totals[kind] = total + timing.cook, count + 1
+        self._kind_averages = {
+            kind: total / count for kind, (total, count) in totals.items()
+        }
+
+    @staticmethod
+    def key_for(recipe: Recipe) -> DurationKey:
+        return (
+            recipe_kind(recipe.__class__),
+            paramhash_recipe(recipe),
+            recipe.recipe_context.sous,
+        )
+
+    def estimate(self, recipe: Recipe) -> Optional[float]:
+        """
+        The expected time to cook the recipe, or None if no recipe of its kind
+        has been seen before.
+        """
+        key = self.key_for(recipe)
+        average = self.averages.get(key)
+        if average is not None:
+            return average.cook
+        return self._kind_averages.get(key[0])
+
+    def estimate_skip(self, recipe: Recipe) -> Optional[float]:
+        """
+        The expected time to find that the recipe can be skipped, or None if
+        it has never been skipped before.
+        """
+        return self.skip_averages.get(self.key_for(recipe))
+
+    def record_skip(self, recipe: Recipe, seconds: float) -> None:
+        key = self.key_for(recipe)
+        average = self.skip_averages.get(key)
+        if average is not None:
+            seconds = _smooth(average, seconds)
+        self.skip_averages[key] = seconds
+        self._unsaved_skips.add(key)
+
+    async def record(self, recipe: Recipe, timing: CookTiming) -> None:
+        key = self.key_for(recipe)
+        average = self.averages.get(key)
+        if average is None:
+            average = attr.evolve(timing)
+        else:
+            average = CookTiming(
+                _smooth(average.queue_wait, timing.queue_wait),
+                _smooth(average.remote, timing.remote),
+                _smooth(average.head, timing.head),
+            )
+        self.averages[key] = average
+
+        await self.db.execute(
+            """
+            INSERT INTO durations
+                (recipe_kind, paramhash, sous, queue_wait, remote, head, ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (recipe_kind, paramhash, sous)
+                DO UPDATE SET
+                    queue_wait = excluded.queue_wait,
+                    remote = excluded.remote,
+                    head = excluded.head,
+                    ts = excluded.ts
+            """,
+            (
+                *key,
+                average.queue_wait,
+                average.remote,
+                average.head,
+                int(time.time() * 1000),
+            ),
+        )
+        await self.db.commit()
+
+    async def save(self) -> None:
+        """
+        Stores the skip durations recorded since the last save.
+        """
+        now = int(time.time() * 1000)
+        rows = [(*key, self.skip_averages[key], now) for key in self._unsaved_skips]
+        self._unsaved_skips.clear()
+        if not rows:
+            return
+        await self.db.executemany(
+            """
+            INSERT INTO durations (recipe_kind, paramhash, sous, skip, ts)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (recipe_kind, paramhash, sous)
+                DO UPDATE SET
+                    skip = excluded.skip,
+                    ts = excluded.ts
+            """,
+            rows,
+        )
+        await self.db.commit()
@@ -0,0 +1,186 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiosqlite
+from aiosqlite import Connection
+
+from scone.common.hashing import (
+    DEFAULT_CHANGE_ALGORITHM,
+    RACY_WINDOW_NS,
+    hash_bytes,
+    hash_file,
+    hash_path,
+)
+
+# (absolute path, algorithm)
+FingerprintKey = Tuple[str, str]
+
+# (modification time in ns, size, digest)
+Fingerprint = Tuple[int, int, str]
+
+# The inputs on the head that loading and preparing the recipes depends on,
+# relative to the head directory: its configuration, menus, variables and fridge.
+HEAD_INPUT_GLOBS = (
+    "scone.head.toml",
+    "menu/**/*.scoml",
+    "vars/**/*.v.toml",
+    "vars/**/*.vf.toml",
+)
+HEAD_INPUT_DIRS = ("fridge",)
+
+
+class FingerprintStore:
+    """
+    Remembers the digests of files on the head, along with their modification
+    times and sizes, so that files which haven't been touched since they were
+    last hashed don't need to be read again.
+    Files modified just before they were hashed are not remembered.
+    """
+
+    def __init__(self):
+        self.db: Connection = None  # type: ignore
+        self.fingerprints: Dict[FingerprintKey, Fingerprint] = dict()
+        self._updated: Set[FingerprintKey] = set()
+        # files are hashed in worker threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    async def open(cls, path: str) -> "FingerprintStore":
+        fs = FingerprintStore()
+        fs.db = await aiosqlite.connect(path)
+        await fs.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                path TEXT,
+                algorithm TEXT,
+                mtime_ns INT,
+                size INT,
+                digest TEXT,
+                PRIMARY KEY (path, algorithm)
+            );
+            CREATE TABLE IF NOT EXISTS converged (
+                hostspec TEXT PRIMARY KEY,
+                inputs_digest TEXT,
+                ts INT
+            );
+            """
+        )
+        await fs.db.commit()
+
+        rows = await fs.db.execute_fetchall(
+            "SELECT path, algorithm, mtime_ns, size, digest FROM fingerprints"
+        )
+        for path, algorithm, mtime_ns, size, digest in rows:
+            fs.fingerprints[(path, algorithm)] = (mtime_ns, size, digest)
+        return fs
+
+    def hash_file(self, path: str, algorithm: str) -> str:
+        """
+        Like scone.common.hashing.hash_file, but only reads the file if it
+        has been modified since it was last hashed.
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), algorithm)
+        with self._lock:
+            known = self.fingerprints.get(key)
+        if known is not None:
+            mtime_ns, size, digest = known
+            if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+                return digest
+
+        digest = hash_file(path, algorithm)
+        if stat.st_mtime_ns > time.time_ns() - RACY_WINDOW_NS:
+            # too fresh to trust; it may be modified again without the mtime
+            # changing (as in scone.sous.hash_cache).
+            return digest
+        with self._lock:
+            self.fingerprints[key] = (stat.st_mtime_ns, stat.st_size, digest)
+            self._updated.add(key)
+        return digest
+
+    def hash_path(self, path: str, algorithm: str) -> str:
+        """
+        Hashes a file or a directory tree, reading only the files that have
+        been modified since they were last hashed.
+        """
+        return hash_path(path, algorithm, self.hash_file)
+
+    async def save(self) -> None:
+        """
+        Stores the fingerprints of the files hashed since the last save.
+        """
+        with self._lock:
+            rows = [(*key, *self.fingerprints[key]) for key in self._updated]
+            self._updated.clear()
+        if not rows:
+            return
+        await self.db.executemany(
+            """
+            INSERT OR REPLACE INTO fingerprints
+                (path, algorithm, mtime_ns, size, digest)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        await self.db.commit()
+
+    def head_inputs_digest(self, directory: str) -> str:
+        """
+        A digest of all the inputs on the head that loading and preparing the
+        recipes depends on.
+        """
+        head_dir = Path(directory)
+        paths: List[Path] = []
+        for pattern in HEAD_INPUT_GLOBS:
+            paths += head_dir.glob(pattern)
+        for input_dir in HEAD_INPUT_DIRS:
+            if Path(head_dir, input_dir).exists():
+                paths.append(Path(head_dir, input_dir))
+
+        lines = []
+        for path in sorted(paths):
+            digest = self.hash_path(str(path), DEFAULT_CHANGE_ALGORITHM)
+            lines.append(f"{path.relative_to(head_dir)}\0{digest}\n")
+        return hash_bytes("".join(lines).encode(), DEFAULT_CHANGE_ALGORITHM)
+
+    async def last_converged(self, hostspec: str) -> Optional[str]:
+        """
+        The digest of the head's inputs when the hostspec was last cooked
+        successfully, if it has been.
+        """
+        rows = await self.db.execute_fetchall(
+            "SELECT inputs_digest FROM converged WHERE hostspec = ?", (hostspec,)
+        )
+        for (inputs_digest,) in rows:
+            return inputs_digest
+        return None
+
+    async def record_converged(self, hostspec: str, inputs_digest: str) -> None:
+        await self.db.execute(
+            """
+            INSERT OR REPLACE INTO converged (hostspec, inputs_digest, ts)
+                VALUES (?, ?, ?)
+            """,
+            (hostspec, inputs_digest, int(time.time() * 1000)),
+        )
+        await self.db.commit()
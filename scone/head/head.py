@@ -26,12 +26,14 @@ from typing import Any, Dict, Iterable, List, Optional, Tuple, cast
 import toml
 from nacl.encoding import URLSafeBase64Encoder
 
+from scone.common.hashing import DEFAULT_CHANGE_ALGORITHM, check_algorithm
 from scone.common.loader import ClassLoader
 from scone.common.misc import eprint
 from scone.common.pools import Pools
 from scone.head.dag import RecipeDag
 from scone.head.menu_reader import MenuLoader
 from scone.head.recipe import Recipe, recipe_name_getter
+from scone.head.scheduling import ConcurrencyLimits
 from scone.head.secrets import SecretAccess
 from scone.head.variables import Variables, merge_right_into_left_inplace
 
@@ -47,6 +49,8 @@ class Head:
         groups: Dict[str, List[str]],
         secret_access: Optional[SecretAccess],
         pools: Pools,
+        change_hash: str = DEFAULT_CHANGE_ALGORITHM,
+        concurrency_limits: Optional[ConcurrencyLimits] = None,
     ):
         self.directory = directory
         self.recipe_loader = recipe_loader
@@ -56,6 +60,9 @@ class Head:
         self.secret_access = secret_access
         self.variables: Dict[str, Variables] = dict()
         self.pools = pools
+        # hash algorithm used to detect changes (not for integrity checks)
+        self.change_hash = change_hash
+        self.concurrency_limits = concurrency_limits or ConcurrencyLimits()
 
     @staticmethod
     def open(directory: str):
@@ -83,7 +90,24 @@ class Head:
 
         pools = Pools()
 
-        head = Head(directory, recipe_loader, sous, groups, secret_access, pools)
+        change_hash = check_algorithm(
+            head_data.get("hashing", {}).get(
+                "change_detection", DEFAULT_CHANGE_ALGORITHM
+            )
+        )
+
+        concurrency_limits = ConcurrencyLimits.from_config(head_data.get("kitchen", {}))
+
+        head = Head(
+            directory,
+            recipe_loader,
+            sous,
+            groups,
+            secret_access,
+            pools,
+            change_hash,
+            concurrency_limits,
+        )
         head._load_variables()
         head._load_menus()
         return head
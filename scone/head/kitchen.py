@@ -17,15 +17,32 @@
 
 import asyncio
 import logging
-from asyncio import Future, Queue
-from collections import deque
+import time
+from asyncio import Future
+from collections import defaultdict, deque
+from contextlib import nullcontext
 from contextvars import ContextVar
-from typing import Any, Deque, Dict, Optional, Tuple, Type, TypeVar
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
 import cattr
 from frozendict import frozendict
 
 from scone.common.chanpro import Channel, ChanProHead
+from scone.common.hashing import algorithm_of, hash_path, normalise
 from scone.common.misc import eprint
 from scone.head import sshconn
 from scone.head.dag import RecipeMeta, RecipeState, Resource, Vertex
@@ -33,19 +50,86 @@ from scone.head.dependency_tracking import (
     DependencyBook,
     DependencyCache,
     DependencyTracker,
+    hash_variable,
 )
+from scone.head.durations import CookTimer, CookTiming, DurationStore, TimedChannel
+from scone.head.fingerprints import FingerprintStore
 from scone.head.head import Head
-from scone.head.recipe import Recipe
+from scone.head.planning import ACTION_COOK, ACTION_SKIP, Plan, PlannedRecipe, SousPlan
+from scone.head.recipe import Recipe, recipe_kind
+from scone.head.scheduling import (
+    ConcurrencyLimits,
+    ReadyQueue,
+    critical_path,
+    critical_path_lengths,
+)
+from scone.head.tracing import HEAD_PROCESS, Tracer, Track, recipe_track
 from scone.sous import utensil_namer
+from scone.sous.telemetry import SousTelemetry
 from scone.sous.utensils import Utensil
 
 logger = logging.getLogger(__name__)
 
+# How often (in seconds) souss send telemetry, unless configured otherwise
+# with telemetry_interval in the sous' section of scone.head.toml (0 to disable).
+DEFAULT_TELEMETRY_INTERVAL = 5.0
+
+# Thresholds beyond which a sous is considered saturated.
+SATURATED_LOAD_PER_CPU = 1.5
+SATURATED_PSI_CPU_SOME = 60.0
+SATURATED_PSI_MEMORY_FULL = 10.0
+SATURATED_PSI_IO_FULL = 30.0
+
+# How many times a recipe for a saturated sous may be passed over to let other
+# souss' recipes go first.
+MAX_SATURATION_DEFERRALS = 3
+
+# Expected duration (in seconds) of a recipe with no history of its kind,
+# for prioritising the critical path and estimating the run time.
+DEFAULT_EXPECTED_DURATION = 1.0
+# ... and of finding that a recipe which has never been skipped can be.
+DEFAULT_EXPECTED_SKIP_DURATION = 0.1
+
+# How often (in seconds) to show the progress and ETA of the run.
+PROGRESS_INTERVAL = 10.0
+
 current_recipe: ContextVar[Recipe] = ContextVar("current_recipe")
 
 A = TypeVar("A")
 
 
+class SousFileChecker:
+    """
+    Checks the files on souss that recipes depended on when they last cooked
+    (see DependencyTracker.register_remote_file).
+    Provided, through register_sous_file_checker, by the steps that register
+    such files, as only they know the utensils that can check them.
+    """
+
+    async def unchanged(self, kitchen: "Kitchen", file_hashes: Dict[str, str]) -> bool:
+        """
+        Whether the files, on the current recipe's sous, still have the given
+        digests.
+        """
+        raise NotImplementedError
+
+    async def hash_files(
+        self, kitchen: "Kitchen", sous: str, user: str, paths: List[str], algorithm: str
+    ) -> Dict[str, Optional[str]]:
+        """
+        The digests of files on a sous (None for those that are missing).
+        """
+        raise NotImplementedError
+
+
+_sous_file_checker: Optional[SousFileChecker] = None
+
+
+def register_sous_file_checker(checker: SousFileChecker) -> None:
+    global _sous_file_checker
+    _sous_file_checker = checker
+
+
 class Preparation:
     def __init__(self, head: Head):
         self.dag = head.dag
@@ -121,22 +205,136 @@ class Preparation:
             self._current_recipe = None
             meta.state = RecipeState.PREPARED
 
+        self.coalesce_all()
+
+    def coalesce_all(self) -> None:
+        """
+        Merges compatible coalescible recipes on the same sous and user,
+        except where merging them would create a cycle.
+        """
+        # (class, sous, user, coalesce key) → recipes
+        groups: Dict[
+            Tuple[Type[Recipe], str, str, Hashable], List[Recipe]
+        ] = defaultdict(list)
+        for vertex in self.dag.vertices:
+            if isinstance(vertex, Recipe) and vertex._COALESCIBLE:
+                context = vertex.recipe_context
+                key = (
+                    vertex.__class__,
+                    context.sous,
+                    context.user,
+                    vertex.coalesce_key(),
+                )
+                groups[key].append(vertex)
+
+        for recipes in groups.values():
+            # sorted, so that the merged recipes are the same from run to run
+            recipes.sort(key=str)
+            while len(recipes) > 1:
+                cluster, recipes = self._acyclic_cluster(recipes)
+                if len(cluster) > 1:
+                    merged = cluster[0].__class__.coalesce(cluster, self.head)
+                    self.dag.merge(cluster, merged)
+
+    def _acyclic_cluster(
+        self, recipes: List[Recipe]
+    ) -> Tuple[List[Recipe], List[Recipe]]:
+        """
+        Picks out recipes, starting with the first, none of which reaches
+        another in the DAG; merging these can't create a cycle.
+        Returns them and the remaining recipes.
+        """
+        cluster: List[Recipe] = []
+        rest: List[Recipe] = []
+        descendants: Set[Vertex] = set()
+        ancestors: Set[Vertex] = set()
+        for recipe in recipes:
+            if recipe in descendants or recipe in ancestors:
+                rest.append(recipe)
+                continue
+            cluster.append(recipe)
+            descendants |= self.dag.reachable(recipe)
+            ancestors |= self.dag.reachable(recipe, backwards=True)
+        return cluster, rest
+
 
 class Kitchen:
     def __init__(
-        self, head: "Head", dependency_store: DependencyCache,
+        self,
+        head: "Head",
+        dependency_store: DependencyCache,
+        limits: Optional[ConcurrencyLimits] = None,
+        durations: Optional[DurationStore] = None,
+        keep_going: bool = False,
+        tracer: Optional[Tracer] = None,
+        fingerprints: Optional[FingerprintStore] = None,
+        incremental: bool = False,
     ):
         self._chanproheads: Dict[Tuple[str, str], Future[ChanProHead]] = dict()
         self._dependency_store = dependency_store
         self._dependency_trackers: Dict[Recipe, DependencyTracker] = dict()
+        # (rowid, book) from when each recipe last cooked
+        self._previous_books: Dict[Recipe, Tuple[int, DependencyBook]] = dict()
+        # rowids of the books of skipped recipes, to mark as still in use
+        self._renewals: List[int] = []
+        # (sous, user) → path → digest, of files on the sous hashed in advance
+        self._probed_sous_files: Dict[
+            Tuple[str, str], Dict[str, Optional[str]]
+        ] = dict()
+        # if True, recipes are only checked, not cooked
+        self._planning = False
+        # recipe → why it was (or would be) cooked rather than skipped
+        self.reasons: Dict[Recipe, str] = dict()
         self.head = head
         self.last_updated_ats: Dict[Resource, int] = dict()
-        self._cookable: Queue[Optional[Vertex]] = Queue()
-        self._sleeper_slots: int = 0
+        self.limits = limits or head.concurrency_limits
+        self._durations = durations
+        self._timers: Dict[Recipe, CookTimer] = dict()
+        # how long each recipe cooked in this run took
+        self.timings: Dict[Recipe, CookTiming] = dict()
+        self._critical_paths: Dict[Recipe, float] = dict()
+
+        # if True, a failed recipe only stops the recipes that depend on it
+        self.keep_going = keep_going
+        # failed recipe → the exception it raised
+        self.failures: Dict[Recipe, BaseException] = dict()
+        # blocked recipe → the failed recipe that blocked it
+        self.blocked: Dict[Recipe, Recipe] = dict()
+
+        # if given, records where the time of the run goes
+        self.tracer = tracer
+
+        # if given, files on the head are only re-read when they are modified
+        self._fingerprints = fingerprints
+        # if True, souss are assumed to be as scone left them, so only inputs
+        # on the head are checked for changes
+        self.incremental = incremental
+
+        # latest telemetry sample from each sous
+        self.telemetry: Dict[str, SousTelemetry] = dict()
+        # peak values of telemetry fields for each sous, for reporting
+        self.telemetry_peaks: Dict[str, Dict[str, float]] = dict()
+        # the recipes ready to cook, whilst cooking; throttled by telemetry
+        self._ready: Optional[ReadyQueue] = None
+
+        # state that steps share between recipes for the duration of this run,
+        # keyed by (sous, a name chosen by the step)
+        self.run_state: Dict[Tuple[str, str], Any] = dict()
 
     def get_dependency_tracker(self):
         return self._dependency_trackers[current_recipe.get()]
 
+    async def get_previous_cache_data(self) -> Dict[str, Any]:
+        """
+        Returns the cache_data stored by the current recipe when it last cooked,
+        or an empty dict if it never has.
+        """
+        inquiry = self._previous_books.get(current_recipe.get())
+        if inquiry is None:
+            return {}
+        _rowid, dep_book = inquiry
+        return dep_book.cache_data
+
     async def get_chanprohead(self, host: str, user: str) -> ChanProHead:
         async def new_conn():
             connection_details = self.head.souss[host]
@@ -144,19 +342,25 @@ class Kitchen:
             #  os.path.join(self.head.directory, connection_details["clientkey"])
 
             try:
-                cp, root = await sshconn.open_ssh_sous(
-                    connection_details["host"],
-                    connection_details["user"],
-                    None,
-                    user,
-                    connection_details["souscmd"],
-                    connection_details.get("dangerous_debug_logging", False),
-                )
+                with self._span(
+                    f"connect as {user}", "connection", (host, "connections")
+                ):
+                    cp, root = await sshconn.open_ssh_sous(
+                        connection_details["host"],
+                        connection_details["user"],
+                        None,
+                        user,
+                        connection_details["souscmd"],
+                        connection_details.get("dangerous_debug_logging", False),
+                        connection_details.get(
+                            "telemetry_interval", DEFAULT_TELEMETRY_INTERVAL
+                        ),
+                    )
             except Exception:
                 logger.error("Failed to open SSH connection", exc_info=True)
                 raise
 
-            return ChanProHead(cp, root)
+            return ChanProHead(cp, root, lambda raw: self._receive_telemetry(host, raw))
 
         hostuser = (host, user)
         if hostuser not in self._chanproheads:
@@ -164,100 +368,550 @@ class Kitchen:
 
         return await self._chanproheads[hostuser]
 
+    def _receive_telemetry(self, host: str, raw: dict) -> None:
+        try:
+            telemetry = cattr.structure(raw, SousTelemetry)
+        except Exception:
+            logger.warning("Bad telemetry from %s: %r", host, raw, exc_info=True)
+            return
+
+        # we get telemetry from each user's sous on a host; keep the latest
+        current = self.telemetry.get(host)
+        if current is None or current.timestamp <= telemetry.timestamp:
+            self.telemetry[host] = telemetry
+            if self._ready is not None:
+                self._throttle(self._ready, host)
+
+        peaks = self.telemetry_peaks.setdefault(host, dict())
+        measures = {
+            "load_per_cpu": telemetry.load_per_cpu(),
+            "cpu_busy": telemetry.cpu_busy,
+            "psi_cpu_some": telemetry.psi_cpu_some,
+            "psi_memory_full": telemetry.psi_memory_full,
+            "psi_io_full": telemetry.psi_io_full,
+            "disk_busy": telemetry.disk_busy,
+            "swap_used_kib": telemetry.swap_used_kib,
+        }
+        for name, value in measures.items():
+            if value is not None and value > peaks.get(name, float("-inf")):
+                peaks[name] = value
+
+    def sous_saturated(self, host: str) -> bool:
+        """
+        Whether the sous' host appears to be saturated (CPU, memory or I/O),
+        according to the latest telemetry.
+        """
+        telemetry = self.telemetry.get(host)
+        if telemetry is None:
+            return False
+
+        load_per_cpu = telemetry.load_per_cpu()
+        return (
+            (load_per_cpu is not None and load_per_cpu > SATURATED_LOAD_PER_CPU)
+            or (telemetry.psi_cpu_some or 0.0) > SATURATED_PSI_CPU_SOME
+            or (telemetry.psi_memory_full or 0.0) > SATURATED_PSI_MEMORY_FULL
+            or (telemetry.psi_io_full or 0.0) > SATURATED_PSI_IO_FULL
+        )
+
+    def _throttle(self, ready: ReadyQueue, host: str) -> None:
+        """
+        Lowers (or restores) how many recipes may cook at once on the sous,
+        according to whether its latest telemetry shows it to be saturated.
+        """
+        before = ready.throttled(host)
+        ready.throttle(host, self.sous_saturated(host))
+        after = ready.throttled(host)
+        if after != before:
+            if after is None:
+                logger.info("%s is no longer throttled", host)
+            else:
+                logger.info("%s throttled to %d recipes at once", host, after)
+
+    def telemetry_report(self) -> List[str]:
+        """
+        Human-readable lines summarising the peak resource usage of each sous
+        during this run.
+        """
+        lines = []
+        for host, peaks in sorted(self.telemetry_peaks.items()):
+            parts = [f"{name}={value:.2f}" for name, value in sorted(peaks.items())]
+            lines.append(f"{host}: peak " + ", ".join(parts))
+        return lines
+
+    def slowest_report(self, count: int = 10) -> List[str]:
+        """
+        Human-readable lines describing the slowest recipes of this run.
+        """
+        slowest = sorted(
+            self.timings.items(), key=lambda item: item[1].cook, reverse=True
+        )
+        return [
+            f"{timing.cook:.1f} s (remote {timing.remote:.1f} s,"
+            f" head {timing.head:.1f} s, queued {timing.queue_wait:.1f} s): {recipe}"
+            for recipe, timing in slowest[:count]
+        ]
+
+    def estimate_remaining(self, parallelism: int) -> float:
+        """
+        Roughly how long (in seconds) the recipes not yet cooked will take:
+        their critical path, or their total expected duration shared between
+        the given number of concurrently cooking recipes, whichever is longer.
+        Recipes that will probably be skipped only count for as long as
+        skipping them usually takes.
+        """
+        longest_path = 0.0
+        total_work = 0.0
+        for recipe, meta in self.head.dag.recipe_meta.items():
+            if RecipeState.is_completed(meta.state):
+                continue
+            longest_path = max(longest_path, self._critical_paths.get(recipe, 0.0))
+            total_work += self._anticipated_duration(recipe)
+        return max(longest_path, total_work / max(parallelism, 1))
+
     async def cook_all(self):
         # TODO fridge emitter
+        dag = self.head.dag
+        if not self._planning:
+            await self._inquire_all()
+        self._critical_paths = critical_path_lengths(dag, self._anticipated_duration)
+        ready = ReadyQueue(self.limits, self._critical_paths, MAX_SATURATION_DEFERRALS)
+        self._ready = ready
 
-        num_workers = 8
+        def make_ready(recipe: Recipe) -> None:
+            dag.recipe_meta[recipe].state = RecipeState.COOKABLE
+            self._timers[recipe] = CookTimer()
+            ready.push(recipe)
 
-        self._sleeper_slots = num_workers - 1
+        def complete(vertex: Vertex) -> None:
+            """
+            Marks a vertex as done, releasing anything that was waiting on it.
+            """
+            to_complete = [vertex]
+            while to_complete:
+                done = to_complete.pop()
+                if isinstance(done, Resource):
+                    eprint(f"have {done}")
 
-        for vertex in self.head.dag.vertices:
+                for edge in dag.edges[done]:
+                    logger.debug("updating edge: %s → %s", done, edge)
+                    if isinstance(edge, Recipe):
+                        rec_meta = dag.recipe_meta[edge]
+                        rec_meta.incoming_uncompleted -= 1
+                        logger.debug("has %d incoming", rec_meta.incoming_uncompleted)
+                        if (
+                            rec_meta.incoming_uncompleted == 0
+                            and rec_meta.state == RecipeState.PENDING
+                        ):
+                            make_ready(edge)
+                    elif isinstance(edge, Resource):
+                        res_meta = dag.resource_meta[edge]
+                        res_meta.incoming_uncompleted -= 1
+                        logger.debug("has %d incoming", res_meta.incoming_uncompleted)
+                        if (
+                            res_meta.incoming_uncompleted == 0
+                            and not res_meta.completed
+                        ):
+                            res_meta.completed = True
+                            to_complete.append(edge)
+
+        initially_available: List[Resource] = []
+        for vertex in dag.vertices:
             if isinstance(vertex, Recipe):
-                rec_meta = self.head.dag.recipe_meta[vertex]
+                rec_meta = dag.recipe_meta[vertex]
                 if rec_meta.incoming_uncompleted == 0:
-                    rec_meta.state = RecipeState.COOKABLE
-                    self._cookable.put_nowait(vertex)
+                    make_ready(vertex)
                 else:
                     rec_meta.state = RecipeState.PENDING
             elif isinstance(vertex, Resource):
-                res_meta = self.head.dag.resource_meta[vertex]
+                res_meta = dag.resource_meta[vertex]
                 if res_meta.incoming_uncompleted == 0:
                     res_meta.completed = True
                     if res_meta.hard_need:
-                        needers = self.head.dag.edges[vertex]
+                        needers = dag.edges[vertex]
                         needers_str = "".join(f" - {n}\n" for n in needers)
                         raise RuntimeError(
                             f"Hard need 「{vertex}」 not satisfiable."
                             f" Needed by:\n{needers_str}"
                         )
-                    self._cookable.put_nowait(vertex)
+                    initially_available.append(vertex)
+
+        for resource in initially_available:
+            complete(resource)
+
+        num_recipes = len(dag.recipe_meta)
+        num_souss = len({recipe.recipe_context.sous for recipe in dag.recipe_meta})
+        expected = self.estimate_remaining(
+            self.limits.max_parallelism(num_recipes, num_souss)
+        )
+        if not self._planning:
+            eprint(f"{num_recipes} recipes to cook; expecting about {expected:.0f} s.")
+        last_progress = time.monotonic()
+        num_cooked = 0
+
+        cooking: Dict["asyncio.Task[None]", Recipe] = dict()
+        try:
+            while True:
+                while True:
+                    recipe = ready.pop_startable(self.sous_saturated)
+                    if recipe is None:
+                        break
+                    cooking[asyncio.create_task(self._cook_recipe(recipe))] = recipe
+
+                if not cooking:
+                    break
 
-        workers = []
-        for _ in range(num_workers):
-            workers.append(self._cooking_worker())
+                done, _pending = await asyncio.wait(
+                    cooking.keys(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    recipe = cooking.pop(task)
+                    ready.finished(recipe)
+                    exception = task.exception()
+                    if exception is None:
+                        complete(recipe)
+                        num_cooked += 1
+                    elif self.keep_going:
+                        logger.error("%s", exception, exc_info=exception)
+                        self.failures[recipe] = exception.__cause__ or exception
+                        self._block_dependents(recipe)
+                    else:
+                        raise exception
+
+                now = time.monotonic()
+                if not self._planning and now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    remaining = self.estimate_remaining(len(cooking))
+                    eprint(
+                        f"{num_cooked}/{num_recipes} recipes cooked;"
+                        f" about {remaining:.0f} s remaining."
+                    )
+        finally:
+            self._ready = None
+            for task in cooking:
+                task.cancel()
+            if cooking:
+                await asyncio.gather(*cooking, return_exceptions=True)
+            if self._renewals:
+                with self._span(
+                    "dependency cache: renew", "depcache", (HEAD_PROCESS, "kitchen")
+                ):
+                    await self._dependency_store.renew_many(self._renewals)
+                self._renewals.clear()
+
+        if len(ready):
+            raise RuntimeError(f"{len(ready)} cookable recipes were never started.")
+
+    def _expected_duration(self, recipe: Recipe) -> float:
+        """
+        How long the recipe is expected to take to cook, going by its history.
+        """
+        if self._durations is not None:
+            estimate = self._durations.estimate(recipe)
+            if estimate is not None:
+                return estimate
+        return DEFAULT_EXPECTED_DURATION
+
+    def _anticipated_duration(self, recipe: Recipe) -> float:
+        """
+        How long the recipe is expected to take, allowing for it probably being
+        skipped if its inputs were tracked when it last cooked.
+        """
+        inquiry = self._previous_books.get(recipe)
+        if inquiry is None or inquiry[1].ignored:
+            return self._expected_duration(recipe)
+        if self._durations is not None:
+            estimate = self._durations.estimate_skip(recipe)
+            if estimate is not None:
+                return estimate
+        return DEFAULT_EXPECTED_SKIP_DURATION
+
+    def _block_dependents(self, failed: Recipe) -> None:
+        """
+        Marks everything that (transitively) depends on the failed recipe as
+        blocked.
+        """
+        dag = self.head.dag
+        to_visit: List[Vertex] = list(dag.edges[failed])
+        seen = set(to_visit)
+        while to_visit:
+            vertex = to_visit.pop()
+            if isinstance(vertex, Recipe):
+                meta = dag.recipe_meta[vertex]
+                if meta.state != RecipeState.PENDING:
+                    continue
+                meta.state = RecipeState.BLOCKED
+                self.blocked[vertex] = failed
+            for edge in dag.edges[vertex]:
+                if edge not in seen:
+                    seen.add(edge)
+                    to_visit.append(edge)
+
+    def failure_report(self) -> List[str]:
+        """
+        Human-readable lines describing the recipes that failed, and the
+        recipes that they blocked.
+        """
+        lines = []
+        for failed, exception in self.failures.items():
+            lines.append(f"FAILED {failed}: {exception!r}")
+            for blocked, cause in self.blocked.items():
+                if cause is failed:
+                    lines.append(f"  blocked {blocked}")
+        return lines
+
+    async def _cook_recipe(self, recipe: Recipe) -> None:
+        dag = self.head.dag
+        meta = dag.recipe_meta[recipe]
+
+        timer = self._timers[recipe]
 
-        await asyncio.gather(*workers, return_exceptions=False)
+        # TODO try to deduplicate
+        meta.state = RecipeState.BEING_COOKED
+        timer.started()
+        current_recipe.set(recipe)
+        if self.tracer is not None:
+            assert timer.started_at is not None
+            self.tracer.record(
+                "queued",
+                "recipe",
+                recipe_track(recipe),
+                timer.ready_at,
+                timer.started_at,
+            )
+
+        with self._span("check", "recipe"):
+            reason = await self._reason_to_cook(recipe)
+        if reason is None:
+            del self._timers[recipe]
+            if self._durations is not None and not self._planning:
+                assert timer.started_at is not None
+                self._durations.record_skip(recipe, time.monotonic() - timer.started_at)
+            self._skip(recipe)
+            meta.state = RecipeState.SKIPPED
+            eprint(f"skipped {recipe}")
+            return
+        self.reasons[recipe] = reason
+
+        if self._planning:
+            # what it provides would change
+            del self._timers[recipe]
+            tracker = DependencyTracker(DependencyBook(), dag, recipe)
+            for vertex in dag.edges[recipe]:
+                if isinstance(vertex, Resource):
+                    tracker.provide(vertex)
+            meta.state = RecipeState.COOKED
+            return
+
+        eprint(f"cooking {recipe}")
+        self._dependency_trackers[recipe] = DependencyTracker(
+            DependencyBook(), dag, recipe
+        )
+        try:
+            with self._span("cook", "recipe", reason=reason):
+                await recipe.cook(self)
+        except Exception as e:
+            meta.state = RecipeState.FAILED
+            if recipe in self._previous_books:
+                # it may have left things in a state its book doesn't describe
+                with self._span("dependency cache: forget", "depcache"):
+                    await self._dependency_store.forget(recipe)
+            raise RuntimeError(f"Recipe {recipe} failed!") from e
+        timing = timer.finished()
+        del self._timers[recipe]
+        eprint(f"cooked {recipe}")
+        await self._store_dependency(recipe)
+        meta.state = RecipeState.COOKED
+
+        self.timings[recipe] = timing
+        if self._durations is not None:
+            await self._durations.record(recipe, timing)
+
+    async def _inquire_all(self) -> None:
+        """
+        Looks up what each recipe depended on when it last cooked.
+        """
+        for recipe in self.head.dag.recipe_meta:
+            with self._span(
+                "dependency cache: inquire", "depcache", recipe_track(recipe)
+            ):
+                inquiry = await self._dependency_store.inquire(recipe)
+            if inquiry is not None:
+                self._previous_books[recipe] = inquiry
+
+    def _hash_head_paths(self, paths: List[str]) -> Dict[str, Optional[str]]:
+        hasher: Callable[[str, str], str] = hash_path
+        if self._fingerprints is not None:
+            hasher = self._fingerprints.hash_path
+        result: Dict[str, Optional[str]] = dict()
+        for path in paths:
+            try:
+                result[path] = hasher(path, self.head.change_hash)
+            except FileNotFoundError:
+                result[path] = None
+        return result
+
+    async def _reason_to_cook(self, recipe: Recipe) -> Optional[str]:
+        """
+        Why the recipe needs to be cooked, or None if its inputs are unchanged
+        since it last cooked, so it can be skipped.
+        """
+        inquiry = self._previous_books.get(recipe)
+        if inquiry is None:
+            return "not cooked successfully before"
+        _rowid, book = inquiry
+        if book.ignored:
+            return "has inputs that can't be tracked"
 
-    async def _cooking_worker(self):
         dag = self.head.dag
-        while True:
-            if self._sleeper_slots <= 0 and self._cookable.empty():
-                self._sleeper_slots -= 1
-                self._cookable.put_nowait(None)
-                break
+        needed = set()
+        for vertex in dag.reverse_edges[recipe]:
+            if isinstance(vertex, Resource):
+                needed.add(vertex)
+            elif dag.recipe_meta[vertex].state != RecipeState.SKIPPED:
+                # ordered after a recipe that may have changed things
+                return f"is after {vertex}, which cooks"
+        for resource in needed:
+            if resource not in book.watching:
+                return f"newly needs {resource}"
+        for resource, watched_time in book.watching.items():
+            if dag.resource_time.get(resource, 0) != watched_time:
+                return f"{resource} has changed"
+        for vertex in dag.edges[recipe]:
+            if isinstance(vertex, Resource) and vertex not in book.provided:
+                return f"newly provides {vertex}"
 
-            self._sleeper_slots -= 1
+        variables = self.head.variables.get(recipe.recipe_context.sous)
+        for name, value_hash in book.var_hashes.items():
             try:
-                next_job = await self._cookable.get()
-            finally:
-                self._sleeper_slots += 1
+                if variables is None:
+                    raise KeyError(name)
+                value = variables.get_dotted(name) if name else variables.toplevel()
+            except (KeyError, ValueError):
+                return f"variable {name} is gone"
+            if hash_variable(value) != value_hash:
+                return f"variable {name} has changed"
 
-            if next_job is None:
-                continue
+        if book.head_file_hashes:
+            head_file_hashes = await asyncio.get_running_loop().run_in_executor(
+                self.head.pools.threaded,
+                self._hash_head_paths,
+                list(book.head_file_hashes.keys()),
+            )
+            for path, digest in book.head_file_hashes.items():
+                if head_file_hashes[path] != digest:
+                    return f"{path} has changed"
+
+        if book.dyn_sous_file_hashes and not self.incremental:
+            context = recipe.recipe_context
+            probed = self._probed_sous_files.get((context.sous, context.user))
+            if probed is not None:
+                for path, digest in book.dyn_sous_file_hashes.items():
+                    if probed.get(path) != normalise(digest):
+                        return f"{path} on the sous has changed"
+            elif _sous_file_checker is None:
+                return "files on the sous can't be checked"
+            elif not await _sous_file_checker.unchanged(
+                self, book.dyn_sous_file_hashes
+            ):
+                return "files on the sous have changed"
+
+        return None
 
-            if isinstance(next_job, Recipe):
-                meta = dag.recipe_meta[next_job]
+    async def _probe_sous_files(self) -> None:
+        """
+        Hashes all the sous files that recipes depended on, in one go per sous
+        and user, rather than once per recipe.
+        """
+        wanted: Dict[Tuple[str, str], Dict[str, Set[str]]] = dict()
+        for recipe, (_rowid, book) in self._previous_books.items():
+            context = recipe.recipe_context
+            by_algorithm = wanted.setdefault((context.sous, context.user), dict())
+            for path, digest in book.dyn_sous_file_hashes.items():
+                by_algorithm.setdefault(algorithm_of(digest), set()).add(path)
 
-                # TODO try to deduplicate
-                meta.state = RecipeState.BEING_COOKED
-                current_recipe.set(next_job)
-                eprint(f"cooking {next_job}")
-                self._dependency_trackers[next_job] = DependencyTracker(
-                    DependencyBook(), dag, next_job
+        checker = _sous_file_checker
+        if checker is None:
+            return
+
+        async def probe(sous: str, user: str, by_algorithm: Dict[str, Set[str]]):
+            assert checker is not None
+            probed: Dict[str, Optional[str]] = dict()
+            for algorithm, paths in by_algorithm.items():
+                probed.update(
+                    await checker.hash_files(self, sous, user, sorted(paths), algorithm)
+                )
+            self._probed_sous_files[(sous, user)] = probed
+
+        await asyncio.gather(
+            *(
+                probe(sous, user, by_algorithm)
+                for (sous, user), by_algorithm in wanted.items()
+                if by_algorithm
+            )
+        )
+
+    async def plan(self) -> Plan:
+        """
+        Works out which recipes would be cooked (and why) and which would be
+        skipped, without cooking anything.
+        """
+        self._planning = True
+        await self._inquire_all()
+        if not self.incremental:
+            await self._probe_sous_files()
+        await self.cook_all()
+
+        dag = self.head.dag
+        plan = Plan()
+
+        def planned_duration(recipe: Recipe) -> float:
+            if recipe in self.reasons:
+                return self._expected_duration(recipe)
+            return 0.0
+
+        for recipe, meta in dag.recipe_meta.items():
+            context = recipe.recipe_context
+            sous_plan = plan.souss.setdefault(context.sous, SousPlan())
+            reason = self.reasons.get(recipe)
+            if reason is None:
+                sous_plan.to_skip += 1
+            else:
+                sous_plan.to_cook += 1
+                sous_plan.work += planned_duration(recipe)
+            plan.recipes.append(
+                PlannedRecipe(
+                    str(recipe),
+                    recipe_kind(recipe.__class__),
+                    context.sous,
+                    context.user,
+                    ACTION_SKIP if reason is None else ACTION_COOK,
+                    reason,
+                    planned_duration(recipe),
                 )
-                try:
-                    await next_job.cook(self)
-                except Exception as e:
-                    meta.state = RecipeState.FAILED
-                    raise RuntimeError(f"Recipe {next_job} failed!") from e
-                eprint(f"cooked {next_job}")
-                # TODO cook
-                # TODO store depbook
-                await self._store_dependency(next_job)
-                meta.state = RecipeState.COOKED
-            elif isinstance(next_job, Resource):
-                eprint(f"have {next_job}")
-                pass
-
-            for edge in dag.edges[next_job]:
-                logger.debug("updating edge: %s → %s", next_job, edge)
-                if isinstance(edge, Recipe):
-                    rec_meta = dag.recipe_meta[edge]
-                    rec_meta.incoming_uncompleted -= 1
-                    logger.debug("has %d incoming", rec_meta.incoming_uncompleted)
-                    if (
-                        rec_meta.incoming_uncompleted == 0
-                        and rec_meta.state == RecipeState.PENDING
-                    ):
-                        rec_meta.state = RecipeState.COOKABLE
-                        self._cookable.put_nowait(edge)
-                elif isinstance(edge, Resource):
-                    res_meta = dag.resource_meta[edge]
-                    res_meta.incoming_uncompleted -= 1
-                    logger.debug("has %d incoming", res_meta.incoming_uncompleted)
-                    if res_meta.incoming_uncompleted == 0 and not res_meta.completed:
-                        res_meta.completed = True
-                        self._cookable.put_nowait(edge)
+            )
+
+        for sous_plan in plan.souss.values():
+            parallelism = self.limits.max_parallelism(sous_plan.to_cook or 1, 1)
+            sous_plan.estimated_duration = sous_plan.work / parallelism
+
+        path = critical_path(dag, planned_duration)
+        plan.critical_path = [str(recipe) for recipe in path if recipe in self.reasons]
+        plan.estimated_duration = max(
+            [sum(map(planned_duration, path))]
+            + [sous_plan.estimated_duration for sous_plan in plan.souss.values()]
+        )
+        return plan
+
+    def _skip(self, recipe: Recipe) -> None:
+        rowid, book = self._previous_books[recipe]
+        if not self._planning:
+            self._renewals.append(rowid)
+        dag = self.head.dag
+        # what it provides is unchanged since it was provided last time
+        for resource, provided_time in book.provided.items():
+            dag.resource_time[resource] = max(
+                provided_time, dag.resource_time.get(resource, 0)
+            )
 
     # async def run_epoch(
     #     self,
@@ -281,11 +935,49 @@ class Kitchen:
     #
     #     await asyncio.gather(*coros, return_exceptions=False)
 
+    def _remote_time(self) -> ContextManager[None]:
+        """
+        Counts the time within as time spent waiting on the sous.
+        """
+        timer = self._timers.get(current_recipe.get())
+        if timer is None:
+            return nullcontext()
+        return timer.remote()
+
+    def _span(
+        self, name: str, category: str, track: Optional[Track] = None, **args: Any
+    ) -> ContextManager[None]:
+        """
+        Traces the time within as a span, on the current recipe's track unless
+        another is given.
+        """
+        if self.tracer is None:
+            return nullcontext()
+        if track is None:
+            track = recipe_track(current_recipe.get())
+        return self.tracer.span(name, category, track, **args)
+
+    async def _start(self, utensil: Utensil) -> Channel:
+        context = current_recipe.get().recipe_context
+        return await self.start_on(context.sous, context.user, utensil)
+
     async def start(self, utensil: Utensil) -> Channel:
+        utensil_name = utensil.__class__.__name__
+        with self._remote_time(), self._span(f"start {utensil_name}", "utensil"):
+            channel = await self._start(utensil)
+
+        timer = self._timers.get(current_recipe.get())
+        if timer is None:
+            return channel
+        # waiting on the channel is waiting on the sous
+        return cast(Channel, TimedChannel(channel, timer))
+
+    async def start_on(self, sous: str, user: str, utensil: Utensil) -> Channel:
+        """
+        Starts a utensil on a given sous, outside of any recipe.
+        """
         utensil_name = utensil_namer(utensil.__class__)
-        recipe = current_recipe.get()
-        context = recipe.recipe_context
-        cph = await self.get_chanprohead(context.sous, context.user)
+        cph = await self.get_chanprohead(sous, user)
 
         # noinspection PyDataclass
         payload = cattr.unstructure(utensil)
@@ -295,8 +987,10 @@ class Kitchen:
     ut = start
 
     async def start_and_consume(self, utensil: Utensil) -> Any:
-        channel = await self.start(utensil)
-        return await channel.consume()
+        utensil_name = utensil.__class__.__name__
+        with self._remote_time(), self._span(utensil_name, "utensil"):
+            channel = await self._start(utensil)
+            return await channel.consume()
 
     ut1 = start_and_consume
 
@@ -319,8 +1013,10 @@ class Kitchen:
     ut1areq = start_and_consume_attrs
 
     async def start_and_wait_close(self, utensil: Utensil) -> Any:
-        channel = await self.start(utensil)
-        return await channel.wait_close()
+        utensil_name = utensil.__class__.__name__
+        with self._remote_time(), self._span(utensil_name, "utensil"):
+            channel = await self._start(utensil)
+            return await channel.wait_close()
 
     ut0 = start_and_wait_close
 
@@ -329,8 +1025,24 @@ class Kitchen:
         if not dependency_tracker:
             raise KeyError(f"Recipe {recipe} has not been tracked.")
         depbook = dependency_tracker.book
+
+        dag = self.head.dag
+        for vertex in dag.edges[recipe]:
+            if isinstance(vertex, Resource) and vertex not in depbook.provided:
+                dependency_tracker.provide(vertex)
+        for vertex in dag.reverse_edges[recipe]:
+            if isinstance(vertex, Resource):
+                dependency_tracker.watch(vertex)
+        if dependency_tracker.head_paths:
+            depbook.head_file_hashes = await asyncio.get_running_loop().run_in_executor(
+                self.head.pools.threaded,
+                self._hash_head_paths,
+                sorted(str(path) for path in dependency_tracker.head_paths),
+            )
+
         if depbook:
-            await self._dependency_store.register(recipe, depbook)
+            with self._span("dependency cache: register", "depcache"):
+                await self._dependency_store.register(recipe, depbook)
 
     @staticmethod
     def resource_on_sous(
@@ -0,0 +1,89 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import attr
+import cattr
+
+ACTION_COOK = "cook"
+ACTION_SKIP = "skip"
+
+
+@attr.s(auto_attribs=True)
+class PlannedRecipe:
+    recipe: str
+    kind: str
+    sous: str
+    user: str
+    # ACTION_COOK or ACTION_SKIP
+    action: str
+    # why it would be cooked
+    reason: Optional[str]
+    # seconds, if it would be cooked
+    estimated_duration: float
+
+
+@attr.s(auto_attribs=True)
+class SousPlan:
+    to_cook: int = 0
+    to_skip: int = 0
+    # total expected duration (seconds) of the recipes to cook
+    work: float = 0.0
+    # that work shared between the recipes that may cook at once on the sous
+    estimated_duration: float = 0.0
+
+
+@attr.s(auto_attribs=True)
+class Plan:
+    """
+    What a run would do.
+    """
+
+    recipes: List[PlannedRecipe] = attr.Factory(list)
+    souss: Dict[str, SousPlan] = attr.Factory(dict)
+    # the chain of recipes to cook with the longest expected duration
+    critical_path: List[str] = attr.Factory(list)
+    estimated_duration: float = 0.0
+
+    def report(self) -> List[str]:
+        """
+        Human-readable lines describing the plan.
+        """
+        lines = []
+        for planned in self.recipes:
+            if planned.action == ACTION_COOK:
+                lines.append(f"cook {planned.recipe}: {planned.reason}")
+            else:
+                lines.append(f"skip {planned.recipe}")
+
+        for sous, sous_plan in sorted(self.souss.items()):
+            lines.append(
+                f"{sous}: {sous_plan.to_cook} to cook, {sous_plan.to_skip} to skip;"
+                f" about {sous_plan.estimated_duration:.0f} s"
+            )
+
+        lines.append(f"Critical path (about {self.estimated_duration:.0f} s):")
+        for recipe in self.critical_path:
+            lines.append(f" {recipe}")
+        return lines
+
+    def write_json(self, path: Path) -> None:
+        with open(path, "w") as fout:
+            json.dump(cattr.unstructure(self), fout, indent=2)
@@ -16,7 +16,7 @@
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
 import typing
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Hashable, List, Optional
 
 import attr
 
@@ -31,6 +31,14 @@ def recipe_name_getter(c: typing.Type["Recipe"]) -> Optional[str]:
     return None
 
 
+def recipe_kind(c: typing.Type["Recipe"]) -> str:
+    """
+    The recipe's name, or its class name for recipes that can't be used in
+    menus (such as those made by coalescing).
+    """
+    return recipe_name_getter(c) or c.__name__
+
+
 @attr.s(auto_attribs=True)
 class RecipeContext:
     sous: str
@@ -44,7 +52,25 @@ class RecipeContext:
     human: str
 
 
+def coalesced_context(recipes: List["Recipe"]) -> RecipeContext:
+    """
+    A context for a recipe that stands in for all of the given recipes.
+    """
+    first = recipes[0].recipe_context
+    return RecipeContext(
+        sous=first.sous,
+        user=first.user,
+        slug=None,
+        hierarchical_source=first.hierarchical_source,
+        human=f"{first.human} (coalesced with {len(recipes) - 1} more)",
+    )
+
+
 class Recipe:
+    # If True, compatible recipes of this class on the same sous and user are
+    # merged into one (see coalesce) once all recipes have been prepared.
+    _COALESCIBLE = False
+
     def __init__(
         self, recipe_context: RecipeContext, args: Dict[str, Any], head: "Head"
     ):
@@ -64,6 +90,22 @@ class Recipe:
     async def cook(self, kitchen: "Kitchen") -> None:
         raise NotImplementedError
 
+    def coalesce_key(self) -> Hashable:
+        """
+        Coalescible recipes are only merged with others whose key is equal.
+        """
+        return ()
+
+    @classmethod
+    def coalesce(cls, recipes: List["Recipe"], head: "Head") -> "Recipe":
+        """
+        Creates one recipe that does the work of all of the given (compatible)
+        recipes of this class, in one cook.
+        It is not prepared: it takes over the needs and provides of the
+        recipes it replaces.
+        """
+        raise NotImplementedError
+
     def __str__(self):
         cls = self.__class__
         if hasattr(cls, "RECIPE_NAME"):
@@ -0,0 +1,367 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+from collections import defaultdict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import attr
+
+from scone.head.dag import RecipeDag, Vertex
+from scone.head.recipe import Recipe, recipe_name_getter
+
+# Defaults for the [kitchen] section of scone.head.toml.
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_MAX_PER_SOUS = 4
+
+LimitKey = Tuple[str, ...]
+
+
+def limit_opt(value: Optional[int]) -> Optional[int]:
+    """
+    0 (or less) means unlimited.
+    """
+    if value is None or value <= 0:
+        return None
+    return value
+
+
+@attr.s(auto_attribs=True)
+class ConcurrencyLimits:
+    """
+    Limits on how many recipes may be cooking at once.
+    None means unlimited.
+    """
+
+    # across the whole run
+    total: Optional[int] = DEFAULT_MAX_IN_FLIGHT
+    # on any one sous (across all of its users)
+    per_sous: Optional[int] = DEFAULT_MAX_PER_SOUS
+    # for any one user on a sous
+    per_sous_user: Optional[int] = None
+    # for a recipe kind, on any one sous
+    per_kind: Dict[str, int] = attr.Factory(dict)
+
+    @staticmethod
+    def from_config(section: dict) -> "ConcurrencyLimits":
+        """
+        Reads the [kitchen] section of scone.head.toml:
+
+            [kitchen]
+            max_in_flight = 64
+            max_per_sous = 4
+            max_per_sous_user = 0   # 0 for no limit
+
+            [kitchen.max_per_kind]
+            apt-install = 1
+        """
+        limits = ConcurrencyLimits()
+        if "max_in_flight" in section:
+            limits.total = limit_opt(section["max_in_flight"])
+        if "max_per_sous" in section:
+            limits.per_sous = limit_opt(section["max_per_sous"])
+        if "max_per_sous_user" in section:
+            limits.per_sous_user = limit_opt(section["max_per_sous_user"])
+        for kind, limit in section.get("max_per_kind", {}).items():
+            limits.set_kind_limit(kind, limit)
+        return limits
+
+    def set_kind_limit(self, kind: str, limit: int) -> None:
+        kind_limit = limit_opt(limit)
+        if kind_limit is None:
+            self.per_kind.pop(kind, None)
+        else:
+            self.per_kind[kind] = kind_limit
+
+    def max_parallelism(self, num_recipes: int, num_souss: int) -> int:
+        """
+        The most recipes that could be cooking at once.
+        """
+        parallelism = num_recipes
+        if self.total is not None:
+            parallelism = min(parallelism, self.total)
+        if self.per_sous is not None:
+            parallelism = min(parallelism, self.per_sous * num_souss)
+        return parallelism
+
+    def limits_for(self, recipe: Recipe) -> List[Tuple[LimitKey, int]]:
+        """
+        The counters that cooking this recipe would count against, with their
+        limits.
+        """
+        context = recipe.recipe_context
+        result: List[Tuple[LimitKey, int]] = []
+        if self.total is not None:
+            result.append((("total",), self.total))
+        if self.per_sous is not None:
+            result.append((("sous", context.sous), self.per_sous))
+        if self.per_sous_user is not None:
+            result.append(
+                (("sous_user", context.sous, context.user), self.per_sous_user)
+            )
+        kind = recipe_name_getter(recipe.__class__)
+        if kind is not None and kind in self.per_kind:
+            result.append((("kind", context.sous, kind), self.per_kind[kind]))
+        return result
+
+
+def _longest_paths(
+    dag: RecipeDag, duration: Callable[[Recipe], float]
+) -> Dict[Vertex, float]:
+    # Kahn's algorithm, from the sinks backwards
+    outgoing_remaining: Dict[Vertex, int] = {
+        vertex: len(dag.edges[vertex]) for vertex in dag.vertices
+    }
+    to_visit = [vertex for vertex, count in outgoing_remaining.items() if count == 0]
+    longest: Dict[Vertex, float] = dict()
+
+    while to_visit:
+        vertex = to_visit.pop()
+        after = max((longest[edge] for edge in dag.edges[vertex]), default=0.0)
+        if isinstance(vertex, Recipe):
+            after += duration(vertex)
+        longest[vertex] = after
+
+        for predecessor in dag.reverse_edges[vertex]:
+            outgoing_remaining[predecessor] -= 1
+            if outgoing_remaining[predecessor] == 0:
+                to_visit.append(predecessor)
+
+    if len(longest) != len(dag.vertices):
+        raise RuntimeError("Recipe DAG contains a cycle.")
+
+    return longest
+
+
+def critical_path_lengths(
+    dag: RecipeDag, duration: Callable[[Recipe], float]
+) -> Dict[Recipe, float]:
+    """
+    For each recipe, the expected duration of the longest chain of recipes
+    from it (inclusive) to the end of the DAG.
+    Recipes with the longest remaining chains are on the critical path and
+    should be started first.
+    """
+    return {
+        vertex: length
+        for vertex, length in _longest_paths(dag, duration).items()
+        if isinstance(vertex, Recipe)
+    }
+
+
+def critical_path(dag: RecipeDag, duration: Callable[[Recipe], float]) -> List[Recipe]:
+    """
+    The chain of recipes with the longest total expected duration.
+    """
+    longest = _longest_paths(dag, duration)
+
+    def longest_from(candidate: Vertex) -> float:
+        return longest[candidate]
+
+    sources = [vertex for vertex in dag.vertices if not dag.reverse_edges[vertex]]
+    path: List[Recipe] = []
+    vertex: Optional[Vertex] = max(sources, key=longest_from, default=None)
+    while vertex is not None:
+        if isinstance(vertex, Recipe):
+            path.append(vertex)
+        vertex = max(dag.edges[vertex], key=longest_from, default=None)
+    return path
+
+
+class ReadyQueue:
+    """
+    Recipes that are ready to be cooked.
+
+    Each sous has its own queue, and the souss take turns (round-robin), so
+    that a sous with many recipes can't hog the slots allowed by the global
+    limit whilst other souss wait.
+    Within a sous, recipes are handed out highest priority first (then in the
+    order they became ready), except that a recipe is held back whilst
+    starting it would exceed one of the concurrency limits.
+
+    A sous can also be passed over whilst it is saturated, letting other souss'
+    recipes go first; each recipe is only passed over up to `max_deferrals`
+    times. A sous that stays saturated is throttled (see `throttle`).
+    """
+
+    def __init__(
+        self,
+        limits: ConcurrencyLimits,
+        priorities: Optional[Dict[Recipe, float]] = None,
+        max_deferrals: int = 0,
+    ):
+        self.limits = limits
+        self.priorities = priorities or dict()
+        self.max_deferrals = max_deferrals
+        # recipe → number of times it has been passed over
+        self.deferrals: Dict[Recipe, int] = defaultdict(int)
+        # sous → heap of (-priority, sequence number, recipe)
+        self._ready: Dict[str, List[Tuple[float, int, Recipe]]] = dict()
+        # souss with ready recipes, the one whose turn it is first
+        self._turns: Deque[str] = deque()
+        self._num_ready = 0
+        self._sequence = itertools.count()
+        self._in_flight: Dict[LimitKey, int] = defaultdict(int)
+        # counted even without a per-sous limit, for throttling
+        self._sous_in_flight: Dict[str, int] = defaultdict(int)
+        # sous → the most recipes it may have in flight whilst throttled
+        self._throttled: Dict[str, int] = dict()
+        # sous → the most it had in flight when it was first throttled
+        self._throttled_from: Dict[str, int] = dict()
+
+    def __len__(self) -> int:
+        return self._num_ready
+
+    def push(self, recipe: Recipe) -> None:
+        sous = recipe.recipe_context.sous
+        if sous not in self._ready:
+            self._ready[sous] = []
+            self._turns.append(sous)
+        priority = self.priorities.get(recipe, 0.0)
+        heapq.heappush(self._ready[sous], (-priority, next(self._sequence), recipe))
+        self._num_ready += 1
+
+    def _startable(self, recipe: Recipe) -> bool:
+        return all(
+            self._in_flight[key] < limit
+            for key, limit in self.limits.limits_for(recipe)
+        )
+
+    def _sous_full(self, sous: str) -> bool:
+        per_sous = self.limits.per_sous
+        if per_sous is not None and self._in_flight[("sous", sous)] >= per_sous:
+            return True
+        throttled = self._throttled.get(sous)
+        return throttled is not None and self._sous_in_flight[sous] >= throttled
+
+    def throttle(self, sous: str, saturated: bool) -> None:
+        """
+        Adapts how many recipes may cook at once on the sous to how loaded it
+        is, given each new reading of whether it is saturated: whilst it is,
+        the allowance is halved (down to 1); once it isn't, the allowance grows
+        back one at a time until the sous is no longer throttled.
+        """
+        in_flight = self._sous_in_flight[sous]
+        allowance = self._throttled.get(sous)
+        if saturated:
+            if allowance is None:
+                allowance = in_flight
+                self._throttled_from[sous] = in_flight
+            self._throttled[sous] = max(1, min(allowance, in_flight) // 2)
+        elif allowance is not None:
+            if allowance + 1 >= self._throttled_from[sous]:
+                del self._throttled[sous]
+                del self._throttled_from[sous]
+            else:
+                self._throttled[sous] = allowance + 1
+
+    def throttled(self, sous: str) -> Optional[int]:
+        """
+        How many recipes the sous may have in flight whilst it is throttled,
+        or None if it isn't.
+        """
+        return self._throttled.get(sous)
+
+    def _pop_from(self, sous: str) -> Optional[Tuple[float, int, Recipe]]:
+        """
+        Takes the sous' best recipe that can be started.
+        """
+        heap = self._ready[sous]
+        passed_over: List[Tuple[float, int, Recipe]] = []
+        chosen: Optional[Tuple[float, int, Recipe]] = None
+        while heap:
+            entry = heapq.heappop(heap)
+            if self._startable(entry[2]):
+                chosen = entry
+                break
+            passed_over.append(entry)
+
+        for entry in passed_over:
+            heapq.heappush(heap, entry)
+        return chosen
+
+    def pop_startable(
+        self, saturated: Optional[Callable[[str], bool]] = None
+    ) -> Optional[Recipe]:
+        """
+        Takes the next recipe that can be started within the limits, and counts
+        it as in flight. Returns None if there is no such recipe.
+
+        :param saturated: if given, souss for which it returns True are passed
+            over in favour of other souss with startable recipes, if there are
+            any. It is asked at most once per sous.
+        """
+        total = self.limits.total
+        if total is not None and self._in_flight[("total",)] >= total:
+            return None
+
+        chosen: Optional[Recipe] = None
+        # the best recipes of saturated souss that were passed over
+        deferred: List[Recipe] = []
+        for _ in range(len(self._turns)):
+            sous = self._turns[0]
+            # the next sous gets the next turn, whatever happens
+            self._turns.rotate(-1)
+            if self._sous_full(sous):
+                continue
+            entry = self._pop_from(sous)
+            if entry is None:
+                continue
+            recipe = entry[2]
+            if (
+                saturated is not None
+                and self.deferrals[recipe] < self.max_deferrals
+                and saturated(sous)
+            ):
+                heapq.heappush(self._ready[sous], entry)
+                deferred.append(recipe)
+                continue
+            chosen = recipe
+            break
+
+        if chosen is not None:
+            for recipe in deferred:
+                self.deferrals[recipe] += 1
+        elif deferred:
+            # every startable recipe is on a saturated sous; take one anyway
+            entry = self._pop_from(deferred[0].recipe_context.sous)
+            assert entry is not None
+            chosen = entry[2]
+        else:
+            return None
+
+        self.deferrals.pop(chosen, None)
+
+        sous = chosen.recipe_context.sous
+        self._num_ready -= 1
+        if not self._ready[sous]:
+            del self._ready[sous]
+            self._turns.remove(sous)
+
+        for key, _limit in self.limits.limits_for(chosen):
+            self._in_flight[key] += 1
+        self._sous_in_flight[sous] += 1
+        return chosen
+
+    def finished(self, recipe: Recipe) -> None:
+        """
+        Stops counting the recipe as in flight.
+        """
+        for key, _limit in self.limits.limits_for(recipe):
+            self._in_flight[key] -= 1
+        self._sous_in_flight[recipe.recipe_context.sous] -= 1
@@ -16,7 +16,7 @@
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import asyncssh
 from asyncssh import SSHClientConnection, SSHClientConnectionOptions, SSHClientProcess
@@ -45,6 +45,7 @@ async def open_ssh_sous(
     requested_user: str,
     sous_command: str,
     debug_logging: bool = False,
+    telemetry_interval: Optional[float] = None,
 ) -> Tuple[ChanPro, Channel]:
     if client_key:
         opts = SSHClientConnectionOptions(username=user, client_keys=[client_key])
@@ -71,7 +72,11 @@ async def open_ssh_sous(
     cp = AsyncSSHChanPro(conn, process)
     ch = cp.new_channel(number=0, desc="Root channel")
     cp.start_listening_to_channels(default_route=None)
-    await ch.send({"hello": "head"})
+    hello: Dict[str, Any] = {"hello": "head"}
+    if telemetry_interval:
+        # ask the sous to periodically send us its resource usage
+        hello["telemetry_interval"] = telemetry_interval
+    await ch.send(hello)
     logger.debug("Waiting for sous hello from %s[%s]@%s...", user, requested_user, host)
     sous_hello = await ch.recv()
     assert isinstance(sous_hello, dict)
@@ -0,0 +1,120 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from scone.head.recipe import Recipe, recipe_kind
+
+# the process for spans that aren't on any sous
+HEAD_PROCESS = "head"
+
+# (process, thread) that a span is drawn on
+Track = Tuple[str, str]
+
+
+def recipe_track(recipe: Recipe) -> Track:
+    """
+    Each recipe has its own track, within its sous' process.
+    """
+    context = recipe.recipe_context
+    kind = recipe_kind(recipe.__class__)
+    return context.sous, f"{kind} {context.human} ({context.user})"
+
+
+class Tracer:
+    """
+    Records spans of a run as Chrome trace events, which can be viewed in
+    Perfetto or chrome://tracing.
+    Each sous is shown as a process, with a thread for each recipe (and one
+    for its connections); spans on a thread nest by time.
+    """
+
+    def __init__(self):
+        self._origin = time.monotonic()
+        self.events: List[Dict[str, Any]] = []
+        self._pids: Dict[str, int] = dict()
+        self._tids: Dict[Track, int] = dict()
+
+    def _ids(self, track: Track) -> Tuple[int, int]:
+        process, thread = track
+        pid = self._pids.get(process)
+        if pid is None:
+            pid = self._pids[process] = len(self._pids) + 1
+            self._metadata("process_name", pid, 0, process)
+        tid = self._tids.get(track)
+        if tid is None:
+            tid = self._tids[track] = len(self._tids) + 1
+            self._metadata("thread_name", pid, tid, thread)
+        return pid, tid
+
+    def _metadata(self, kind: str, pid: int, tid: int, name: str) -> None:
+        self.events.append(
+            {"name": kind, "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+        )
+
+    def _micros(self, monotonic: float) -> float:
+        return (monotonic - self._origin) * 1e6
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        track: Track,
+        start: float,
+        end: float,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Records a span that has already finished.
+
+        :param start: when the span started, from time.monotonic()
+        :param end: when the span ended, from time.monotonic()
+        """
+        pid, tid = self._ids(track)
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self._micros(start),
+            "dur": max(0.0, (end - start) * 1e6),
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    @contextmanager
+    def span(
+        self, name: str, category: str, track: Track, **args: Any
+    ) -> Iterator[None]:
+        """
+        Records a span lasting as long as the block within.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, category, track, start, time.monotonic(), args)
+
+    def write(self, path: Path) -> None:
+        with open(path, "w") as fout:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fout)
@@ -24,8 +24,9 @@ from scone.sous.utensils import Utensil, utensil_namer
 
 
 class Sous:
-    def __init__(self, ut_loader: ClassLoader[Utensil]):
+    def __init__(self, ut_loader: ClassLoader[Utensil], config: dict):
         self.utensil_loader = ut_loader
+        self.config = config
 
     @staticmethod
     def open(directory: str):
@@ -41,4 +42,4 @@ class Sous:
         for package_root in utensil_module_roots:
             loader.add_package_root(package_root)
 
-        return Sous(loader)
+        return Sous(loader, sous_data)
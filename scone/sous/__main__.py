@@ -21,13 +21,14 @@ import os
 import pwd
 import sys
 from pathlib import Path
-from typing import List, cast
+from typing import List, Optional, cast
 
 import cattr
 
 from scone.common.chanpro import Channel, ChanPro
 from scone.common.pools import Pools
 from scone.sous import Sous, Utensil
+from scone.sous.telemetry import send_telemetry_forever
 from scone.sous.utensils import Worktop
 
 logger = logging.getLogger(__name__)
@@ -65,6 +66,13 @@ async def main(args: List[str]):
     assert isinstance(remote_hello, dict)
     assert remote_hello["hello"] == "head"
 
+    telemetry_interval = remote_hello.get("telemetry_interval")
+    telemetry_task: "Optional[asyncio.Task[None]]" = None
+    if telemetry_interval:
+        telemetry_task = asyncio.create_task(
+            send_telemetry_forever(root, telemetry_interval)
+        )
+
     sous_user = pwd.getpwuid(os.getuid()).pw_name
 
     quasi_pers = Path(args[0], "worktop", sous_user)
@@ -72,35 +80,47 @@ async def main(args: List[str]):
     if not quasi_pers.exists():
         quasi_pers.mkdir(parents=True)
 
-    worktop = Worktop(quasi_pers, Pools())
+    worktop = Worktop(quasi_pers, Pools(), sous.config)
 
     logger.info("Worktop dir is: %s", worktop.dir)
 
-    while True:
-        try:
-            message = await root.recv()
-        except EOFError:
-            break
-        if "nc" in message:
-            # start a new command channel
-            channel_num = message["nc"]
-            command = message["cmd"]
-            payload = message["pay"]
-
-            utensil_class = sous.utensil_loader.get_class(command)
-            utensil = cast(Utensil, cattr.structure(payload, utensil_class))
-
-            channel = cp.new_channel(channel_num, command)
-
-            logger.debug("going to sched task with %r", utensil)
-
-            asyncio.create_task(run_utensil(utensil, channel, worktop))
-        elif "lost" in message:
-            # for a then-non-existent channel, but probably just waiting on us
-            # retry without a default route.
-            await cp.handle_incoming_message(message["lost"])
-        else:
-            raise RuntimeError(f"Unknown ch0 message {message}")
+    try:
+        while True:
+            try:
+                message = await root.recv()
+            except EOFError:
+                break
+            if "nc" in message:
+                # start a new command channel
+                channel_num = message["nc"]
+                command = message["cmd"]
+                payload = message["pay"]
+
+                utensil_class = sous.utensil_loader.get_class(command)
+                utensil = cast(Utensil, cattr.structure(payload, utensil_class))
+
+                channel = cp.new_channel(channel_num, command)
+
+                logger.debug("going to sched task with %r", utensil)
+
+                asyncio.create_task(run_utensil(utensil, channel, worktop))
+            elif "lost" in message:
+                # for a then-non-existent channel, but probably just waiting on us
+                # retry without a default route.
+                await cp.handle_incoming_message(message["lost"])
+            else:
+                raise RuntimeError(f"Unknown ch0 message {message}")
+    finally:
+        if telemetry_task is not None:
+            telemetry_task.cancel()
+            try:
+                await telemetry_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.error("Telemetry failed", exc_info=True)
+
+    await worktop.close()
 
 
 async def run_utensil(utensil: Utensil, channel: Channel, worktop: Worktop):
@@ -0,0 +1,201 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from typing import Optional
+
+from scone.common.hashing import BLAKE2B, new_hasher, tag
+from scone.common.modeutils import DEFAULT_MODE_FILE
+from scone.sous.utensils import Worktop
+
+logger = logging.getLogger(__name__)
+
+# fsync each file (and its directory) before returning
+DURABILITY_FSYNC = "fsync"
+# one syncfs(2) per written filesystem once the head has disconnected;
+# the head does not wait for it, so a crash soon after a run can lose writes.
+DURABILITY_SYNCFS = "syncfs"
+# leave it to the kernel
+DURABILITY_NONE = "none"
+
+DURABILITIES = (DURABILITY_FSYNC, DURABILITY_SYNCFS, DURABILITY_NONE)
+DEFAULT_DURABILITY = DURABILITY_FSYNC
+
+
+def get_durability(worktop: Worktop, requested: Optional[str]) -> str:
+    """
+    Returns the durability to use: the requested one, or else the sous'
+    `write_durability` setting in scone.sous.toml.
+    """
+    durability = requested or worktop.config.get("write_durability", DEFAULT_DURABILITY)
+    if durability not in DURABILITIES:
+        raise ValueError(f"Unknown durability {durability!r}")
+    return durability
+
+
+class AtomicWriter:
+    """
+    Writes a file by writing a temporary file alongside it and renaming it over
+    the target, so that readers never see a partially-written file.
+
+    The content is hashed as it is written; if the target already has the same
+    content, it is left untouched (its mtime is not bumped) and the temporary
+    file is discarded.
+
+    A target with more than one hard link is instead overwritten in place
+    (so not atomically), as replacing it would split it from its other links.
+    """
+
+    def __init__(self, path: str, mode: Optional[int] = None, algorithm: str = BLAKE2B):
+        # write through symlinks, as opening the path would
+        self.path = os.path.realpath(path)
+        self._mode = mode
+        try:
+            self._old_st: Optional[os.stat_result] = os.stat(self.path)
+        except FileNotFoundError:
+            self._old_st = None
+
+        directory, name = os.path.split(self.path)
+        fd, self._temp_path = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+        self._file = open(fd, "w+b")
+        self._algorithm = algorithm
+        self._hasher = new_hasher(algorithm)
+        self._size = 0
+
+        try:
+            if mode is not None:
+                os.fchmod(fd, mode)
+            elif self._old_st is not None:
+                os.fchmod(fd, stat.S_IMODE(self._old_st.st_mode))
+            else:
+                os.fchmod(fd, DEFAULT_MODE_FILE)
+
+            if self._old_st is not None and not self._in_place():
+                # keep the ownership of the file being replaced
+                try:
+                    os.fchown(fd, self._old_st.st_uid, self._old_st.st_gid)
+                except PermissionError:
+                    logger.warning(
+                        "Can't keep the ownership (%d:%d) of %s;"
+                        " it will be owned by the sous' user",
+                        self._old_st.st_uid,
+                        self._old_st.st_gid,
+                        self.path,
+                    )
+        except BaseException:
+            self.abort()
+            raise
+
+    def _in_place(self) -> bool:
+        old_st = self._old_st
+        return (
+            old_st is not None and stat.S_ISREG(old_st.st_mode) and old_st.st_nlink > 1
+        )
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._hasher.update(data)
+        self._size += len(data)
+
+    def digest(self) -> str:
+        """
+        The tagged digest of what has been written so far.
+        """
+        return tag(self._algorithm, self._hasher.hexdigest())
+
+    def _is_unchanged(self, worktop: Worktop) -> bool:
+        old_st = self._old_st
+        if old_st is None or not stat.S_ISREG(old_st.st_mode):
+            return False
+        if old_st.st_size != self._size:
+            return False
+        try:
+            existing = worktop.hash_cache.hash_file(self.path, self._algorithm)
+            return existing == self.digest()
+        except FileNotFoundError:
+            return False
+
+    def commit(self, worktop: Worktop, durability: str) -> bool:
+        """
+        Finishes the write. Blocking; call from a thread pool.
+
+        :return: True if the target was replaced, False if it already had
+            this content.
+        """
+        try:
+            self._file.flush()
+
+            if self._is_unchanged(worktop):
+                self.abort()
+                assert self._old_st is not None
+                if (
+                    self._mode is not None
+                    and stat.S_IMODE(self._old_st.st_mode) != self._mode
+                ):
+                    os.chmod(self.path, self._mode)
+                return False
+
+            if self._in_place():
+                self._overwrite(durability)
+                self.abort()
+                if durability == DURABILITY_SYNCFS:
+                    worktop.request_syncfs(self.path)
+                return True
+
+            if durability == DURABILITY_FSYNC:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            os.rename(self._temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+        if durability == DURABILITY_FSYNC:
+            # make the rename itself durable
+            dir_fd = os.open(os.path.dirname(self.path), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        elif durability == DURABILITY_SYNCFS:
+            worktop.request_syncfs(self.path)
+
+        return True
+
+    def _overwrite(self, durability: str) -> None:
+        """
+        Copies what has been written over the target's existing content.
+        """
+        self._file.seek(0)
+        with open(self.path, "r+b") as target:
+            shutil.copyfileobj(self._file, target)
+            target.truncate()
+            if durability == DURABILITY_FSYNC:
+                os.fsync(target.fileno())
+        if self._mode is not None:
+            os.chmod(self.path, self._mode)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self._temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,214 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from scone.common.hashing import RACY_WINDOW_NS, SHA256, hash_file, untag
+from scone.common.pools import Pools
+
+# (st_dev, st_ino, st_size, st_mtime_ns)
+StatIdentity = Tuple[int, int, int, int]
+
+# Files at least this large are hashed in the process pool; smaller ones are
+# hashed in the thread pool as they are not worth the IPC overhead.
+PROCESS_POOL_THRESHOLD = 1024 * 1024
+
+
+def stat_identity(stat_result: os.stat_result) -> StatIdentity:
+    return (
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+
+
+def _hash_with_identity(path: str, algorithm: str) -> Tuple[str, StatIdentity]:
+    # N.B. top-level so that it can be sent to the process pool.
+    digest = hash_file(path, algorithm)
+    return digest, stat_identity(os.stat(path))
+
+
+class HashCache:
+    """
+    Persistent cache of file digests on the sous, keyed by path and algorithm.
+    Digests are tagged (see scone.common.hashing).
+
+    A cached hash is only used if the file's stat identity
+    (device, inode, size, mtime) is unchanged since it was hashed.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_digests (
+                    path TEXT,
+                    algorithm TEXT,
+                    dev INT,
+                    ino INT,
+                    size INT,
+                    mtime_ns INT,
+                    digest TEXT,
+                    PRIMARY KEY (path, algorithm)
+                )
+                """
+            )
+
+    def lookup(
+        self, path: str, identity: StatIdentity, algorithm: str
+    ) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT dev, ino, size, mtime_ns, digest FROM file_digests"
+                " WHERE path = ? AND algorithm = ?",
+                (path, algorithm),
+            ).fetchone()
+        if row is None or tuple(row[0:4]) != identity:
+            return None
+        return row[4]
+
+    def store(
+        self, path: str, identity: StatIdentity, algorithm: str, digest: str
+    ) -> None:
+        if identity[3] > time.time_ns() - RACY_WINDOW_NS:
+            # too fresh to trust; it may be modified again without the mtime
+            # changing.
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_digests VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, algorithm, *identity, digest),
+            )
+
+    def hash_file(self, path: str, algorithm: str) -> str:
+        """
+        Returns the tagged digest of a file, consulting the cache first.
+        Blocking; call from a thread pool.
+
+        :raises FileNotFoundError: if the file does not exist.
+        """
+        identity = stat_identity(os.stat(path))
+        cached = self.lookup(path, identity, algorithm)
+        if cached is not None:
+            return cached
+
+        digest = hash_file(path, algorithm)
+
+        # only store if the file didn't change under our feet whilst hashing
+        if stat_identity(os.stat(path)) == identity:
+            self.store(path, identity, algorithm, digest)
+
+        return digest
+
+    def sha256_file(self, path: str) -> str:
+        """
+        Returns the (untagged) SHA-256 of a file, consulting the cache first.
+        Blocking; call from a thread pool.
+        """
+        return untag(self.hash_file(path, SHA256))[1]
+
+    def _lookup_many(
+        self, paths: List[str], algorithm: str
+    ) -> Tuple[Dict[str, Optional[str]], Dict[str, StatIdentity]]:
+        """
+        Returns (hashes known without reading, identities of those to hash).
+        Missing or unreadable files are known to have a hash of None.
+        """
+        known: Dict[str, Optional[str]] = {}
+        to_hash: Dict[str, StatIdentity] = {}
+        for path in paths:
+            try:
+                identity = stat_identity(os.stat(path))
+            except OSError:
+                known[path] = None
+                continue
+            cached = self.lookup(path, identity, algorithm)
+            if cached is not None:
+                known[path] = cached
+            else:
+                to_hash[path] = identity
+        return known, to_hash
+
+    async def hash_many(
+        self, paths: List[str], pools: Pools, algorithm: str = SHA256
+    ) -> AsyncGenerator[Tuple[str, Optional[str]], None]:
+        """
+        Hashes many files in parallel, yielding (path, tagged digest) pairs as
+        they complete. The digest is None if the file could not be read.
+        """
+        loop = asyncio.get_running_loop()
+        known, to_hash = await loop.run_in_executor(
+            pools.threaded, self._lookup_many, paths, algorithm
+        )
+
+        for path, digest in known.items():
+            yield path, digest
+
+        futures: Dict[asyncio.Future, str] = {}
+        for path, identity in to_hash.items():
+            executor: Executor
+            if identity[2] >= PROCESS_POOL_THRESHOLD:
+                executor = pools.process
+            else:
+                executor = pools.threaded
+            future = loop.run_in_executor(
+                executor, _hash_with_identity, path, algorithm
+            )
+            futures[future] = path
+
+        try:
+            pending = set(futures.keys())
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    path = futures[future]
+                    try:
+                        digest, identity_after = future.result()
+                    except OSError:
+                        yield path, None
+                        continue
+
+                    # only store if the file didn't change whilst hashing
+                    if identity_after == to_hash[path]:
+                        await loop.run_in_executor(
+                            pools.threaded,
+                            self.store,
+                            path,
+                            identity_after,
+                            algorithm,
+                            digest,
+                        )
+                    yield path, digest
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
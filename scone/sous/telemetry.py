@@ -0,0 +1,200 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import attr
+import cattr
+
+from scone.common.chanpro import Channel
+
+logger = logging.getLogger(__name__)
+
+# whole disks only, not partitions (sda but not sda1, nvme0n1 but not nvme0n1p1)
+_WHOLE_DISK_RE = re.compile(r"^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme\d+n\d+|mmcblk\d+)$")
+_SECTOR_SIZE = 512
+
+
+@attr.s(auto_attribs=True)
+class SousTelemetry:
+    """
+    A sample of the resource usage of the sous' host, read from /proc.
+    Fields are None when unavailable (e.g. no PSI support in the kernel).
+    Rates and fractions are averaged since the previous sample.
+    """
+
+    timestamp: float
+    cpu_count: int
+    # fraction of CPU time not idle
+    cpu_busy: Optional[float] = None
+    # 1, 5 and 15 minute load averages
+    loadavg: Optional[List[float]] = None
+    mem_total_kib: Optional[int] = None
+    mem_available_kib: Optional[int] = None
+    swap_used_kib: Optional[int] = None
+    # pressure stall information: percentage of time stalled over last 10 s
+    psi_cpu_some: Optional[float] = None
+    psi_memory_some: Optional[float] = None
+    psi_memory_full: Optional[float] = None
+    psi_io_some: Optional[float] = None
+    psi_io_full: Optional[float] = None
+    disk_read_bytes_per_s: Optional[float] = None
+    disk_write_bytes_per_s: Optional[float] = None
+    # fraction of time the busiest disk was doing I/O
+    disk_busy: Optional[float] = None
+
+    def load_per_cpu(self) -> Optional[float]:
+        if self.loadavg is None:
+            return None
+        return self.loadavg[0] / max(self.cpu_count, 1)
+
+
+def _read_proc(name: str) -> Optional[str]:
+    try:
+        with open(os.path.join("/proc", name)) as fin:
+            return fin.read()
+    except OSError:
+        return None
+
+
+def _read_psi(resource: str) -> Dict[str, float]:
+    """
+    :return: dict of 'some' and/or 'full' to their avg10 percentages.
+    """
+    text = _read_proc(f"pressure/{resource}")
+    result: Dict[str, float] = {}
+    if text is None:
+        return result
+    for line in text.splitlines():
+        kind, *fields = line.split()
+        for field in fields:
+            key, _, value = field.partition("=")
+            if key == "avg10":
+                result[kind] = float(value)
+    return result
+
+
+class TelemetrySampler:
+    def __init__(self):
+        self._last_cpu: Optional[Tuple[int, int]] = None
+        self._last_disk: Optional[Tuple[float, int, int, Dict[str, int]]] = None
+
+    def _sample_cpu(self, telemetry: SousTelemetry) -> None:
+        text = _read_proc("stat")
+        if text is None:
+            return
+        # cpu  user nice system idle iowait irq softirq steal ...
+        fields = [int(x) for x in text.splitlines()[0].split()[1:]]
+        total = sum(fields[0:8])
+        idle = fields[3] + fields[4]
+        if self._last_cpu is not None:
+            last_total, last_idle = self._last_cpu
+            if total > last_total:
+                telemetry.cpu_busy = 1.0 - (idle - last_idle) / (total - last_total)
+        self._last_cpu = (total, idle)
+
+    @staticmethod
+    def _sample_memory(telemetry: SousTelemetry) -> None:
+        text = _read_proc("meminfo")
+        if text is None:
+            return
+        meminfo: Dict[str, int] = {}
+        for line in text.splitlines():
+            key, _, value = line.partition(":")
+            meminfo[key] = int(value.split()[0])
+        telemetry.mem_total_kib = meminfo.get("MemTotal")
+        telemetry.mem_available_kib = meminfo.get("MemAvailable")
+        if "SwapTotal" in meminfo and "SwapFree" in meminfo:
+            telemetry.swap_used_kib = meminfo["SwapTotal"] - meminfo["SwapFree"]
+
+    def _sample_disks(self, telemetry: SousTelemetry) -> None:
+        text = _read_proc("diskstats")
+        if text is None:
+            return
+        now = time.monotonic()
+        sectors_read = 0
+        sectors_written = 0
+        io_ticks: Dict[str, int] = {}
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) < 13 or not _WHOLE_DISK_RE.match(fields[2]):
+                continue
+            sectors_read += int(fields[5])
+            sectors_written += int(fields[9])
+            io_ticks[fields[2]] = int(fields[12])
+
+        if self._last_disk is not None:
+            last_time, last_read, last_written, last_ticks = self._last_disk
+            elapsed = now - last_time
+            if elapsed > 0:
+                telemetry.disk_read_bytes_per_s = (
+                    (sectors_read - last_read) * _SECTOR_SIZE / elapsed
+                )
+                telemetry.disk_write_bytes_per_s = (
+                    (sectors_written - last_written) * _SECTOR_SIZE / elapsed
+                )
+                busy = [
+                    (ticks - last_ticks[disk]) / (elapsed * 1000.0)
+                    for disk, ticks in io_ticks.items()
+                    if disk in last_ticks
+                ]
+                if busy:
+                    telemetry.disk_busy = min(max(busy), 1.0)
+
+        self._last_disk = (now, sectors_read, sectors_written, io_ticks)
+
+    def sample(self) -> SousTelemetry:
+        telemetry = SousTelemetry(timestamp=time.time(), cpu_count=os.cpu_count() or 1)
+
+        self._sample_cpu(telemetry)
+        self._sample_memory(telemetry)
+        self._sample_disks(telemetry)
+
+        loadavg = _read_proc("loadavg")
+        if loadavg is not None:
+            telemetry.loadavg = [float(x) for x in loadavg.split()[0:3]]
+
+        psi_cpu = _read_psi("cpu")
+        telemetry.psi_cpu_some = psi_cpu.get("some")
+        psi_memory = _read_psi("memory")
+        telemetry.psi_memory_some = psi_memory.get("some")
+        telemetry.psi_memory_full = psi_memory.get("full")
+        psi_io = _read_psi("io")
+        telemetry.psi_io_some = psi_io.get("some")
+        telemetry.psi_io_full = psi_io.get("full")
+
+        return telemetry
+
+
+async def send_telemetry_forever(root: Channel, interval: float) -> None:
+    """
+    Periodically sends telemetry samples to the head on the root channel.
+    """
+    sampler = TelemetrySampler()
+    while True:
+        try:
+            sample = sampler.sample()
+        except Exception:
+            logger.warning("Failed to sample telemetry", exc_info=True)
+        else:
+            await root.send({"telemetry": cattr.unstructure(sample)})
+        await asyncio.sleep(interval)
@@ -15,20 +15,87 @@
 #  You should have received a copy of the GNU General Public License
 #  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
 
+import ctypes
+import logging
+import os
 from pathlib import Path
-from typing import Type, TypeVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, TypeVar
 
 from scone.common.chanpro import Channel
 from scone.common.pools import Pools
+from scone.sous.hash_cache import HashCache
 
 T = TypeVar("T")
 
+logger = logging.getLogger(__name__)
+
+
+def _syncfs(path: str) -> None:
+    """
+    Flushes the filesystem containing path to disk,
+    or all filesystems if syncfs(2) is not available.
+    """
+    try:
+        libc_syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        os.sync()
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if libc_syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+    finally:
+        os.close(fd)
+
 
 class Worktop:
-    def __init__(self, dir: Path, pools: Pools):
+    def __init__(self, dir: Path, pools: Pools, config: Optional[dict] = None):
         # mostly-persistent worktop space for utensils
         self.dir = dir
         self.pools = pools
+        self.hash_cache = HashCache(Path(dir, "hash_cache.db"))
+        # the contents of scone.sous.toml
+        self.config = config or dict()
+        # device number → a path on each filesystem awaiting a syncfs
+        self._syncfs_pending: Dict[int, str] = dict()
+        # long-lived objects shared between utensils (e.g. connection pools),
+        # keyed by a name chosen by the utensil
+        self.shared: Dict[str, Any] = dict()
+        self._closers: List[Callable[[], Awaitable[None]]] = []
+
+    def on_close(self, closer: Callable[[], Awaitable[None]]) -> None:
+        """
+        Registers a coroutine function to be called when the sous finishes,
+        e.g. to close something in `shared`.
+        """
+        self._closers.append(closer)
+
+    def request_syncfs(self, path: str) -> None:
+        """
+        Requests that the filesystem containing path be synced to disk when the
+        sous finishes, rather than fsyncing every file individually.
+        """
+        directory = os.path.dirname(path) or "."
+        self._syncfs_pending.setdefault(os.stat(directory).st_dev, directory)
+
+    def sync_pending(self) -> None:
+        while self._syncfs_pending:
+            _dev, path = self._syncfs_pending.popitem()
+            try:
+                _syncfs(path)
+            except OSError:
+                logger.error("Failed to syncfs %s", path, exc_info=True)
+
+    async def close(self) -> None:
+        for closer in reversed(self._closers):
+            try:
+                await closer()
+            except Exception:
+                logger.error("Failed to close worktop resource", exc_info=True)
+        self.sync_pending()
+        self.hash_cache.close()
 
 
 class Utensil:
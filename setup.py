@@ -55,7 +55,10 @@ EXTRAS = {
     "sous-core": EX_SOUS_BASE,
     "sous-pg": EX_SOUS_PG,
 
-    "docker": ["docker"]  # TODO do this more properly if we can...
+    "docker": ["docker"],  # TODO do this more properly if we can...
+
+    # faster change detection; needed on both the head and the sous
+    "xxhash": ["xxhash"]
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -0,0 +1,120 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+from typing import List, cast
+from unittest import TestCase
+
+from scone.head.dag import RecipeDag, Resource
+from scone.head.head import Head
+from scone.head.kitchen import Preparation
+from scone.head.recipe import Recipe, RecipeContext, coalesced_context
+from scone.head.scheduling import critical_path_lengths
+
+
+class Coalescible(Recipe):
+    _COALESCIBLE = True
+
+    @classmethod
+    def coalesce(cls, recipes: List[Recipe], head) -> Recipe:
+        return cls(coalesced_context(recipes), {}, head)
+
+
+def make_recipe(human: str, cls=Coalescible) -> Recipe:
+    return cls(RecipeContext("sous", "user", None, None, human), {}, None)
+
+
+def resource(name: str) -> Resource:
+    return Resource("thing", name, "sous")
+
+
+class MergeTestCase(TestCase):
+    def setUp(self):
+        self.dag = RecipeDag()
+        self.prep = Preparation(cast(Head, SimpleNamespace(dag=self.dag)))
+
+    def add(self, human: str, needs=(), provides=()) -> Recipe:
+        recipe = make_recipe(human)
+        self.dag.add(recipe)
+        for name in needs:
+            self.dag.needs(recipe, resource(name))
+        for name in provides:
+            self.dag.provides(recipe, resource(name))
+        return recipe
+
+    def assert_acyclic(self):
+        # raises if there is a cycle
+        critical_path_lengths(self.dag, lambda recipe: 1.0)
+
+    def test_merge_takes_union_of_edges(self):
+        a = self.add("a", needs=["x"], provides=["y"])
+        b = self.add("b", needs=["z"], provides=["w"])
+        merged = make_recipe("merged")
+        self.dag.merge([a, b], merged)
+
+        self.assertNotIn(a, self.dag.vertices)
+        self.assertNotIn(b, self.dag.vertices)
+        self.assertEqual(self.dag.reverse_edges[merged], {resource("x"), resource("z")})
+        self.assertEqual(self.dag.edges[merged], {resource("y"), resource("w")})
+        self.assertEqual(self.dag.recipe_meta[merged].incoming_uncompleted, 2)
+        self.assert_acyclic()
+
+    def test_coalesce_all_merges_independent_recipes(self):
+        self.add("a", needs=["x"])
+        self.add("b", needs=["x"])
+        self.add("c", needs=["x"])
+        self.prep.coalesce_all()
+
+        recipes = list(self.dag.recipe_meta)
+        self.assertEqual(len(recipes), 1)
+        self.assertEqual(self.dag.reverse_edges[recipes[0]], {resource("x")})
+        self.assert_acyclic()
+
+    def test_coalesce_all_keeps_dependent_recipes_apart(self):
+        # a → y → b → z → c: a and c can't be merged, nor either with b
+        self.add("a", provides=["y"])
+        self.add("b", needs=["y"], provides=["z"])
+        self.add("c", needs=["z"])
+        self.prep.coalesce_all()
+
+        self.assertEqual(len(self.dag.recipe_meta), 3)
+        self.assert_acyclic()
+
+    def test_coalesce_all_merges_around_dependencies(self):
+        # a → y → b; c is independent of both, so joins a's cluster
+        a = self.add("a", provides=["y"])
+        b = self.add("b", needs=["y"])
+        self.add("c", needs=["x"])
+        self.prep.coalesce_all()
+
+        self.assertEqual(len(self.dag.recipe_meta), 2)
+        self.assertNotIn(a, self.dag.vertices)
+        self.assertIn(b, self.dag.vertices)
+        self.assert_acyclic()
+
+    def test_only_coalescible_recipes_merge(self):
+        for human in ("a", "b"):
+            self.dag.add(make_recipe(human, cls=Recipe))
+        self.prep.coalesce_all()
+
+        self.assertEqual(len(self.dag.recipe_meta), 2)
+
+    def test_cycle_is_detected(self):
+        self.add("a", needs=["x"], provides=["y"])
+        self.add("b", needs=["y"], provides=["x"])
+        with self.assertRaises(RuntimeError):
+            self.assert_acyclic()
@@ -0,0 +1,99 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import random
+from typing import List
+from unittest import TestCase
+
+from scone.common.delta import (
+    MAX_LITERAL_CHUNK,
+    DeltaInstruction,
+    compute_delta,
+    compute_signatures,
+    literal_delta,
+)
+
+BLOCK_SIZE = 2048
+
+
+def apply_delta(old: bytes, delta: List[DeltaInstruction], block_size: int) -> bytes:
+    """
+    Reconstructs the new file as the receiver would.
+    """
+    result = bytearray()
+    for instruction in delta:
+        if isinstance(instruction, bytes):
+            result += instruction
+        else:
+            first, count = instruction
+            result += old[first * block_size : (first + count) * block_size]
+    return bytes(result)
+
+
+def round_trip(old: bytes, new: bytes) -> List[DeltaInstruction]:
+    signatures = compute_signatures(io.BytesIO(old), BLOCK_SIZE)
+    delta = compute_delta(new, signatures)
+    assert delta is not None
+    assert apply_delta(old, delta, BLOCK_SIZE) == new
+    return delta
+
+
+def literal_size(delta: List[DeltaInstruction]) -> int:
+    return sum(len(ins) for ins in delta if isinstance(ins, bytes))
+
+
+class DeltaTestCase(TestCase):
+    def setUp(self):
+        self.random = random.Random(42)
+        self.old = bytes(self.random.getrandbits(8) for _ in range(20 * BLOCK_SIZE))
+
+    def test_identical(self):
+        delta = round_trip(self.old, self.old)
+        # one run covering every block
+        self.assertEqual(delta, [[0, 20]])
+
+    def test_insertion(self):
+        new = self.old[:5000] + b"inserted" + self.old[5000:]
+        delta = round_trip(self.old, new)
+        # only the block around the insertion needs to be sent
+        self.assertLess(literal_size(delta), 2 * BLOCK_SIZE)
+
+    def test_deletion_and_trailing_partial_block(self):
+        new = self.old[: 3 * BLOCK_SIZE] + self.old[4 * BLOCK_SIZE + 17 :]
+        delta = round_trip(self.old, new)
+        self.assertLess(literal_size(delta), 2 * BLOCK_SIZE)
+
+    def test_unrelated(self):
+        new = bytes(self.random.getrandbits(8) for _ in range(3 * BLOCK_SIZE + 5))
+        delta = round_trip(self.old, new)
+        self.assertEqual(literal_size(delta), len(new))
+
+    def test_no_old_blocks(self):
+        round_trip(b"", b"hello")
+        round_trip(self.old, b"")
+
+    def test_max_literal(self):
+        new = bytes(self.random.getrandbits(8) for _ in range(3 * BLOCK_SIZE))
+        signatures = compute_signatures(io.BytesIO(self.old), BLOCK_SIZE)
+        self.assertIsNone(compute_delta(new, signatures, max_literal=BLOCK_SIZE))
+
+    def test_literal_delta(self):
+        data = b"x" * (MAX_LITERAL_CHUNK + 10)
+        delta = literal_delta(data)
+        self.assertEqual([len(ins) for ins in delta], [MAX_LITERAL_CHUNK, 10])
+        self.assertEqual(apply_delta(b"", delta, BLOCK_SIZE), data)
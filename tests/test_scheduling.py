@@ -0,0 +1,179 @@
+#  Copyright 2020, Olivier 'reivilibre'.
+#
+#  This file is part of Scone.
+#
+#  Scone is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Scone is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Scone.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Dict, List, Optional
+from unittest import TestCase
+
+from scone.head.recipe import Recipe, RecipeContext
+from scone.head.scheduling import ConcurrencyLimits, ReadyQueue
+
+
+class Install(Recipe):
+    _NAME = "install"
+
+
+class Other(Recipe):
+    _NAME = "other"
+
+
+def make_recipe(sous: str, human: str, user: str = "user", cls=Other) -> Recipe:
+    return cls(RecipeContext(sous, user, None, None, human), {}, None)
+
+
+def unlimited() -> ConcurrencyLimits:
+    return ConcurrencyLimits(total=None, per_sous=None)
+
+
+def drain(queue: ReadyQueue) -> List[str]:
+    """
+    Pops everything startable, without finishing any of it.
+    """
+    popped: List[str] = []
+    while True:
+        recipe = queue.pop_startable()
+        if recipe is None:
+            return popped
+        popped.append(recipe.recipe_context.human)
+
+
+class ReadyQueueOrderingTestCase(TestCase):
+    def test_priority_then_fifo(self):
+        recipes = [make_recipe("s", name) for name in "abcd"]
+        priorities: Dict[Recipe, float] = {recipes[1]: 5.0, recipes[3]: 5.0}
+        queue = ReadyQueue(unlimited(), priorities)
+        for recipe in recipes:
+            queue.push(recipe)
+
+        self.assertEqual(drain(queue), ["b", "d", "a", "c"])
+        self.assertEqual(len(queue), 0)
+
+    def test_souss_take_turns(self):
+        queue = ReadyQueue(unlimited())
+        for name in ("a1", "a2", "a3"):
+            queue.push(make_recipe("a", name))
+        for name in ("b1", "b2"):
+            queue.push(make_recipe("b", name))
+
+        self.assertEqual(drain(queue), ["a1", "b1", "a2", "b2", "a3"])
+
+
+class ReadyQueueLimitsTestCase(TestCase):
+    def test_total_limit(self):
+        queue = ReadyQueue(ConcurrencyLimits(total=2, per_sous=None))
+        recipes = [make_recipe(sous, sous) for sous in "abc"]
+        for recipe in recipes:
+            queue.push(recipe)
+
+        self.assertEqual(drain(queue), ["a", "b"])
+        queue.finished(recipes[0])
+        self.assertEqual(drain(queue), ["c"])
+
+    def test_per_sous_limit_lets_other_souss_go(self):
+        queue = ReadyQueue(ConcurrencyLimits(total=None, per_sous=1))
+        a1, a2, b1 = (
+            make_recipe("a", "a1"),
+            make_recipe("a", "a2"),
+            make_recipe("b", "b1"),
+        )
+        for recipe in (a1, a2, b1):
+            queue.push(recipe)
+
+        self.assertEqual(drain(queue), ["a1", "b1"])
+        queue.finished(a1)
+        self.assertEqual(drain(queue), ["a2"])
+
+    def test_per_kind_limit_skips_to_startable_recipe(self):
+        limits = unlimited()
+        limits.set_kind_limit("install", 1)
+        queue = ReadyQueue(limits)
+        first = make_recipe("s", "i1", cls=Install)
+        queue.push(first)
+        queue.push(make_recipe("s", "i2", cls=Install))
+        queue.push(make_recipe("s", "o1"))
+
+        # i2 is held back, but doesn't hold up o1
+        self.assertEqual(drain(queue), ["i1", "o1"])
+        self.assertEqual(len(queue), 1)
+        queue.finished(first)
+        self.assertEqual(drain(queue), ["i2"])
+
+    def test_per_sous_user_limit(self):
+        limits = unlimited()
+        limits.per_sous_user = 1
+        queue = ReadyQueue(limits)
+        for name, user in (("r1", "root"), ("r2", "root"), ("u1", "user")):
+            queue.push(make_recipe("s", name, user=user))
+
+        self.assertEqual(drain(queue), ["r1", "u1"])
+
+
+class ReadyQueueSaturationTestCase(TestCase):
+    def setUp(self):
+        self.queue = ReadyQueue(unlimited(), max_deferrals=1)
+        self.asked: List[str] = []
+
+    def saturated(self, sous: str) -> bool:
+        self.asked.append(sous)
+        return sous == "a"
+
+    def pop(self) -> Optional[str]:
+        recipe = self.queue.pop_startable(self.saturated)
+        return None if recipe is None else recipe.recipe_context.human
+
+    def test_saturated_sous_is_passed_over(self):
+        for sous in "ab":
+            self.queue.push(make_recipe(sous, sous))
+
+        self.assertEqual(self.pop(), "b")
+        # asked once per sous
+        self.assertEqual(self.asked, ["a", "b"])
+        # a's recipe has used up its deferrals
+        self.assertEqual(self.pop(), "a")
+        self.assertEqual(self.asked, ["a", "b"])
+
+    def test_saturated_sous_goes_when_alone(self):
+        self.queue.push(make_recipe("a", "a"))
+
+        self.assertEqual(self.pop(), "a")
+        self.assertEqual(dict(self.queue.deferrals), {})
+
+    def test_throttling(self):
+        recipes = [make_recipe("a", str(i)) for i in range(10)]
+        for recipe in recipes:
+            self.queue.push(recipe)
+        self.assertEqual(len(drain(self.queue)), 10)
+        for recipe in recipes[:2]:
+            self.queue.finished(recipe)
+        self.queue.push(make_recipe("a", "late"))
+
+        self.queue.throttle("a", True)
+        self.assertEqual(self.queue.throttled("a"), 4)
+        self.queue.throttle("a", True)
+        self.assertEqual(self.queue.throttled("a"), 2)
+        self.assertIsNone(self.queue.pop_startable())
+
+        for recipe in recipes[2:]:
+            self.queue.finished(recipe)
+        self.assertEqual(drain(self.queue), ["late"])
+
+        # grows back by one per unsaturated reading, up to the 8 in flight
+        # when throttling began
+        for expected in range(3, 8):
+            self.queue.throttle("a", False)
+            self.assertEqual(self.queue.throttled("a"), expected)
+        self.queue.throttle("a", False)
+        self.assertIsNone(self.queue.throttled("a"))